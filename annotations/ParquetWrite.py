@@ -1,14 +1,39 @@
+import copy
+import datetime
+import hashlib
+import itertools
+import json
 import logging
+import mmap
+import multiprocessing
 import os
+import queue
+import shutil
+import tempfile
 import traceback
-
-import pandas as pd
-from dateutil import parser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from parquet_write_automation.cloud.scripts.main.cloud_factory import CloudFactory
+from parquet_write_automation.cloud.scripts.main.local_storage import LocalStorage
 from parquet_write_automation.datastore.scripts.main.db import Db
+from parquet_write_automation.parquet_write.scripts.main.csv_reader import NativeCsvReader
+from parquet_write_automation.parquet_write.scripts.main.dataset_writer import PartitionedDatasetWriter
+from parquet_write_automation.parquet_write.scripts.main.excel_writer import StreamingExcelWriter
+from parquet_write_automation.parquet_write.scripts.main.report_schema import ReportSchema
+from parquet_write_automation.parquet_write.scripts.main.report_splitter import find_record_ranges
+from parquet_write_automation.parquet_write.scripts.main.stage_metrics import StageMetrics
+from parquet_write_automation.parquet_write.scripts.main.writer_profile import ParquetWriterProfile, \
+    choose_profile, get_writer_profile
 from parquet_write_automation.exception.scripts.main.exceptions import StorageInvalidCredential, StorageNotReachable, \
     StorageFileNotFound, ReportInvalidSchema, DataCountMismatch, InvalidJobConfig
+from parquet_write_automation.common.scripts.main.lazy_import import lazy_import
+
+# imported on first use, short lived task processes which never convert do not pay for them
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+pa = lazy_import('pyarrow')
+ipc = lazy_import('pyarrow.ipc')
+pq = lazy_import('pyarrow.parquet')
 
 
 class ParquetWrite:
@@ -16,77 +41,1503 @@ class ParquetWrite:
     logger.setLevel(logging.INFO)
     handler = logging.StreamHandler()
     logger.addHandler(handler)
+    default_batch_size = 100000
+    # parser of the reports, native (multi threaded pyarrow parser, see NativeCsvReader) or python (pd.read_csv with
+    # engine='python', the fallback for delimiters meant as regular expression)
+    parser_engine = 'native'
+    # chunk size of streamed gcs reads and resumable uploads, has to be a multiple of 256 KB
+    stream_chunk_size = 8 * 1024 * 1024
+    # bytes of the memory mapped report scanned at a time by the pre-flight validation
+    preflight_chunk_size = 64 * 1024 * 1024
+    # object written next to a partitioned dataset once all of its files are uploaded
+    dataset_manifest_name = '_SUCCESS'
+    dataset_upload_workers = 8
+    # part files downloaded at the same time when the part files are converted without merging them first
+    part_download_workers = 8
+    # parsed batches waiting for every writer of a multi format conversion, bounds the memory of a slow writer
+    fan_out_queue_size = 2
+    # byte ranges per worker of a parallel conversion, more ranges than workers keep every worker busy when some
+    # ranges parse slower than others
+    parallel_splits_per_worker = 4
+    # byte ranges of a parallel conversion are not made smaller than this, smaller reports are split less
+    parallel_min_split_bytes = 32 * 1024 * 1024
+    # rows of the report the auto writer profile is benchmarked on
+    profile_sample_rows = 50000
+
+    def __init__(self, storage_backend:str='gcs'):
+        """
+        No client is created here, the storage and datastore clients are created on first access so a task which
+        ends early never pays for them
+
+        :param storage_backend: name of the CloudFactory backend holding the reports, ex - gcs or local.
+                                Task entities are always kept in datastore
+        """
+        self.storage_backend = storage_backend
+        # the storage backend, kept under its historical name
+        self.gcs = CloudFactory.get_cloud_storage(storage_backend)
+        self.db = Db()
+        # objects notified around every stage of a run of this instance, see StageMetrics
+        self.metrics_hooks = []
+        self.stage_metrics = StageMetrics(self.metrics_hooks)
+        self._datastore_client = None
 
-    def __init__(self):
+    @property
+    def datastore_client(self)->'google.cloud.datastore.Client':
+        """
+        shared datastore client, created on first access
+        :return: datastore client
+        """
+        if self._datastore_client is None:
+            self._datastore_client = self.create_client(
+                lambda: CloudFactory.get_cloud_storage('gcs').gcs_data_store_client())
+        return self._datastore_client
+
+    @datastore_client.setter
+    def datastore_client(self, client:'google.cloud.datastore.Client'):
+        self._datastore_client = client
+
+    @property
+    def storage_client(self)->'google.cloud.storage.Client':
+        """
+        client of the storage backend, created by the backend on first access
+        :return: storage client
+        """
+        return self.create_client(lambda: self.gcs.client)
+
+    @property
+    def upload_client(self)->'google.cloud.storage.Client':
+        """
+        a single shared client, its connection pool serves downloads and uploads
+        :return: storage client
+        """
+        return self.storage_client
+
+    @staticmethod
+    def create_client(create:'callable'):
+        """
+        This method creates a client, failures are raised as StorageInvalidCredential like before clients were
+        created lazily
+
+        :param create: function returning the client
+        :return: client
+        """
         try:
-            self.gcs = CloudFactory.get_cloud_storage('gcs')
-            self.datastore_client = self.gcs.gcs_data_store_client()
-            self.storage_client = self.gcs.gcs_auth_client()
-            self.upload_client = self.gcs.gcs_auth_client()
-            self.db = Db()
+            return create()
         except Exception:
             ex = StorageInvalidCredential("Invalid credentials")
             logging.exception(ex)
             raise ex
 
-    def get_blob_for_merged_report(self, input_bucket_name:str, input_path:str, input_file_name:str)->str:
+    def add_metrics_hook(self, hook):
+        """
+        This method attaches a hook to the stage metrics of every run of this instance, ex - a profiler
+
+        :param hook: object with the optional methods stage_started(stage) and stage_finished(stage, record)
+        :return: None
+        """
+        self.metrics_hooks.append(hook)
+        self.stage_metrics.hooks.append(hook)
+
+    def worker_settings(self)->dict:
+        """
+        This method describes this instance for the conversion processes, which are spawned and build their own
+        ParquetWrite with from_worker_settings: the storage backend, the root of an overridden LocalStorage, the
+        parser engine and the settings of the blob cache and the config cache. The datastore client is not passed,
+        conversions never use it. Metrics hooks and any other overridden storage object can not be rebuilt in
+        another process, None is returned for them and the conversions run in this process instead
+
+        :return: picklable dict, None if the conversions have to run in this process
+        """
+        if self.metrics_hooks:
+            return None
+        if self.gcs is CloudFactory.get_cloud_storage(self.storage_backend):
+            storage_root = None
+        elif type(self.gcs) is LocalStorage:
+            storage_root = self.gcs.client.root
+        else:
+            return None
+        blob_cache = self.gcs.blob_cache
+        config_cache = self.db.config_cache
+        return {'storage_backend': self.storage_backend, 'storage_root': storage_root,
+                'parser_engine': self.parser_engine,
+                'blob_cache': None if blob_cache is None else (blob_cache.cache_dir, blob_cache.max_bytes),
+                'config_cache': None if config_cache is None else (config_cache.ttl, config_cache.max_entries,
+                                                                   config_cache.disk_path)}
+
+    @classmethod
+    def from_worker_settings(cls, settings:dict)->'ParquetWrite':
+        """
+        This method builds the ParquetWrite of a conversion process from the worker_settings of the instance which
+        started it. The caches are process wide, they are enabled once per process
+
+        :param settings: result of worker_settings
+        :return: ParquetWrite
+        """
+        parquet_write = cls(settings['storage_backend'])
+        if settings['storage_root'] is not None:
+            parquet_write.gcs = LocalStorage(settings['storage_root'])
+        parquet_write.parser_engine = settings['parser_engine']
+        if settings['blob_cache'] is not None and parquet_write.gcs.blob_cache is None:
+            type(parquet_write.gcs).enable_blob_cache(*settings['blob_cache'])
+        if settings['config_cache'] is not None and Db.config_cache is None:
+            Db.enable_config_cache(*settings['config_cache'])
+        return parquet_write
+
+    def conversion_executor(self, max_workers:int=None)->tuple:
+        """
+        This method returns the executor running the conversions of many reports and the worker passed to
+        convert_merged_report_job and convert_downloaded_report_job: a pool of spawned processes with the
+        worker_settings of this instance, or a single thread of this process with the instance itself when
+        worker_settings is None
+
+        :param max_workers: processes of the pool, defaults to the number of cpus
+        :return: executor and worker
         """
+        settings = self.worker_settings()
+        if settings is None:
+            logging.info("converting in this process, the metrics hooks or the storage of this instance can not be "
+                         "passed to conversion processes")
+            return ThreadPoolExecutor(max_workers=1), self
+        context = multiprocessing.get_context('spawn')
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=context), settings
+
+    def job_worker(self, parser_engine:str=None)->'ParquetWrite':
+        """
+        This method returns a copy of this instance for a single conversion, sharing its clients and metrics hooks
+        but with stage metrics of its own
+
+        :param parser_engine: parser of the report, defaults to the parser_engine of this instance
+        :return: ParquetWrite
+        """
+        parquet_write = copy.copy(self)
+        parquet_write.stage_metrics = StageMetrics(self.metrics_hooks)
+        parquet_write.parser_engine = parser_engine or self.parser_engine
+        return parquet_write
+
+    def get_blob_for_merged_report(self, input_bucket_name:str, input_path:str, input_file_name:str,
+                                   generation:int=None)->str:
+        """
+        This method downloads the merged report, through the blob cache of Gcs if it is enabled
 
         :param input_bucket_name: input bucket name
         :param input_path: input gcs path
         :param input_file_name: input file name
+        :param generation: if given, the download fails unless the blob still has this generation, so the
+                           generation recorded for a conversion is the one which was converted
         :return: downloaded local file path
         """
         try:
             input_bucket = self.storage_client.bucket(input_bucket_name)
             logging.info(input_path)
             input_blob_file_name = input_bucket.blob(input_path)
-            input_blob_file_name.download_to_filename(input_file_name)
+            with self.stage_metrics.stage('download') as counts:
+                if self.gcs.blob_cache is not None:
+                    self.gcs.blob_cache.fetch(input_blob_file_name, input_file_name, generation)
+                else:
+                    input_blob_file_name.download_to_filename(input_file_name, if_generation_match=generation)
+                counts['bytes'] = os.path.getsize(input_file_name)
             return input_file_name
         except Exception as e:
             logging.exception("exception occur in creating blob for merged report:-  {}".format(traceback.format_exc()))
             raise e
 
+    def open_merged_report(self, input_bucket_name:str, input_path:str, generation:int=None)->'readable stream':
+        """
+        This method opens the merged report as a stream, without downloading it
+
+        :param input_bucket_name: input bucket name
+        :param input_path: input gcs path
+        :param generation: if given, reading fails unless the blob still has this generation
+        :return: binary stream of the report
+        """
+        pin = {'if_generation_match': generation} if generation is not None else {}
+        return self.storage_client.bucket(input_bucket_name).blob(input_path).open('rb',
+                                                                                  chunk_size=self.stream_chunk_size,
+                                                                                  **pin)
+
     def put_parquet_file_to_gcs(self, input_file_name:str, column_name_for_report:list, column_data_type_for_report:'dataframe schema',
-                                output_format:'parquet/csv/excel', output_file_name:str, output_file_path:str, output_bucket:str, delimiter'/,*,&,@ etc')->int:
+                                output_format:'parquet/csv/excel', output_file_name:str, output_file_path:str, output_bucket:str,
+                                delimiter:'/,*,&,@ etc', batch_size:int=None,
+                                writer_profile:ParquetWriterProfile=None)->int:
         """
 
         :param input_file_name: input file name in local file system
         :param column_name_for_report: list of columns for data frame
-        :param column_data_type_for_report:schema of data frame
+        :param column_data_type_for_report:schema of data frame, see ReportSchema for the supported types
         :param output_format: output format of file
         :param output_file_name: output file name
         :param output_file_path: output file path
         :param output_bucket: output bucket name
+        :param delimiter: delimiter of data frame
+        :param batch_size: if given, the report is converted batch_size rows at a time instead of being
+                           loaded as a single data frame
+        :param writer_profile: parquet writer settings, defaults to ParquetWriterProfile()
         :return: number of rows
         """
-        df = pd.read_csv(input_file_name, sep=delimiter, names=column_name_for_report,
-                         dtype=column_data_type_for_report, engine='python')
-        total_row = df.shape[0]
+        total_row = self.write_report_to_file(input_file_name, column_name_for_report, column_data_type_for_report,
+                                              output_format, output_file_name, delimiter, batch_size, writer_profile)
+        logging.info(output_file_path)
+        # large outputs are uploaded as parallel composite upload by Gcs.upload_file
+        with self.stage_metrics.stage('upload', bytes_=os.path.getsize(output_file_name)):
+            self.gcs.upload_file(output_file_name, output_bucket, output_file_path)
+        return total_row
 
-        if output_format == 'parquet':
-            df.to_parquet(output_file_name, engine='pyarrow', compression='snappy',
-                          allow_truncated_timestamps=True)
-        elif output_format == 'csv':
-            df.to_csv(output_file_name, index=False)
-        elif output_format == 'excel':
-            df.to_excel(output_file_name, index=False)
+    def write_report_to_file(self, input_file_name:str, column_name_for_report:list,
+                             column_data_type_for_report:'dataframe schema', output_format:'parquet/csv/excel',
+                             output_file_name:str, delimiter:'/,*,&,@ etc', batch_size:int=None,
+                             writer_profile:ParquetWriterProfile=None)->int:
+        """
+        This method converts the local report into the local output file, without uploading it
+
+        :param input_file_name: input file name in local file system
+        :param column_name_for_report: list of columns for data frame
+        :param column_data_type_for_report:schema of data frame, see ReportSchema for the supported types
+        :param output_format: output format of file
+        :param output_file_name: output file name in local file system
+        :param delimiter: delimiter of data frame
+        :param batch_size: if given, the report is converted batch_size rows at a time
+        :param writer_profile: parquet writer settings, defaults to ParquetWriterProfile()
+        :return: number of rows
+        """
+        writer_profile = get_writer_profile(writer_profile)
+        if output_format == 'excel' and not batch_size:
+            # excel is always written by the constant memory writer of write_report_in_batches
+            batch_size = self.default_batch_size
+        if batch_size:
+            with open(output_file_name, 'wb') as output_stream:
+                total_row = self.write_report_in_batches(input_file_name, column_name_for_report,
+                                                         column_data_type_for_report, output_format,
+                                                         output_stream, delimiter, batch_size, writer_profile)
         else:
+            report_schema = ReportSchema(column_name_for_report, column_data_type_for_report)
+            with self.stage_metrics.stage('parse', bytes_=os.path.getsize(input_file_name)) as counts:
+                df = self.read_report(input_file_name, column_name_for_report, report_schema, delimiter)
+                counts['rows'] = df.shape[0]
+            total_row = df.shape[0]
+
+            with self.stage_metrics.stage('encode', rows=total_row):
+                if output_format == 'parquet':
+                    pq.write_table(report_schema.to_table(df), output_file_name,
+                                   row_group_size=writer_profile.row_group_size, allow_truncated_timestamps=True,
+                                   **writer_profile.writer_kwargs())
+                elif output_format == 'csv':
+                    df.to_csv(output_file_name, index=False)
+                else:
+                    logging.info("No proper format to write")
+        return total_row
+
+    def write_report_in_batches(self, input_file:'local path or readable stream', column_name_for_report:list,
+                                column_data_type_for_report:'dataframe schema', output_format:'parquet/csv/excel',
+                                output_stream:'writable binary stream', delimiter:'/,*,&,@ etc', batch_size:int,
+                                writer_profile:ParquetWriterProfile=None)->int:
+        """
+        This method reads the report batch_size rows at a time and appends every batch to the output stream, so
+        peak memory is set by the batch size and not by the report size. For parquet every batch becomes one
+        row group of the output file, for excel the rows are streamed by StreamingExcelWriter.
+
+        :param input_file: input file name in local file system or a readable stream of the report
+        :param column_name_for_report: list of columns for data frame
+        :param column_data_type_for_report: schema of data frame
+        :param output_format: output format of file
+        :param output_stream: binary stream the converted report is written to
+        :param delimiter: delimiter of data frame
+        :param batch_size: number of rows read per batch
+        :param writer_profile: parquet writer settings, defaults to ParquetWriterProfile()
+        :return: number of rows
+        """
+        report_schema = ReportSchema(column_name_for_report, column_data_type_for_report)
+        batches = self.read_report_batches(input_file, column_name_for_report, report_schema, delimiter, batch_size)
+        total_row = self.write_batches(batches, column_name_for_report, report_schema, output_format, output_stream,
+                                       writer_profile)
+        logging.info("Converted {} rows in batches of {}".format(total_row, batch_size))
+        return total_row
+
+    def read_report_batches(self, input_file:'local path or readable stream', column_name_for_report:list,
+                            report_schema:ReportSchema, delimiter:'/,*,&,@ etc', batch_size:int)->'iterator':
+        """
+        This method returns the batches of the report, read batch_size rows at a time with the read dtypes of
+        report_schema by the parser of parser_engine. Reading is timed as the parse stage
+
+        :param input_file: input file name in local file system or a readable stream of the report
+        :param column_name_for_report: list of columns for data frame
+        :param report_schema: compiled schema of the report
+        :param delimiter: delimiter of data frame
+        :param batch_size: number of rows read per batch
+        :return: iterator of data frames
+        """
+        if isinstance(input_file, str) and os.path.getsize(input_file) == 0:
+            # pandas refuses an empty file, ex - an empty part file, it has no batches
+            return iter(())
+        if self.parser_engine == 'python':
+            reader = pd.read_csv(input_file, sep=delimiter, names=column_name_for_report,
+                                 dtype=report_schema.read_dtypes, engine='python', chunksize=batch_size)
+        else:
+            reader = self.native_reader(column_name_for_report, report_schema, delimiter).batches(input_file,
+                                                                                                  batch_size)
+        return self.stage_metrics.iterate('parse', reader)
+
+    def read_report(self, input_file:'local path or readable stream', column_name_for_report:list,
+                    report_schema:ReportSchema, delimiter:'/,*,&,@ etc', nrows:int=None)->'pd.DataFrame':
+        """
+        This method reads the report, or its first nrows rows, into one data frame by the parser of parser_engine
+
+        :param input_file: input file name in local file system or a readable stream of the report
+        :param column_name_for_report: list of columns for data frame
+        :param report_schema: compiled schema of the report
+        :param delimiter: delimiter of data frame
+        :param nrows: number of rows to read, all if None
+        :return: data frame
+        """
+        if self.parser_engine == 'python':
+            return pd.read_csv(input_file, sep=delimiter, names=column_name_for_report,
+                               dtype=report_schema.read_dtypes, engine='python', nrows=nrows)
+        return self.native_reader(column_name_for_report, report_schema, delimiter).read(input_file, nrows)
+
+    def native_reader(self, column_name_for_report:list, report_schema:ReportSchema,
+                      delimiter:'/,*,&,@ etc')->NativeCsvReader:
+        """
+        This method returns the native reader of a report, checking parser_engine
+
+        :param column_name_for_report: list of columns for data frame
+        :param report_schema: compiled schema of the report
+        :param delimiter: delimiter of data frame
+        :return: reader
+        """
+        if self.parser_engine != 'native':
+            raise InvalidJobConfig("parser_engine has to be native or python", self.parser_engine)
+        return NativeCsvReader(column_name_for_report, report_schema.read_dtypes, delimiter)
+
+    def write_batches(self, batches:'iterable of data frames', column_name_for_report:list,
+                      report_schema:ReportSchema, output_format:'parquet/csv/excel',
+                      output_stream:'writable binary stream', writer_profile:ParquetWriterProfile=None,
+                      header:bool=True)->int:
+        """
+        This method appends every batch to the output stream. For parquet every batch becomes one row group of the
+        output file, for excel the rows are streamed by StreamingExcelWriter. An empty report is written with the
+        header or schema only
+
+        :param batches: data frames read with the read dtypes of report_schema
+        :param column_name_for_report: list of columns for data frame
+        :param report_schema: compiled schema of the report
+        :param output_format: output format of file
+        :param output_stream: binary stream the converted report is written to
+        :param writer_profile: parquet writer settings, defaults to ParquetWriterProfile()
+        :param header: if False csv is written without header, ex - a byte range appended to an earlier one
+        :return: number of rows
+        """
+        writer_profile = get_writer_profile(writer_profile)
+        total_row = 0
+        parquet_writer = None
+        excel_writer = None
+        if output_format == 'excel':
+            excel_writer = StreamingExcelWriter(output_stream, column_name_for_report, report_schema)
+        try:
+            for batch in batches:
+                with self.stage_metrics.stage('encode', rows=batch.shape[0]):
+                    if output_format == 'parquet':
+                        table = report_schema.to_table(batch)
+                        if parquet_writer is None:
+                            parquet_writer = pq.ParquetWriter(output_stream, table.schema,
+                                                              allow_truncated_timestamps=True,
+                                                              **writer_profile.writer_kwargs())
+                        elif not table.schema.equals(parquet_writer.schema):
+                            # columns without a declared dtype are inferred per batch, align them with the first batch
+                            table = table.cast(parquet_writer.schema)
+                        parquet_writer.write_table(table, row_group_size=writer_profile.row_group_size)
+                    elif output_format == 'csv':
+                        output_stream.write(batch.to_csv(index=False,
+                                                         header=header and total_row == 0).encode('utf-8'))
+                    elif output_format == 'excel':
+                        excel_writer.write_batch(batch)
+                total_row += batch.shape[0]
+        finally:
+            if parquet_writer is not None:
+                parquet_writer.close()
+
+        empty_df = pd.DataFrame(columns=column_name_for_report)
+        if output_format == 'parquet' and parquet_writer is None:
+            pq.write_table(report_schema.to_table(empty_df), output_stream, **writer_profile.writer_kwargs())
+        elif output_format == 'csv' and total_row == 0 and header:
+            output_stream.write(empty_df.to_csv(index=False).encode('utf-8'))
+        elif output_format == 'excel':
+            excel_writer.close()
+        elif output_format not in ('parquet', 'csv'):
             logging.info("No proper format to write")
-        output_bucket_name = self.upload_client.bucket(output_bucket)
-        logging.info(output_file_path)
-        output_blob = output_bucket_name.blob(output_file_path)
-        logging.info(output_blob)
-        output_blob.upload_from_filename(output_file_name)
         return total_row
 
+    def stream_merged_report_to_gcs(self, input_bucket_name:str, input_path:str, column_name_for_report:list,
+                                    column_data_type_for_report:'dataframe schema', output_format:'parquet/csv/excel',
+                                    output_file_path:str, output_bucket:str, delimiter:'/,*,&,@ etc',
+                                    batch_size:int=None, writer_profile:ParquetWriterProfile=None,
+                                    input_generation:int=None)->int:
+        """
+        This method converts the merged report without staging anything on local disk. The input blob is read as
+        a stream, converted batch by batch and written to the output blob through a resumable upload. If the
+        conversion fails the partially written output blob is removed.
+
+        :param input_bucket_name: input bucket name
+        :param input_path: input gcs path
+        :param column_name_for_report: list of columns for data frame
+        :param column_data_type_for_report: schema of data frame
+        :param output_format: output format of file
+        :param output_file_path: output file path
+        :param output_bucket: output bucket name
+        :param delimiter: delimiter of data frame
+        :param batch_size: number of rows converted per batch, defaults to default_batch_size
+        :param writer_profile: parquet writer settings, defaults to ParquetWriterProfile()
+        :param input_generation: if given, reading fails unless the input blob still has this generation
+        :return: number of rows
+        """
+        output_blob = self.upload_client.bucket(output_bucket).blob(output_file_path)
+        logging.info("Streaming {} to {}".format(input_path, output_file_path))
+        with self.open_merged_report(input_bucket_name, input_path, input_generation) as input_stream:
+            output_stream = output_blob.open('wb', chunk_size=self.stream_chunk_size, ignore_flush=True)
+            try:
+                total_row = self.write_report_in_batches(input_stream, column_name_for_report,
+                                                         column_data_type_for_report, output_format,
+                                                         output_stream, delimiter,
+                                                         batch_size or self.default_batch_size, writer_profile)
+            except Exception:
+                # closing the writer commits whatever was uploaded so far, so drop that object again
+                output_stream.close()
+                output_blob.delete()
+                raise
+            output_stream.close()
+        return total_row
+
+
+    @staticmethod
+    def count_blank_lines(data:bytes, start:int)->int:
+        """
+        This method counts the newlines at or after start that end a blank line, that is the ones right after a
+        newline or after a newline and a carriage return (CRLF)
+
+        :param data: bytes of the report, at least the two bytes before start
+        :param start: first position counted, at least 2
+        :return: number of blank lines
+        """
+        values = np.frombuffer(data, dtype=np.uint8)
+        is_newline = values == ord('\n')
+        is_carriage_return = values == ord('\r')
+        previous = is_newline[start - 1:-1] | (is_carriage_return[start - 1:-1] & is_newline[start - 2:-2])
+        return int(np.count_nonzero(is_newline[start:] & previous))
+
+    def validate_merged_report(self, input_file_name:str, column_name_for_report:list, delimiter:'/,*,&,@ etc',
+                               expected_row_count:int=None)->int:
+        """
+        This method is a cheap pre-flight check of the downloaded report. The file is memory mapped and scanned in
+        chunks with vectorized newline and delimiter counts, which takes a fraction of the conversion time, so a
+        report with the wrong row count or number of columns fails before anything is converted or uploaded. Blank
+        lines are not counted as rows, like in pd.read_csv. Quoted fields may hide newlines and delimiters, so for
+        a report containing quotes only the first line is checked
+
+        :param input_file_name: input file name in local file system
+        :param column_name_for_report: list of columns for data frame
+        :param delimiter: delimiter of data frame
+        :param expected_row_count: expected number of rows, not checked if None
+        :return: number of rows, None if the report contains quotes
+        """
+        delimiter_bytes = delimiter.encode('utf-8')
+        expected_delimiters = len(column_name_for_report) - 1
+        if os.path.getsize(input_file_name) == 0:
+            row_count = 0
+            first_line = b''
+            quoted = False
+            delimiter_count = 0
+        else:
+            with open(input_file_name, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                size = len(mm)
+                quoted = mm.find(b'"') != -1
+                first_line_end = mm.find(b'\n')
+                first_line = mm[:first_line_end if first_line_end != -1 else size].rstrip(b'\r')
+                newline_count = 0
+                blank_line_count = 0
+                delimiter_count = 0
+                previous_is_newline = True
+                # the start of the file counts as a newline, the last two bytes carry blank lines across chunks
+                tail = b'\n\n'
+                carry = b''
+                for start in range(0, size, self.preflight_chunk_size):
+                    chunk = mm[start:start + self.preflight_chunk_size]
+                    is_newline = np.frombuffer(chunk, dtype=np.uint8) == ord('\n')
+                    newline_count += int(np.count_nonzero(is_newline))
+                    blank_line_count += self.count_blank_lines(tail + chunk[:2], 2)
+                    blank_line_count += self.count_blank_lines(chunk, 2)
+                    tail = (tail + chunk[-2:])[-2:]
+                    previous_is_newline = bool(is_newline[-1])
+                    if not quoted:
+                        # keep the tail of the previous chunk so a delimiter split across chunks is counted
+                        window = carry + chunk
+                        delimiter_count += window.count(delimiter_bytes)
+                        carry = window[-(len(delimiter_bytes) - 1):] if len(delimiter_bytes) > 1 else b''
+                        if carry and window.endswith(delimiter_bytes):
+                            carry = b''
+                line_count = newline_count + (0 if previous_is_newline else 1)
+                row_count = line_count - blank_line_count
+
+        if first_line and b'"' not in first_line and first_line.count(delimiter_bytes) != expected_delimiters:
+            raise ReportInvalidSchema("Invalid Schema", "expected {} columns but the first line has {}".format(
+                len(column_name_for_report), first_line.count(delimiter_bytes) + 1))
+        if quoted:
+            logging.info("Report contains quoted fields, pre-flight validation only checked the first line")
+            return None
+        if delimiter_count != row_count * expected_delimiters:
+            raise ReportInvalidSchema("Invalid Schema", "expected {} delimiters for {} rows of {} columns but found "
+                                                        "{}".format(row_count * expected_delimiters, row_count,
+                                                                    len(column_name_for_report), delimiter_count))
+        if expected_row_count is not None and row_count != expected_row_count:
+            raise DataCountMismatch("Row count mismatch exception", abs(row_count - expected_row_count))
+        logging.info("Pre-flight validation passed for {} rows".format(row_count))
+        return row_count
+
+    def get_merge_entry_input(self, task_entries:list, report_date:datetime.datetime, input_bucket_field_name:str,
+                              input_path_field_name:str, kind:'namespace', filter_map:dict)->tuple:
+        """
+        This method picks the merge entry out of the queried entries and reads the location of the merged report
+
+        :param task_entries: entries returned for filter_map
+        :param report_date: report download date
+        :param input_bucket_field_name: bucket name field name in data store entity
+        :param input_path_field_name: input path field name in entity
+        :param kind: kind on which query is done
+        :param filter_map: filter map(dict) used to query the entries
+        :return: merge entry, input bucket name and input path
+        """
+        if len(task_entries) > 0 and \
+                task_entries[0]['status'] == 'success':
+            merge_entry = task_entries[0]
+        else:
+            raise InvalidJobConfig("No input file found", report_date)
+
+        input_bucket_name = merge_entry.get(input_bucket_field_name)
+        input_path = merge_entry.get(input_path_field_name)
+        logging.info(input_path)
+        if input_path is None:
+            raise StorageFileNotFound("No input file path found for"
+                                      " field {} , kind {}  and filter {}".format(
+                input_path_field_name, kind, filter_map))
+        return merge_entry, input_bucket_name, input_path
+
+    def convert_merged_report(self, input_bucket_name:str, input_path:str, column_name_for_report:list,
+                              column_data_type_for_report:'dataframe schema', output_format:'parquet/csv/excel',
+                              output_file_name:str, output_file_path:str, output_bucket:str, delimiter:'/,*,&,@ etc',
+                              batch_size:int=None, stream:bool=False, preflight:bool=False,
+                              expected_row_count:int=None, partition_by:list=None, max_rows_per_file:int=None,
+                              writer_profile:'ParquetWriterProfile/dict/auto'=None, profile_objective:str='size',
+                              part_files_layout:str=None, output_targets:list=None, work_dir:str=None,
+                              parallel_workers:int=None, parallel_layout:str='single',
+                              input_generation:'int/str'=None)->dict:
+        """
+        This method converts the merged report at input_path and uploads it to output_file_path
+
+        :param input_bucket_name: input bucket name
+        :param input_path: input gcs path
+        :param column_name_for_report: list of columns for data frame
+        :param column_data_type_for_report: schema of data frame
+        :param output_format: output format of file
+        :param output_file_name: output file name
+        :param output_file_path: output file path
+        :param output_bucket: output bucket name
+        :param delimiter: delimiter of data frame
+        :param batch_size: if given, the report is converted batch_size rows at a time
+        :param stream: if True the report is streamed from the input blob to the output blob without using local disk
+        :param preflight: if True the downloaded report is validated with validate_merged_report before conversion
+        :param expected_row_count: row count the pre-flight validation checks against, not checked if None
+        :param partition_by: if given, a parquet report is written as hive partitioned dataset under output_file_path
+        :param max_rows_per_file: rows after which a partition of the dataset starts a new file
+        :param writer_profile: parquet writer settings as profile or dict, or 'auto' to benchmark candidate settings
+                               on a sample of the report
+        :param profile_objective: what the auto writer profile optimises, size or speed
+        :param part_files_layout: if given, input_path is the prefix of the part files, which are converted without
+                                  merging them first into one output ('single') or one output per part ('per_part'),
+                                  see convert_part_files
+        :param output_targets: if given, the result of get_output_targets, the report is parsed once and written to
+                               every target by fan_out_report instead of output_file_name
+        :param work_dir: local directory for the downloaded and converted files, defaults to the working directory
+        :param parallel_workers: if given, the downloaded report is split on record boundaries and converted by this
+                                 many processes, see put_report_in_parallel
+        :param parallel_layout: output of a parallel conversion, one file ('single') or one file per byte range in
+                                the directory output_file_path ('parts')
+        :param input_generation: if given, the input_generation of plan_conversion, the conversion fails if the
+                                 input changed since, so the recorded generation is always the converted one
+        :return: dict with total_row and the writer_profile used (as dict, None for csv and excel), with part_rows
+                 for part files and outputs for output targets
+        """
+        if partition_by and output_format != 'parquet':
+            raise InvalidJobConfig("partition_by is only supported for parquet output", output_format)
+        if parallel_workers and (partition_by or stream or part_files_layout or output_targets):
+            raise InvalidJobConfig("parallel conversion can not be combined with partition_by, stream, part files "
+                                   "or output targets", parallel_workers)
+        if output_targets and (partition_by or stream or part_files_layout):
+            raise InvalidJobConfig("output targets can not be combined with partition_by, stream or part files",
+                                   output_targets)
+        if part_files_layout:
+            if partition_by or stream:
+                raise InvalidJobConfig("part files can not be converted with partition_by or stream",
+                                       part_files_layout)
+            return self.convert_part_files(input_bucket_name, input_path, column_name_for_report,
+                                           column_data_type_for_report, output_format, output_file_name,
+                                           output_file_path, output_bucket, delimiter, part_files_layout, batch_size,
+                                           preflight, writer_profile, profile_objective, work_dir, input_generation)
+        if stream and not partition_by:
+            if preflight:
+                logging.info("Skipping pre-flight validation, it needs the report on local disk")
+            writer_profile = self.resolve_writer_profile(
+                writer_profile, output_format,
+                lambda: self.open_merged_report(input_bucket_name, input_path, input_generation),
+                column_name_for_report, column_data_type_for_report, delimiter, profile_objective)
+            total_row = self.stream_merged_report_to_gcs(input_bucket_name, input_path, column_name_for_report,
+                                                         column_data_type_for_report, output_format,
+                                                         output_file_path, output_bucket, delimiter, batch_size,
+                                                         writer_profile, input_generation)
+            return self.conversion_result(total_row, writer_profile)
+        input_file_name = input_path.split('/')[-1]
+        if work_dir:
+            input_file_name = os.path.join(work_dir, input_file_name)
+            output_file_name = os.path.join(work_dir, output_file_name)
+
+        downloaded_merged_report = self.get_blob_for_merged_report(input_bucket_name,
+                                                                   input_path,
+                                                                   input_file_name,
+                                                                   input_generation)
+        if preflight:
+            with self.stage_metrics.stage('preflight', bytes_=os.path.getsize(downloaded_merged_report)):
+                self.validate_merged_report(downloaded_merged_report, column_name_for_report, delimiter,
+                                            expected_row_count)
+        if output_targets:
+            outputs = self.fan_out_report(downloaded_merged_report, column_name_for_report,
+                                          column_data_type_for_report, output_targets, delimiter, batch_size,
+                                          profile_objective, work_dir)
+            conversion = self.conversion_result(outputs[0]['total_row'], None)
+            conversion['writer_profile'] = outputs[0]['writer_profile']
+            conversion['outputs'] = outputs
+            return conversion
+        writer_profile = self.resolve_writer_profile(writer_profile, output_format,
+                                                     lambda: open(downloaded_merged_report, 'rb'),
+                                                     column_name_for_report, column_data_type_for_report, delimiter,
+                                                     profile_objective)
+
+        if partition_by:
+            total_row = self.put_partitioned_dataset_to_gcs(downloaded_merged_report, column_name_for_report,
+                                                            column_data_type_for_report, output_file_path,
+                                                            output_bucket, delimiter, partition_by,
+                                                            max_rows_per_file, batch_size, work_dir, writer_profile)
+        elif parallel_workers:
+            total_row = self.put_report_in_parallel(downloaded_merged_report, column_name_for_report,
+                                                    column_data_type_for_report, output_format, output_file_name,
+                                                    output_file_path, output_bucket, delimiter, parallel_workers,
+                                                    parallel_layout, batch_size, writer_profile, work_dir)
+        else:
+            total_row = self.put_parquet_file_to_gcs(downloaded_merged_report, column_name_for_report,
+                                                     column_data_type_for_report, output_format,
+                                                     output_file_name, output_file_path, output_bucket,
+                                                     delimiter, batch_size, writer_profile)
+        return self.conversion_result(total_row, writer_profile)
+
+    @staticmethod
+    def conversion_result(total_row:int, writer_profile:ParquetWriterProfile)->dict:
+        """
+        This method builds the result of convert_merged_report
+
+        :param total_row: number of rows converted
+        :param writer_profile: parquet writer settings used, None if no parquet was written
+        :return: dict with total_row and writer_profile
+        """
+        return {'total_row': total_row,
+                'writer_profile': writer_profile.to_dict() if writer_profile is not None else None}
+
+    def resolve_writer_profile(self, writer_profile:'ParquetWriterProfile/dict/auto', output_format:'parquet/csv/excel',
+                               open_input:'callable', column_name_for_report:list,
+                               column_data_type_for_report:'dataframe schema', delimiter:'/,*,&,@ etc',
+                               profile_objective:str='size')->ParquetWriterProfile:
+        """
+        This method returns the parquet writer settings of a conversion. For 'auto' the first profile_sample_rows
+        rows of the report are read and the candidate settings are benchmarked on them
+
+        :param writer_profile: profile, its dict form, 'auto' or None for the default profile
+        :param output_format: output format of file
+        :param open_input: function returning a new binary stream of the report
+        :param column_name_for_report: list of columns for data frame
+        :param column_data_type_for_report: schema of data frame
+        :param delimiter: delimiter of data frame
+        :param profile_objective: size or speed
+        :return: profile, None if the output is not parquet
+        """
+        if output_format != 'parquet':
+            return None
+        if writer_profile != 'auto':
+            return get_writer_profile(writer_profile)
+        report_schema = ReportSchema(column_name_for_report, column_data_type_for_report)
+        with open_input() as input_stream:
+            sample = self.read_report(input_stream, column_name_for_report, report_schema, delimiter,
+                                      self.profile_sample_rows)
+        profile = choose_profile(report_schema.to_table(sample), profile_objective)
+        logging.info("Chose writer profile {} for objective {}".format(profile, profile_objective))
+        return profile
+
+    def upload_dataset_manifest(self, files:list, output_bucket:str, output_file_path:str, **extra)->dict:
+        """
+        This method uploads the manifest of a dataset as output_file_path/_SUCCESS, listing every file and its row
+        count. It is uploaded after the files, so readers can tell a complete dataset
+
+        :param files: list of (path relative to output_file_path, rows) of the files of the dataset
+        :param output_bucket: output bucket name
+        :param output_file_path: gcs directory of the dataset
+        :param extra: other properties of the manifest, ex - partition_by
+        :return: manifest
+        """
+        manifest = dict(extra, files=[{'path': relative_path, 'rows': rows} for relative_path, rows in files],
+                        total_rows=sum(rows for _, rows in files))
+        manifest_blob = self.upload_client.bucket(output_bucket).blob(
+            self.get_output_object_path(output_file_path, dataset=True))
+        manifest_blob.upload_from_string(json.dumps(manifest), content_type='application/json')
+        return manifest
+
+    def put_partitioned_dataset_to_gcs(self, input_file_name:str, column_name_for_report:list,
+                                       column_data_type_for_report:'dataframe schema', output_file_path:str,
+                                       output_bucket:str, delimiter:'/,*,&,@ etc', partition_by:list,
+                                       max_rows_per_file:int=None, batch_size:int=None, work_dir:str=None,
+                                       writer_profile:ParquetWriterProfile=None)->int:
+        """
+        This method writes the report as hive partitioned parquet dataset, ex -
+        output_file_path/report_date=2020-07-27/store=12/part-00000.parquet. The partitions of every batch are
+        written concurrently, the files are uploaded in parallel and a manifest listing every file and its row
+        count is uploaded last as output_file_path/_SUCCESS, so readers can tell a complete dataset
+
+        :param input_file_name: input file name in local file system
+        :param column_name_for_report: list of columns for data frame
+        :param column_data_type_for_report: schema of data frame
+        :param output_file_path: gcs directory of the dataset
+        :param output_bucket: output bucket name
+        :param delimiter: delimiter of data frame
+        :param partition_by: columns the dataset is partitioned by, in directory order
+        :param max_rows_per_file: rows after which a partition starts a new file, unlimited if None
+        :param batch_size: number of rows read per batch, defaults to default_batch_size
+        :param work_dir: local directory the dataset is staged in, defaults to the working directory
+        :param writer_profile: parquet writer settings, defaults to ParquetWriterProfile()
+        :return: number of rows according to the manifest
+        """
+        report_schema = ReportSchema(column_name_for_report, column_data_type_for_report)
+        batches = self.read_report_batches(input_file_name, column_name_for_report, report_schema, delimiter,
+                                           batch_size or self.default_batch_size)
+        with tempfile.TemporaryDirectory(dir=work_dir or os.getcwd()) as dataset_dir:
+            dataset_writer = PartitionedDatasetWriter(dataset_dir, partition_by, max_rows_per_file,
+                                                      writer_profile=get_writer_profile(writer_profile))
+            schema = None
+            try:
+                for batch in batches:
+                    with self.stage_metrics.stage('encode', rows=batch.shape[0]):
+                        table = report_schema.to_table(batch)
+                        if schema is None:
+                            schema = table.schema
+                        elif not table.schema.equals(schema):
+                            table = table.cast(schema)
+                        dataset_writer.write_batch(table)
+            finally:
+                files = dataset_writer.close()
+
+            local_paths = [os.path.join(dataset_dir, relative_path) for relative_path, _ in files]
+            with self.stage_metrics.stage('upload', bytes_=sum(os.path.getsize(path) for path in local_paths)), \
+                    ThreadPoolExecutor(max_workers=self.dataset_upload_workers) as executor:
+                uploads = [executor.submit(self.gcs.upload_file, local_path, output_bucket,
+                                           '/'.join([output_file_path.rstrip('/'), relative_path]))
+                           for local_path, (relative_path, _) in zip(local_paths, files)]
+                for upload in uploads:
+                    upload.result()
+
+        manifest = self.upload_dataset_manifest(files, output_bucket, output_file_path, partition_by=list(partition_by))
+        logging.info("Wrote {} rows in {} files under {}".format(manifest['total_rows'], len(files),
+                                                                 output_file_path))
+        return manifest['total_rows']
+
+    def convert_part_files(self, input_bucket_name:str, input_prefix:str, column_name_for_report:list,
+                           column_data_type_for_report:'dataframe schema', output_format:'parquet/csv/excel',
+                           output_file_name:str, output_file_path:str, output_bucket:str, delimiter:'/,*,&,@ etc',
+                           layout:str='single', batch_size:int=None, preflight:bool=False,
+                           writer_profile:'ParquetWriterProfile/dict/auto'=None, profile_objective:str='size',
+                           work_dir:str=None, input_generation:str=None)->dict:
+        """
+        This method converts the part files under input_prefix without merging them first. The parts are
+        downloaded concurrently and converted in name order while the next parts are still downloading, so the
+        output is the same for every run. With layout 'single' the batches of all parts are written into one
+        output file, with layout 'per_part' every part becomes output_file_path/part-00000.<ext>, ... and a
+        manifest listing every file and its row count is uploaded last as output_file_path/_SUCCESS
+
+        :param input_bucket_name: input bucket name
+        :param input_prefix: gcs prefix of the part files, only the files directly under it are converted
+        :param column_name_for_report: list of columns for data frame
+        :param column_data_type_for_report: schema of data frame
+        :param output_format: output format of file
+        :param output_file_name: output file name, its extension is used for the files of layout 'per_part'
+        :param output_file_path: output file path, the directory of the files for layout 'per_part'
+        :param output_bucket: output bucket name
+        :param delimiter: delimiter of data frame
+        :param layout: 'single' or 'per_part'
+        :param batch_size: number of rows read per batch, defaults to default_batch_size for layout 'single'
+        :param preflight: if True every part is validated with validate_merged_report before it is converted, the
+                          row count is checked on the sum of the parts by the caller
+        :param writer_profile: parquet writer settings as profile or dict, or 'auto' to benchmark candidate settings
+                               on a sample of the first part
+        :param profile_objective: what the auto writer profile optimises, size or speed
+        :param work_dir: local directory for the downloaded and converted files, defaults to the working directory
+        :param input_generation: if given, the part_files_generation of plan_conversion, the conversion fails if a
+                                 part was added, removed or rewritten since
+        :return: dict with total_row, writer_profile and part_rows, the row count of every part in name order
+        """
+        if layout not in ('single', 'per_part'):
+            raise InvalidJobConfig("part files layout has to be single or per_part", layout)
+        parts = self.list_part_files(input_bucket_name, input_prefix)
+        if input_generation is not None and self.parts_generation(parts) != input_generation:
+            raise StorageFileNotFound("Part files at gs://{}/{} changed since generation {}".format(
+                input_bucket_name, input_prefix, input_generation))
+        logging.info("Converting {} part files under {}".format(len(parts), input_prefix))
+        report_schema = ReportSchema(column_name_for_report, column_data_type_for_report)
+        extension = os.path.splitext(output_file_name)[1]
+        part_rows = []
+
+        with tempfile.TemporaryDirectory(dir=work_dir or os.getcwd()) as part_dir, \
+                ThreadPoolExecutor(max_workers=self.part_download_workers) as executor:
+            # the index keeps the local names unique and in the order of the parts
+            # every part is downloaded in the generation it was listed with
+            downloads = [executor.submit(self.get_blob_for_merged_report, input_bucket_name, part.name,
+                                         os.path.join(part_dir, '{:05d}-{}'.format(index, part.name.split('/')[-1])),
+                                         part.generation)
+                         for index, part in enumerate(parts)]
+
+            def downloaded_parts():
+                for download in downloads:
+                    part_file_name = download.result()
+                    if preflight:
+                        with self.stage_metrics.stage('preflight', bytes_=os.path.getsize(part_file_name)):
+                            self.validate_merged_report(part_file_name, column_name_for_report, delimiter)
+                    yield part_file_name
+
+            try:
+                part_files = downloaded_parts()
+                first_part = next(part_files)
+                writer_profile = self.resolve_writer_profile(writer_profile, output_format,
+                                                             lambda: open(first_part, 'rb'), column_name_for_report,
+                                                             column_data_type_for_report, delimiter,
+                                                             profile_objective)
+                part_files = itertools.chain([first_part], part_files)
+
+                if layout == 'single':
+                    def part_batches():
+                        for part_file_name in part_files:
+                            rows = 0
+                            for batch in self.read_report_batches(part_file_name, column_name_for_report,
+                                                                  report_schema, delimiter,
+                                                                  batch_size or self.default_batch_size):
+                                rows += batch.shape[0]
+                                yield batch
+                            part_rows.append(rows)
+                            os.remove(part_file_name)
+
+                    local_output = os.path.join(part_dir, output_file_name.split('/')[-1])
+                    with open(local_output, 'wb') as output_stream:
+                        total_row = self.write_batches(part_batches(), column_name_for_report, report_schema,
+                                                       output_format, output_stream, writer_profile)
+                    with self.stage_metrics.stage('upload', bytes_=os.path.getsize(local_output)):
+                        self.gcs.upload_file(local_output, output_bucket, output_file_path)
+                else:
+                    files = []
+                    uploads = []
+                    with ThreadPoolExecutor(max_workers=self.dataset_upload_workers) as upload_executor:
+                        for index, part_file_name in enumerate(part_files):
+                            relative_path = 'part-{:05d}{}'.format(index, extension)
+                            local_output = os.path.join(part_dir, relative_path)
+                            rows = self.write_report_to_file(part_file_name, column_name_for_report,
+                                                             column_data_type_for_report, output_format,
+                                                             local_output, delimiter,
+                                                             batch_size or self.default_batch_size, writer_profile)
+                            os.remove(part_file_name)
+                            part_rows.append(rows)
+                            files.append((relative_path, rows))
+                            # parts are uploaded while the next ones are converted
+                            uploads.append(upload_executor.submit(
+                                self.upload_part_output, local_output, output_bucket,
+                                '/'.join([output_file_path.rstrip('/'), relative_path])))
+                        for upload in uploads:
+                            upload.result()
+                    total_row = self.upload_dataset_manifest(files, output_bucket, output_file_path)['total_rows']
+            finally:
+                # downloads still running when a part fails must not write into the removed directory
+                for download in downloads:
+                    download.cancel()
+                for download in downloads:
+                    if not download.cancelled():
+                        download.exception()
+
+        logging.info("Converted {} rows from {} part files".format(total_row, len(part_rows)))
+        conversion = self.conversion_result(total_row, writer_profile)
+        conversion['part_rows'] = part_rows
+        return conversion
+
+    def upload_part_output(self, local_output:str, output_bucket:str, output_object_path:str):
+        """
+        This method uploads a converted file and removes the local copy
+
+        :param local_output: converted file in local file system
+        :param output_bucket: output bucket name
+        :param output_object_path: gcs path of the file
+        :return: None
+        """
+        with self.stage_metrics.stage('upload', bytes_=os.path.getsize(local_output)):
+            self.gcs.upload_file(local_output, output_bucket, output_object_path)
+        os.remove(local_output)
+
+    def put_report_in_parallel(self, input_file_name:str, column_name_for_report:list,
+                               column_data_type_for_report:'dataframe schema', output_format:'parquet/csv',
+                               output_file_name:str, output_file_path:str, output_bucket:str, delimiter:'/,*,&,@ etc',
+                               workers:int, layout:str='single', batch_size:int=None,
+                               writer_profile:ParquetWriterProfile=None, work_dir:str=None)->int:
+        """
+        This method converts one large local report with several processes. The memory mapped report is split into
+        byte ranges on record boundaries by find_record_ranges and every range is parsed and converted by
+        convert_byte_range_job in a process pool. With layout 'single' the ranges are assembled in file order into
+        one output file, for parquet every range becomes ordered row groups of the file, so the rows and their order
+        are the ones of a serial conversion. With layout 'parts' every range becomes
+        output_file_path/part-00000.<ext>, ... and a manifest listing every file and its row count is uploaded last
+        as output_file_path/_SUCCESS
+
+        :param input_file_name: input file name in local file system
+        :param column_name_for_report: list of columns for data frame
+        :param column_data_type_for_report: schema of data frame
+        :param output_format: output format of file, parquet or csv
+        :param output_file_name: output file name, its extension is used for the files of layout 'parts'
+        :param output_file_path: output file path, the directory of the files for layout 'parts'
+        :param output_bucket: output bucket name
+        :param delimiter: delimiter of data frame
+        :param workers: number of processes converting ranges at the same time
+        :param layout: 'single' or 'parts'
+        :param batch_size: number of rows read per batch of a range, defaults to default_batch_size
+        :param writer_profile: parquet writer settings, defaults to ParquetWriterProfile()
+        :param work_dir: local directory the ranges are converted in, defaults to the working directory
+        :return: number of rows
+        """
+        if layout not in ('single', 'parts'):
+            raise InvalidJobConfig("parallel layout has to be single or parts", layout)
+        if output_format not in ('parquet', 'csv'):
+            raise InvalidJobConfig("parallel conversion is only supported for parquet and csv output", output_format)
+        ranges = find_record_ranges(input_file_name, workers * self.parallel_splits_per_worker,
+                                    self.parallel_min_split_bytes, self.preflight_chunk_size)
+        if len(ranges) < 2 and layout == 'single':
+            logging.info("Report is too small to split, converting it in one process")
+            return self.put_parquet_file_to_gcs(input_file_name, column_name_for_report, column_data_type_for_report,
+                                                output_format, output_file_name, output_file_path, output_bucket,
+                                                delimiter, batch_size, writer_profile)
+        writer_profile = get_writer_profile(writer_profile)
+        extension = os.path.splitext(output_file_name)[1]
+        if layout == 'single':
+            # parquet ranges are handed over as arrow ipc files, the parquet file itself is written once
+            range_format = 'arrow' if output_format == 'parquet' else output_format
+            relative_paths = ['range-{:05d}'.format(index) for index in range(len(ranges))]
+        else:
+            range_format = output_format
+            relative_paths = ['part-{:05d}{}'.format(index, extension) for index in range(len(ranges))]
+        logging.info("Converting {} in {} byte ranges with {} workers".format(input_file_name, len(ranges), workers))
+
+        with tempfile.TemporaryDirectory(dir=work_dir or os.getcwd()) as range_dir:
+            range_files = [os.path.join(range_dir, relative_path) for relative_path in relative_paths]
+            context = multiprocessing.get_context('spawn')
+            with self.stage_metrics.stage('parallel_convert', bytes_=os.path.getsize(input_file_name)) as counts, \
+                    ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                futures = [executor.submit(convert_byte_range_job, input_file_name, start, end,
+                                           column_name_for_report, column_data_type_for_report, range_format,
+                                           range_file, delimiter, batch_size or self.default_batch_size,
+                                           # a csv output keeps the header of the first range only
+                                           layout == 'parts' or index == 0, writer_profile.to_dict(),
+                                           self.parser_engine)
+                           for index, ((start, end), range_file) in enumerate(zip(ranges, range_files))]
+                range_rows = [future.result() for future in futures]
+                counts['rows'] = sum(range_rows)
+            total_row = sum(range_rows)
+
+            if layout == 'parts':
+                with ThreadPoolExecutor(max_workers=self.dataset_upload_workers) as upload_executor:
+                    uploads = [upload_executor.submit(self.upload_part_output, range_file, output_bucket,
+                                                      '/'.join([output_file_path.rstrip('/'), relative_path]))
+                               for range_file, relative_path in zip(range_files, relative_paths)]
+                    for upload in uploads:
+                        upload.result()
+                self.upload_dataset_manifest(list(zip(relative_paths, range_rows)), output_bucket, output_file_path)
+            else:
+                local_output = os.path.join(range_dir, output_file_name.split('/')[-1])
+                if output_format == 'parquet':
+                    report_schema = ReportSchema(column_name_for_report, column_data_type_for_report)
+                    with open(local_output, 'wb') as output_stream:
+                        self.write_arrow_ranges(range_files, range_rows, column_name_for_report, report_schema,
+                                                output_stream, writer_profile)
+                else:
+                    with open(local_output, 'wb') as output_stream:
+                        for range_file in range_files:
+                            with open(range_file, 'rb') as range_stream:
+                                shutil.copyfileobj(range_stream, output_stream, self.stream_chunk_size)
+                            os.remove(range_file)
+                with self.stage_metrics.stage('upload', bytes_=os.path.getsize(local_output)):
+                    self.gcs.upload_file(local_output, output_bucket, output_file_path)
+
+        logging.info("Converted {} rows in {} byte ranges".format(total_row, len(ranges)))
+        return total_row
+
+    def write_byte_range(self, input_file_name:str, start:int, end:int, column_name_for_report:list,
+                         column_data_type_for_report:'dataframe schema', output_format:'parquet/csv/arrow',
+                         output_file_name:str, delimiter:'/,*,&,@ etc', batch_size:int, header:bool=True,
+                         writer_profile:ParquetWriterProfile=None)->int:
+        """
+        This method converts the records in the bytes start to end of the report into a local file. Format 'arrow'
+        writes the batches as arrow ipc file for put_report_in_parallel to assemble, nothing is written when the
+        range has no rows
+
+        :param input_file_name: input file name in local file system
+        :param start: first byte of the range, the start of a record
+        :param end: end of the range (exclusive), the end of a record or of the report
+        :param column_name_for_report: list of columns for data frame
+        :param column_data_type_for_report: schema of data frame
+        :param output_format: output format of file, parquet, csv or arrow
+        :param output_file_name: output file name in local file system
+        :param delimiter: delimiter of data frame
+        :param batch_size: number of rows read per batch
+        :param header: if False csv is written without header
+        :param writer_profile: parquet writer settings, defaults to ParquetWriterProfile()
+        :return: number of rows
+        """
+        report_schema = ReportSchema(column_name_for_report, column_data_type_for_report)
+        # the range is a zero copy slice of the memory mapped report, which stays mapped while the slice is alive
+        with pa.memory_map(input_file_name) as source:
+            source.seek(start)
+            range_stream = pa.BufferReader(source.read_buffer(end - start))
+        batches = self.read_report_batches(range_stream, column_name_for_report, report_schema, delimiter,
+                                           batch_size)
+        if output_format != 'arrow':
+            with open(output_file_name, 'wb') as output_stream:
+                return self.write_batches(batches, column_name_for_report, report_schema, output_format,
+                                          output_stream, writer_profile, header)
+        total_row = 0
+        ipc_writer = None
+        try:
+            for batch in batches:
+                with self.stage_metrics.stage('encode', rows=batch.shape[0]):
+                    table = report_schema.to_table(batch)
+                    if ipc_writer is None:
+                        ipc_writer = ipc.new_file(output_file_name, table.schema)
+                    elif not table.schema.equals(ipc_writer.schema):
+                        table = table.cast(ipc_writer.schema)
+                    ipc_writer.write_table(table)
+                total_row += batch.shape[0]
+        finally:
+            if ipc_writer is not None:
+                ipc_writer.close()
+        return total_row
+
+    def write_arrow_ranges(self, range_files:list, range_rows:list, column_name_for_report:list,
+                           report_schema:ReportSchema, output_stream:'writable binary stream',
+                           writer_profile:ParquetWriterProfile=None)->int:
+        """
+        This method writes the arrow ipc files of write_byte_range in order into one parquet file. The files are
+        memory mapped so a range is not copied before it is encoded, columns without a declared dtype are aligned
+        with the first range like write_batches aligns them with the first batch
+
+        :param range_files: arrow ipc files in file order of their ranges
+        :param range_rows: row count of every range, no file is written for a range without rows
+        :param column_name_for_report: list of columns for data frame
+        :param report_schema: compiled schema of the report
+        :param output_stream: binary stream the parquet file is written to
+        :param writer_profile: parquet writer settings, defaults to ParquetWriterProfile()
+        :return: number of rows
+        """
+        writer_profile = get_writer_profile(writer_profile)
+        total_row = 0
+        parquet_writer = None
+        try:
+            for range_file, rows in zip(range_files, range_rows):
+                if not rows:
+                    continue
+                with self.stage_metrics.stage('encode', rows=rows):
+                    table = ipc.open_file(pa.memory_map(range_file)).read_all()
+                    if parquet_writer is None:
+                        parquet_writer = pq.ParquetWriter(output_stream, table.schema,
+                                                          allow_truncated_timestamps=True,
+                                                          **writer_profile.writer_kwargs())
+                    elif not table.schema.equals(parquet_writer.schema):
+                        table = table.cast(parquet_writer.schema)
+                    parquet_writer.write_table(table, row_group_size=writer_profile.row_group_size)
+                total_row += rows
+                os.remove(range_file)
+        finally:
+            if parquet_writer is not None:
+                parquet_writer.close()
+        if parquet_writer is None:
+            pq.write_table(report_schema.to_table(pd.DataFrame(columns=column_name_for_report)), output_stream,
+                           **writer_profile.writer_kwargs())
+        return total_row
+
+    def get_output_targets(self, output_targets:list, output_format:'parquet/csv/excel', output_file_name:str,
+                           output_path:str, output_bucket:str,
+                           writer_profile:'ParquetWriterProfile/dict/auto'=None)->list:
+        """
+        This method completes the output targets of a conversion, a target without output_path, output_bucket or
+        writer_profile takes the one of the task. Without output_targets the task has the single target given by
+        output_format and output_file_name
+
+        :param output_targets: list of dict with output_format, output_file_name and optionally output_path,
+                               output_bucket and writer_profile, or None
+        :param output_format: output format of the task
+        :param output_file_name: output file name of the task
+        :param output_path: gcs path of the outputs of the task
+        :param output_bucket: output bucket of the task
+        :param writer_profile: parquet writer settings of the task
+        :return: list of dict with output_format, output_file_name, output_path, output_bucket, output_file_path and
+                 writer_profile
+        """
+        targets = []
+        for target in output_targets or [{'output_format': output_format, 'output_file_name': output_file_name}]:
+            if target.get('output_format') not in ('parquet', 'csv', 'excel') or not target.get('output_file_name'):
+                raise InvalidJobConfig("output target needs output_format parquet, csv or excel and output_file_name",
+                                       target)
+            target = dict({'output_path': output_path, 'output_bucket': output_bucket,
+                           'writer_profile': writer_profile}, **target)
+            target['output_file_path'] = os.path.join(target['output_path'], target['output_file_name'])
+            targets.append(target)
+        output_locations = [(target['output_bucket'], target['output_file_path']) for target in targets]
+        if len(set(output_locations)) != len(output_locations):
+            raise InvalidJobConfig("output targets have to be written to different files", output_locations)
+        return targets
+
+    def job_output_targets(self, job:dict)->list:
+        """
+        This method returns the completed output targets of a job of write_merge_reports_as_parquet
+
+        :param job: keyword arguments of write_merge_report_as_parquet
+        :return: result of get_output_targets, None if the job has no output targets
+        """
+        if not job.get('output_targets'):
+            return None
+        return self.get_output_targets(job['output_targets'], job['output_format'], job['output_file_name'],
+                                       job['output_path'], job['output_bucket'], job.get('writer_profile'))
+
+    def fan_out_report(self, input_file_name:str, column_name_for_report:list,
+                       column_data_type_for_report:'dataframe schema', output_targets:list,
+                       delimiter:'/,*,&,@ etc', batch_size:int=None, profile_objective:str='size',
+                       work_dir:str=None)->list:
+        """
+        This method converts the report into every output target with a single parse. Every batch is read once and
+        handed to one writer thread per target through a bounded queue, so the writers encode concurrently and the
+        slowest writer holds back the reading instead of the batches piling up in memory. The outputs are uploaded
+        in parallel once every writer has finished
+
+        :param input_file_name: input file name in local file system
+        :param column_name_for_report: list of columns for data frame
+        :param column_data_type_for_report: schema of data frame
+        :param output_targets: result of get_output_targets
+        :param delimiter: delimiter of data frame
+        :param batch_size: number of rows read per batch, defaults to default_batch_size
+        :param profile_objective: what the auto writer profiles optimise, size or speed
+        :param work_dir: local directory for the converted files, defaults to the working directory
+        :return: list of dict with output_format, output_bucket, output_file_path, total_row, size_bytes and
+                 writer_profile (as dict) for every target in the order of output_targets
+        """
+        report_schema = ReportSchema(column_name_for_report, column_data_type_for_report)
+        writer_profiles = [self.resolve_writer_profile(target['writer_profile'], target['output_format'],
+                                                       lambda: open(input_file_name, 'rb'), column_name_for_report,
+                                                       column_data_type_for_report, delimiter, profile_objective)
+                           for target in output_targets]
+        # the index keeps the local files of targets with the same file name apart
+        local_outputs = [os.path.join(work_dir or os.getcwd(),
+                                      '{}-{}'.format(index, target['output_file_name'].split('/')[-1]))
+                         for index, target in enumerate(output_targets)]
+        batch_queues = [queue.Queue(maxsize=self.fan_out_queue_size) for _ in output_targets]
+
+        def queued_batches(batch_queue):
+            while True:
+                batch = batch_queue.get()
+                if batch is None:
+                    return
+                yield batch
+
+        def write(index):
+            with open(local_outputs[index], 'wb') as output_stream:
+                return self.write_batches(queued_batches(batch_queues[index]), column_name_for_report,
+                                          report_schema, output_targets[index]['output_format'], output_stream,
+                                          writer_profiles[index])
+
+        with ThreadPoolExecutor(max_workers=len(output_targets)) as executor:
+            writers = [executor.submit(write, index) for index in range(len(output_targets))]
+            try:
+                for batch in self.read_report_batches(input_file_name, column_name_for_report, report_schema,
+                                                      delimiter, batch_size or self.default_batch_size):
+                    # the batches are only read by the writers, so all of them share it
+                    for batch_queue, writer in zip(batch_queues, writers):
+                        self.offer_batch(batch_queue, batch, writer)
+            finally:
+                for batch_queue, writer in zip(batch_queues, writers):
+                    self.offer_batch(batch_queue, None, writer, raise_failure=False)
+            total_rows = [writer.result() for writer in writers]
+
+        outputs = []
+        for target, local_output, total_row, writer_profile in zip(output_targets, local_outputs, total_rows,
+                                                                  writer_profiles):
+            outputs.append({'output_format': target['output_format'], 'output_bucket': target['output_bucket'],
+                            'output_file_path': target['output_file_path'], 'total_row': total_row,
+                            'size_bytes': os.path.getsize(local_output),
+                            'writer_profile': writer_profile.to_dict() if writer_profile is not None else None})
+        with ThreadPoolExecutor(max_workers=self.dataset_upload_workers) as executor:
+            uploads = [executor.submit(self.upload_part_output, local_output, output['output_bucket'],
+                                       output['output_file_path'])
+                       for local_output, output in zip(local_outputs, outputs)]
+            for upload in uploads:
+                upload.result()
+        logging.info("Converted {} rows into {} outputs".format(total_rows[0], len(outputs)))
+        return outputs
+
+    @staticmethod
+    def offer_batch(batch_queue:queue.Queue, batch:'pd.DataFrame', writer:'concurrent.futures.Future',
+                    raise_failure:bool=True):
+        """
+        This method puts a batch into the queue of a writer, giving up when the writer has stopped so a failed
+        writer can not block the reading forever
+
+        :param batch_queue: queue of the writer
+        :param batch: batch, None marks the end of the batches
+        :param writer: future of the writer
+        :param raise_failure: if True the exception of a failed writer is raised
+        :return: None
+        """
+        while not writer.done():
+            try:
+                batch_queue.put(batch, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        if raise_failure:
+            writer.result()
+
+    def part_files_generation(self, input_bucket_name:str, input_prefix:str)->str:
+        """
+        This method returns the version of a prefix of part files, a digest of the name and generation of every
+        part, so adding, removing or rewriting a part changes it
+
+        :param input_bucket_name: input bucket name
+        :param input_prefix: gcs prefix of the part files
+        :return: hex digest
+        """
+        return self.parts_generation(self.list_part_files(input_bucket_name, input_prefix))
+
+    def list_part_files(self, input_bucket_name:str, input_prefix:str)->list:
+        """
+        This method lists the part files directly under input_prefix
+
+        :param input_bucket_name: input bucket name
+        :param input_prefix: gcs prefix of the part files
+        :return: list of blobs sorted by name
+        """
+        parts = self.gcs.list_files(input_prefix, input_bucket_name)
+        if not parts:
+            raise StorageFileNotFound("No part files found at gs://{}/{}".format(input_bucket_name, input_prefix))
+        return parts
+
+    @staticmethod
+    def parts_generation(parts:list)->str:
+        """
+        This method hashes the name and generation of every part, see part_files_generation
+
+        :param parts: blobs of the part files
+        :return: hex digest
+        """
+        return hashlib.sha256(json.dumps([[part.name, part.generation] for part in parts]).encode('utf-8')).hexdigest()
+
+    def get_output_object_path(self, output_file_path:str, dataset:bool=False)->str:
+        """
+        This method returns the object which marks a finished output, the file itself or the manifest of a
+        dataset (partitioned or one file per part)
+
+        :param output_file_path: output file path
+        :param dataset: True if the output is a directory of files with a manifest
+        :return: gcs path of the object
+        """
+        if dataset:
+            return '/'.join([output_file_path.rstrip('/'), self.dataset_manifest_name])
+        return output_file_path
+
+    @staticmethod
+    def conversion_fingerprint(*settings)->str:
+        """
+        This method hashes the input location and every setting which changes the converted output, two
+        conversions with the same fingerprint and input generation produce the same output
+
+        :param settings: input location, schema, output location, format and writer options of the conversion
+        :return: hex digest
+        """
+        def encode(value):
+            return value.to_dict() if isinstance(value, ParquetWriterProfile) else str(value)
+        return hashlib.sha256(json.dumps(settings, sort_keys=True, default=encode).encode('utf-8')).hexdigest()
+
+    def find_reusable_conversion(self, fingerprint:str, input_generation:'int/str', output_bucket:str,
+                                 output_object_path:str):
+        """
+        This method looks for a successful ParquetWriteTask which converted the same generation of the input with
+        the same settings and whose output objects still exist unchanged. Only object metadata is read, nothing is
+        downloaded
+
+        :param fingerprint: conversion_fingerprint of the conversion
+        :param input_generation: generation of the input blob, or part_files_generation of a prefix of part files
+        :param output_bucket: output bucket name
+        :param output_object_path: path returned by get_output_object_path
+        :return: the earlier task entity, None if the report has to be converted
+        """
+        # several runs may have converted the input, the latest one wrote the current output. They are ordered here
+        # and not by the query, which would need a composite index
+        entries = self.db.get_datastore_entries(self.datastore_client,
+                                                {'conversion_fingerprint': fingerprint,
+                                                 'input_generation': input_generation,
+                                                 'status': 'success'},
+                                                self.db.parquet_write_namespace)
+        if not entries:
+            return None
+        entry = max(entries, key=self.db.modified_order)
+        output_blob = self.upload_client.bucket(output_bucket).get_blob(output_object_path)
+        if output_blob is None or output_blob.generation != entry.get('output_generation'):
+            logging.info("Output {} changed since task {}, converting again".format(output_object_path, entry.key))
+            return None
+        for output in entry.get('outputs') or []:
+            output_blob = self.upload_client.bucket(output['output_bucket']).get_blob(output['output_file_path'])
+            if output_blob is None or output_blob.generation != output.get('output_generation'):
+                logging.info("Output {} changed since task {}, converting again".format(output['output_file_path'],
+                                                                                      entry.key))
+                return None
+        return entry
+
+    def plan_conversion(self, input_bucket_name:str, input_path:str, column_name_for_report:list,
+                        column_data_type_for_report:'dataframe schema', output_format:'parquet/csv/excel',
+                        output_file_name:str, output_bucket:str, output_path:str, delimiter:'/,*,&,@ etc',
+                        partition_by:list=None, max_rows_per_file:int=None,
+                        writer_profile:'ParquetWriterProfile/dict/auto'=None, profile_objective:str='size',
+                        part_files_layout:str=None, output_targets:list=None, parallel_workers:int=None,
+                        parallel_layout:str='single')->dict:
+        """
+        This method resolves the output of a conversion and versions its input, so it can be checked with
+        find_reusable_conversion before anything is downloaded. Only object metadata is read. The parameters are the
+        ones of write_merge_report_as_parquet
+
+        :return: dict with output_file_name, output_bucket, output_file_path, output_object_path, output_targets
+                 (completed by get_output_targets, None without targets), input_generation, input_crc32c and
+                 fingerprint
+        """
+        if output_targets:
+            output_targets = self.get_output_targets(output_targets, output_format, output_file_name, output_path,
+                                                     output_bucket, writer_profile)
+            output_file_name = output_targets[0]['output_file_name']
+            output_bucket = output_targets[0]['output_bucket']
+            output_path = output_targets[0]['output_path']
+        output_file_path = os.path.join(output_path, output_file_name)
+        output_object_path = self.get_output_object_path(
+            output_file_path, bool(partition_by) or part_files_layout == 'per_part' or
+            bool(parallel_workers) and parallel_layout == 'parts')
+
+        if part_files_layout:
+            input_generation = self.part_files_generation(input_bucket_name, input_path)
+            input_crc32c = None
+        else:
+            input_blob = self.storage_client.bucket(input_bucket_name).get_blob(input_path)
+            if input_blob is None:
+                raise StorageFileNotFound("No input file found at gs://{}/{}".format(input_bucket_name, input_path))
+            input_generation = input_blob.generation
+            input_crc32c = input_blob.crc32c
+        fingerprint = self.conversion_fingerprint(input_bucket_name, input_path, column_name_for_report,
+                                                  column_data_type_for_report, output_format, output_bucket,
+                                                  output_file_path, delimiter, partition_by, max_rows_per_file,
+                                                  writer_profile, profile_objective,
+                                                  # only added when set, fingerprints of merged reports are kept
+                                                  *([part_files_layout] if part_files_layout else []),
+                                                  *([output_targets] if output_targets else []),
+                                                  # the worker count does not change the output, the layout does
+                                                  *([('parallel', parallel_layout)] if parallel_workers else []))
+        return {'output_file_name': output_file_name, 'output_bucket': output_bucket,
+                'output_file_path': output_file_path, 'output_object_path': output_object_path,
+                'output_targets': output_targets, 'input_generation': input_generation,
+                'input_crc32c': input_crc32c, 'fingerprint': fingerprint}
+
+    def plan_job_conversion(self, job:dict, input_bucket_name:str, input_path:str)->dict:
+        """
+        This method runs plan_conversion for a job of write_merge_reports_as_parquet
+
+        :param job: keyword arguments of write_merge_report_as_parquet
+        :param input_bucket_name: bucket of the merged report of the job
+        :param input_path: gcs path of the merged report of the job
+        :return: result of plan_conversion
+        """
+        return self.plan_conversion(input_bucket_name, input_path, job['column_name_for_report'],
+                                    job['column_data_type_for_report'], job['output_format'],
+                                    job['output_file_name'], job['output_bucket'], job['output_path'],
+                                    job['delimiter'], job.get('partition_by'), job.get('max_rows_per_file'),
+                                    job.get('writer_profile'), job.get('profile_objective', 'size'),
+                                    job.get('part_files_layout'), job.get('output_targets'),
+                                    job.get('parallel_workers'), job.get('parallel_layout', 'single'))
+
+    @staticmethod
+    def reused_conversion(reused_entry:'datastore.Entity')->dict:
+        """
+        This method builds the result of convert_merged_report from the task which already converted the input
+
+        :param reused_entry: entity returned by find_reusable_conversion
+        :return: dict like convert_merged_report with the output_generation of the earlier task
+        """
+        logging.info("Input generation {} was already converted by task {}, skipping conversion".format(
+            reused_entry.get('input_generation'), reused_entry.key))
+        conversion = ParquetWrite.conversion_result(reused_entry.get('total_row_in_merged_report'), None)
+        conversion['writer_profile'] = reused_entry.get('writer_profile')
+        conversion['part_rows'] = reused_entry.get('part_rows')
+        conversion['outputs'] = reused_entry.get('outputs')
+        conversion['output_generation'] = reused_entry.get('output_generation')
+        return conversion
+
+    def record_output_generations(self, conversion:dict, plan:dict):
+        """
+        This method adds the generations of the objects a conversion wrote, find_reusable_conversion checks them
+        before the output is reused
+
+        :param conversion: result of convert_merged_report, updated in place
+        :param plan: result of plan_conversion
+        :return: None
+        """
+        output_blob = self.upload_client.bucket(plan['output_bucket']).get_blob(plan['output_object_path'])
+        conversion['output_generation'] = output_blob.generation if output_blob is not None else None
+        for output in conversion.get('outputs') or []:
+            output_blob = self.upload_client.bucket(output['output_bucket']).get_blob(output['output_file_path'])
+            output['output_generation'] = output_blob.generation if output_blob is not None else None
+
+    @staticmethod
+    def conversion_task_properties(plan:dict, conversion:dict, reused_output:bool)->dict:
+        """
+        This method returns the properties a conversion adds to its ParquetWriteTask entity
+
+        :param plan: result of plan_conversion
+        :param conversion: result of convert_merged_report or reused_conversion
+        :param reused_output: True if the output of an earlier task was reused
+        :return: dict of properties
+        """
+        return {'writer_profile': conversion['writer_profile'],
+                'conversion_fingerprint': plan['fingerprint'],
+                'input_generation': plan['input_generation'],
+                'input_crc32c': plan['input_crc32c'],
+                'part_rows': conversion.get('part_rows'),
+                'outputs': conversion.get('outputs'),
+                'output_generation': conversion.get('output_generation'),
+                'reused_output': reused_output,
+                'stage_metrics': conversion.get('stage_metrics')}
 
     def write_merge_report_as_parquet(self, dag_id:'unique dag identifier', run_id:str, report_date:datetime.datetime,
                                       output_file_name:str, output_bucket:str, output_path:str, output_format:'parquet/csv/excel',
                                       column_name_for_report:str, column_data_type_for_report:'data type of column',
                                       report_type, kind:'namespace', input_path_field_name:str, filter_map:dict,
                                       input_bucket_field_name:str, row_count_field_name:str,
-                                      airflow_task_id: 'unique name for task ', delimiter:'/,*,&,@ etc',  run_mode='normal'):
+                                      airflow_task_id: 'unique name for task ', delimiter:'/,*,&,@ etc',  run_mode='normal',
+                                      batch_size:int=None, stream:bool=False, preflight:bool=False,
+                                      partition_by:list=None, max_rows_per_file:int=None,
+                                      writer_profile:'ParquetWriterProfile/dict/auto'=None, profile_objective:str='size',
+                                      force:bool=False, metrics_textfile:str=None, part_files_layout:str=None,
+                                      output_targets:list=None, parser_engine:str=None, parallel_workers:int=None,
+                                      parallel_layout:str='single'):
 
         """
         This method reads the merged report from the input path location convert it output format and write back to gcs at
@@ -111,51 +1562,91 @@ class ParquetWrite:
         :param output_format: format for output file
         :param column_data_type_for_report: data types of report
         :param column_name_for_report: column names of report
+        :param batch_size: if given, the report is converted batch_size rows at a time to bound memory usage
+        :param stream: if True the report is streamed from the input blob to the output blob without using local disk
+        :param preflight: if True the row and column counts of the report are checked before it is converted
+        :param partition_by: if given, the parquet output is written as hive partitioned dataset by these columns in
+                             the directory output_path/output_file_name
+        :param max_rows_per_file: rows after which a partition of the dataset starts a new file
+        :param writer_profile: parquet writer settings as ParquetWriterProfile or dict, or 'auto' to benchmark
+                               candidate settings on a sample of the report. The settings used are recorded on the
+                               ParquetWriteTask entity
+        :param profile_objective: what the auto writer profile optimises, size or speed
+        :param force: if True the report is converted even when an earlier successful task already converted the
+                      same input generation with the same settings and its output still exists
+        :param metrics_textfile: if given, the stage metrics are also written to this prometheus textfile
+        :param part_files_layout: if given, the input path of the entry is the prefix of the part files, which are
+                                  converted without a merge step into one output ('single') or into one file per
+                                  part in the directory output_path/output_file_name ('per_part'). The rows of the
+                                  parts add up to the total row checked against the row count field
+        :param output_targets: if given, the report is parsed once and written to every target instead of the
+                               single output of output_format and output_file_name, see get_output_targets. The
+                               first target is the output of the ParquetWriteTask entity, every output is recorded
+                               with its row count and size in its outputs property
+        :param parser_engine: parser of the report for this run, native or python, defaults to the class attribute
+                              parser_engine
+        :param parallel_workers: if given, the report is split on record boundaries and converted by this many
+                                 processes, for large reports on machines with many cores
+        :param parallel_layout: output of a parallel conversion, one file ('single', the same rows in the same
+                                order as a serial conversion) or one file per byte range in the directory
+                                output_path/output_file_name ('parts')
         :return: None
         """
+        self.stage_metrics = StageMetrics(self.metrics_hooks)
+        self.parser_engine = parser_engine or type(self).parser_engine
         try:
-            task_entries = self.db.get_datastore_entries(self.datastore_client, filter_map, kind)
+            with self.stage_metrics.stage('datastore_query'):
+                # only the first matching entry is used, so there is no need to fetch the others
+                task_entries = self.db.get_datastore_entries(self.datastore_client, filter_map, kind, limit=1)
             logging.info(task_entries)
 
-            if len(task_entries) > 0 and \
-                    task_entries[0]['status'] == 'success':
-                merge_entry = task_entries[0]
-            else:
-                raise InvalidJobConfig("No input file found", report_date)
-
-            input_bucket_name = merge_entry.get(input_bucket_field_name)
-            input_path = merge_entry.get(input_path_field_name)
+            merge_entry, input_bucket_name, input_path = self.get_merge_entry_input(task_entries, report_date,
+                                                                                    input_bucket_field_name,
+                                                                                    input_path_field_name, kind,
+                                                                                    filter_map)
             job_id = merge_entry.get('job_id')
-            logging.info(input_path)
-            if input_path is None:
-                raise StorageFileNotFound("No input file path found for"
-                                          " field {} , kind {}  and filter {}".format(
-                    input_path_field_name, kind, filter_map))
-
             row_count_in_part_file = merge_entry.get(row_count_field_name)
 
-            input_file_name = input_path.split('/')[-1]
-
-            downloaded_merged_report = self.get_blob_for_merged_report(input_bucket_name,
-                                                                       input_path,
-                                                                       input_file_name)
-            output_file_path = os.path.join(output_path, output_file_name)
-
-            total_row = self.put_parquet_file_to_gcs(downloaded_merged_report, column_name_for_report,
-                                                     column_data_type_for_report, output_format,
-                                                     output_file_name, output_file_path, output_bucket, delimiter)
+            plan = self.plan_conversion(input_bucket_name, input_path, column_name_for_report,
+                                        column_data_type_for_report, output_format, output_file_name, output_bucket,
+                                        output_path, delimiter, partition_by, max_rows_per_file, writer_profile,
+                                        profile_objective, part_files_layout, output_targets, parallel_workers,
+                                        parallel_layout)
+            reused_entry = None if force else self.find_reusable_conversion(plan['fingerprint'],
+                                                                            plan['input_generation'],
+                                                                            plan['output_bucket'],
+                                                                            plan['output_object_path'])
+            if reused_entry is not None:
+                conversion = self.reused_conversion(reused_entry)
+            else:
+                conversion = self.convert_merged_report(input_bucket_name, input_path, column_name_for_report,
+                                                        column_data_type_for_report, output_format,
+                                                        plan['output_file_name'], plan['output_file_path'],
+                                                        plan['output_bucket'], delimiter, batch_size, stream,
+                                                        preflight,
+                                                        None if run_mode == 'manual' else row_count_in_part_file,
+                                                        partition_by, max_rows_per_file, writer_profile,
+                                                        profile_objective, part_files_layout, plan['output_targets'],
+                                                        parallel_workers=parallel_workers,
+                                                        parallel_layout=parallel_layout,
+                                                        input_generation=plan['input_generation'])
+                self.record_output_generations(conversion, plan)
+            total_row = conversion['total_row']
             if total_row == row_count_in_part_file or run_mode == 'manual':
                 if run_mode == 'manual':
-                logging.info("Row count in merged file in manual run is {}".format(total_row))
-                
-              self.db.handle_report_parquet_write_task(self.datastore_client, dag_id, run_id, merge_entry.key.id,
-                                                         output_file_name, report_date, column_name_for_report,
-                                                         column_data_type_for_report, output_file_path, None,
-                                                         '', 'success', output_bucket, total_row,
-                                                         row_count_in_part_file, report_type, kind, filter_map,
-                                                         airflow_task_id, job_id)
-
-         
+                    logging.info("Row count in merged file in manual run is {}".format(total_row))
+
+                task_properties = self.conversion_task_properties(plan, conversion, reused_entry is not None)
+                # the datastore_put stage itself is only logged
+                task_properties['stage_metrics'] = self.stage_metrics.to_dict()
+                with self.stage_metrics.stage('datastore_put'):
+                    self.db.handle_report_parquet_write_task(self.datastore_client, dag_id, run_id,
+                                                             merge_entry.key.id, plan['output_file_name'],
+                                                             report_date, column_name_for_report,
+                                                             column_data_type_for_report, plan['output_file_path'],
+                                                             None, '', 'success', plan['output_bucket'], total_row,
+                                                             row_count_in_part_file, report_type, kind, filter_map,
+                                                             airflow_task_id, job_id, task_properties)
             else:
                 ex = DataCountMismatch("Row count mismatch exception",
                                        abs(total_row - row_count_in_part_file))
@@ -177,3 +1668,315 @@ class ParquetWrite:
             else:
                 logging.error(e)
                 raise e
+        finally:
+            self.report_stage_metrics(metrics_textfile, dag_id=dag_id, run_id=run_id,
+                                      airflow_task_id=airflow_task_id)
+
+    def report_stage_metrics(self, metrics_textfile:str=None, **labels):
+        """
+        This method emits the stage metrics of the last run as JSON log line and optionally as prometheus textfile.
+        A failing textfile write is logged and does not fail the run
+
+        :param metrics_textfile: path of the prometheus textfile, not written if None
+        :param labels: labels of the run, ex - dag_id, run_id
+        :return: None
+        """
+        self.stage_metrics.log_json(**labels)
+        if metrics_textfile:
+            try:
+                self.stage_metrics.write_prometheus_textfile(metrics_textfile, **labels)
+            except Exception:
+                logging.exception("Could not write stage metrics to {}".format(metrics_textfile))
+
+    def write_merge_reports_as_parquet(self, jobs:list, max_workers:int=None)->list:
+        """
+        This method runs write_merge_report_as_parquet for many reports at once. The merge entries of all jobs are
+        resolved with as few Datastore queries as possible, jobs whose input was already converted with the same
+        settings reuse the earlier output (unless the job sets force), the other conversions run concurrently in a
+        process pool (one at a time in this process if it can not be passed to the pool, see worker_settings) and
+        the ParquetWriteTask entities of all successful jobs are written with a single put_multi. A failing job does
+        not stop the other jobs, its exception is returned in its result instead
+
+        :param jobs: list of dict, each holding the keyword arguments of write_merge_report_as_parquet
+        :param max_workers: number of conversions running at the same time, defaults to the number of cpus
+        :return: list of dict with job, status, total_row and exception for every job in the order of jobs
+        """
+        results = [{'job': job, 'status': 'failure', 'total_row': None, 'exception': None} for job in jobs]
+        merge_inputs = self.resolve_merge_inputs(jobs, results)
+        plans, conversions = self.plan_merge_conversions(jobs, results, merge_inputs)
+
+        futures = {}
+        executor, worker = self.conversion_executor(max_workers)
+        with executor:
+            for index, plan in plans.items():
+                if index in conversions:
+                    continue
+                job = jobs[index]
+                merge_entry, input_bucket_name, input_path = merge_inputs[index]
+                futures[index] = executor.submit(convert_merged_report_job, worker,
+                                                 input_bucket_name, input_path,
+                                                 job['column_name_for_report'], job['column_data_type_for_report'],
+                                                 job['output_format'], plan['output_file_name'],
+                                                 plan['output_file_path'], plan['output_bucket'], job['delimiter'],
+                                                 batch_size=job.get('batch_size'), stream=job.get('stream', False),
+                                                 preflight=job.get('preflight', False),
+                                                 expected_row_count=self.expected_row_count(job, merge_entry),
+                                                 partition_by=job.get('partition_by'),
+                                                 max_rows_per_file=job.get('max_rows_per_file'),
+                                                 writer_profile=job.get('writer_profile'),
+                                                 profile_objective=job.get('profile_objective', 'size'),
+                                                 part_files_layout=job.get('part_files_layout'),
+                                                 output_targets=plan['output_targets'],
+                                                 parser_engine=job.get('parser_engine'),
+                                                 parallel_workers=job.get('parallel_workers'),
+                                                 parallel_layout=job.get('parallel_layout', 'single'),
+                                                 input_generation=plan['input_generation'])
+
+        for index, future in futures.items():
+            try:
+                conversions[index] = future.result()
+            except Exception as e:
+                logging.exception("exception occur in converting {}".format(jobs[index]['output_file_name']))
+                results[index]['exception'] = e
+        self.record_merge_report_conversions(jobs, results, merge_inputs, conversions, plans)
+        return results
+
+    def plan_merge_conversions(self, jobs:list, results:list, merge_inputs:dict)->tuple:
+        """
+        This method runs plan_job_conversion for every resolved job and looks for a reusable conversion of it, like
+        write_merge_report_as_parquet does for a single report. Jobs which can not be planned get the exception in
+        their result
+
+        :param jobs: list of dict, each holding the keyword arguments of write_merge_report_as_parquet
+        :param results: results of the jobs
+        :param merge_inputs: result of resolve_merge_inputs
+        :return: dict of job index to plan and dict of job index to the reused_conversion of the jobs which are not
+                 converted again
+        """
+        plans = {}
+        reused = {}
+        for index, (_, input_bucket_name, input_path) in sorted(merge_inputs.items()):
+            job = jobs[index]
+            try:
+                plans[index] = self.plan_job_conversion(job, input_bucket_name, input_path)
+                reused_entry = None if job.get('force', False) else self.find_reusable_conversion(
+                    plans[index]['fingerprint'], plans[index]['input_generation'], plans[index]['output_bucket'],
+                    plans[index]['output_object_path'])
+            except Exception as e:
+                logging.exception("exception occur in planning {}".format(job['output_file_name']))
+                results[index]['exception'] = e
+                plans.pop(index, None)
+                continue
+            if reused_entry is not None:
+                reused[index] = self.reused_conversion(reused_entry)
+                plans[index]['reused'] = True
+        return plans, reused
+
+    def resolve_merge_inputs(self, jobs:list, results:list)->dict:
+        """
+        This method finds the merge entry and the merged report of every job, querying every kind once. Jobs whose
+        merge entry can not be resolved get the exception in their result
+
+        :param jobs: list of dict, each holding the keyword arguments of write_merge_report_as_parquet
+        :param results: results of the jobs
+        :return: dict of job index to (merge_entry, input_bucket_name, input_path)
+        """
+        jobs_by_kind = {}
+        for index, job in enumerate(jobs):
+            jobs_by_kind.setdefault(job['kind'], []).append(index)
+        task_entries = [None] * len(jobs)
+        for kind, indexes in jobs_by_kind.items():
+            try:
+                entries = self.db.get_datastore_entries_for_filter_maps(self.datastore_client,
+                                                                        [jobs[index]['filter_map'] for index in indexes],
+                                                                        kind)
+                for index, job_entries in zip(indexes, entries):
+                    task_entries[index] = job_entries
+            except Exception as e:
+                logging.exception("exception occur in querying kind {}".format(kind))
+                for index in indexes:
+                    results[index]['exception'] = e
+
+        merge_inputs = {}
+        for index, job in enumerate(jobs):
+            if task_entries[index] is None:
+                continue
+            try:
+                merge_inputs[index] = self.get_merge_entry_input(
+                    task_entries[index], job['report_date'], job['input_bucket_field_name'],
+                    job['input_path_field_name'], job['kind'], job['filter_map'])
+            except Exception as e:
+                results[index]['exception'] = e
+        return merge_inputs
+
+    @staticmethod
+    def expected_row_count(job:dict, merge_entry:'datastore.Entity'):
+        """
+        This method returns the row count a job is checked against, None for manual runs
+
+        :param job: keyword arguments of write_merge_report_as_parquet
+        :param merge_entry: merge entry of the job
+        :return: row count or None
+        """
+        if job.get('run_mode', 'normal') == 'manual':
+            return None
+        return merge_entry.get(job['row_count_field_name'])
+
+    def record_merge_report_conversions(self, jobs:list, results:list, merge_inputs:dict, conversions:dict,
+                                        plans:dict):
+        """
+        This method checks the row counts of the converted jobs and writes the ParquetWriteTask entities of the
+        successful ones with a single put_multi, with the same fingerprint, input and output generations and stage
+        metrics write_merge_report_as_parquet records
+
+        :param jobs: list of dict, each holding the keyword arguments of write_merge_report_as_parquet
+        :param results: results of the jobs, updated in place
+        :param merge_inputs: result of resolve_merge_inputs
+        :param conversions: dict of job index to the result of convert_merged_report or reused_conversion
+        :param plans: dict of job index to the result of plan_job_conversion, see plan_merge_conversions
+        :return: None
+        """
+        tasks = []
+        task_indexes = []
+        for index, conversion in sorted(conversions.items()):
+            job = jobs[index]
+            merge_entry = merge_inputs[index][0]
+            plan = plans[index]
+            reused_output = plan.get('reused', False)
+            total_row = conversion['total_row']
+            results[index]['total_row'] = total_row
+            row_count_in_part_file = merge_entry.get(job['row_count_field_name'])
+            if total_row != row_count_in_part_file and job.get('run_mode', 'normal') != 'manual':
+                results[index]['exception'] = DataCountMismatch("Row count mismatch exception",
+                                                                abs(total_row - row_count_in_part_file))
+                logging.error(results[index]['exception'])
+                continue
+            if not reused_output:
+                try:
+                    self.record_output_generations(conversion, plan)
+                except Exception as e:
+                    logging.exception("exception occur in reading the output of {}".format(job['output_file_name']))
+                    results[index]['exception'] = e
+                    continue
+            tasks.append(dict(dag_id=job['dag_id'], run_id=job['run_id'], report_merged_task_id=merge_entry.key.id,
+                              output_file_name=plan['output_file_name'], report_date=job['report_date'],
+                              report_column=job['column_name_for_report'],
+                              report_column_datatype=job['column_data_type_for_report'],
+                              gcs_output_file_path=plan['output_file_path'], exception=None, exception_details='',
+                              job_status='success', output_bucket=plan['output_bucket'], total_row=total_row,
+                              row_count_in_part_file=row_count_in_part_file, report_type=job['report_type'],
+                              kind=job['kind'], filter_map=job['filter_map'], airflow_task_id=job['airflow_task_id'],
+                              job_id=merge_entry.get('job_id'),
+                              task_properties=self.conversion_task_properties(plan, conversion, reused_output)))
+            task_indexes.append(index)
+
+        try:
+            self.db.handle_report_parquet_write_tasks(self.datastore_client, tasks)
+            for index in task_indexes:
+                results[index]['status'] = 'success'
+        except Exception as e:
+            logging.exception("exception occur in writing ParquetWriteTask entities")
+            for index in task_indexes:
+                results[index]['exception'] = e
+
+
+def convert_merged_report_job(worker:'dict/ParquetWrite', *args, parser_engine:str=None, **kwargs)->dict:
+    """
+    Process pool entry point of ParquetWrite.write_merge_reports_as_parquet. Every job converts with its own
+    ParquetWrite in a private temporary directory so concurrent jobs never share local files
+
+    :param worker: worker of ParquetWrite.conversion_executor, the worker_settings the ParquetWrite of the process is
+                   built from or the ParquetWrite itself when the job runs in its process
+    :param args: positional arguments of ParquetWrite.convert_merged_report
+    :param parser_engine: parser of the report, defaults to the parser_engine of the worker
+    :param kwargs: keyword arguments of ParquetWrite.convert_merged_report without work_dir
+    :return: result of ParquetWrite.convert_merged_report with the stage_metrics of the conversion
+    """
+    parquet_write = job_parquet_write(worker, parser_engine)
+    with tempfile.TemporaryDirectory() as work_dir:
+        conversion = parquet_write.convert_merged_report(*args, work_dir=work_dir, **kwargs)
+    conversion['stage_metrics'] = parquet_write.stage_metrics.to_dict()
+    return conversion
+
+
+def convert_downloaded_report_job(worker:'dict/ParquetWrite', input_file_name:str, column_name_for_report:list,
+                                  column_data_type_for_report:'dataframe schema', output_format:'parquet/csv/excel',
+                                  output_file_name:str, delimiter:'/,*,&,@ etc', batch_size:int=None,
+                                  preflight:bool=False, expected_row_count:int=None,
+                                  writer_profile:'ParquetWriterProfile/dict/auto'=None,
+                                  profile_objective:str='size', parser_engine:str=None)->dict:
+    """
+    Process pool entry point of the convert stage of ReportPipeline. Converts an already downloaded report into a
+    local output file, downloading and uploading are left to the pipeline
+
+    :param worker: worker of ParquetWrite.conversion_executor, see convert_merged_report_job
+    :param input_file_name: input file name in local file system
+    :param column_name_for_report: list of columns for data frame
+    :param column_data_type_for_report: schema of data frame
+    :param output_format: output format of file
+    :param output_file_name: output file name in local file system
+    :param delimiter: delimiter of data frame
+    :param batch_size: if given, the report is converted batch_size rows at a time
+    :param preflight: if True the report is validated with validate_merged_report before conversion
+    :param expected_row_count: row count the pre-flight validation checks against, not checked if None
+    :param writer_profile: parquet writer settings as profile or dict, or 'auto'
+    :param profile_objective: what the auto writer profile optimises, size or speed
+    :param parser_engine: parser of the report, defaults to the parser_engine of the worker
+    :return: dict with total_row, writer_profile and the stage_metrics of the conversion, like
+             convert_merged_report_job
+    """
+    parquet_write = job_parquet_write(worker, parser_engine)
+    if preflight:
+        parquet_write.validate_merged_report(input_file_name, column_name_for_report, delimiter, expected_row_count)
+    writer_profile = parquet_write.resolve_writer_profile(writer_profile, output_format,
+                                                          lambda: open(input_file_name, 'rb'),
+                                                          column_name_for_report, column_data_type_for_report,
+                                                          delimiter, profile_objective)
+    total_row = parquet_write.write_report_to_file(input_file_name, column_name_for_report,
+                                                   column_data_type_for_report, output_format, output_file_name,
+                                                   delimiter, batch_size, writer_profile)
+    conversion = ParquetWrite.conversion_result(total_row, writer_profile)
+    conversion['stage_metrics'] = parquet_write.stage_metrics.to_dict()
+    return conversion
+
+
+def job_parquet_write(worker:'dict/ParquetWrite', parser_engine:str=None)->ParquetWrite:
+    """
+    this function returns the ParquetWrite a job of a conversion executor converts with
+
+    :param worker: worker of ParquetWrite.conversion_executor
+    :param parser_engine: parser of the report, defaults to the parser_engine of the worker
+    :return: ParquetWrite
+    """
+    if not isinstance(worker, ParquetWrite):
+        worker = ParquetWrite.from_worker_settings(worker)
+    return worker.job_worker(parser_engine)
+
+
+def convert_byte_range_job(input_file_name:str, start:int, end:int, column_name_for_report:list,
+                           column_data_type_for_report:'dataframe schema', output_format:'parquet/csv/arrow',
+                           output_file_name:str, delimiter:'/,*,&,@ etc', batch_size:int, header:bool=True,
+                           writer_profile:dict=None, parser_engine:str=None)->int:
+    """
+    Process pool entry point of ParquetWrite.put_report_in_parallel. Converts the records in the bytes start to end
+    of the local report into a local file, see ParquetWrite.write_byte_range
+
+    :param input_file_name: input file name in local file system
+    :param start: first byte of the range
+    :param end: end of the range (exclusive)
+    :param column_name_for_report: list of columns for data frame
+    :param column_data_type_for_report: schema of data frame
+    :param output_format: output format of file, parquet, csv or arrow
+    :param output_file_name: output file name in local file system
+    :param delimiter: delimiter of data frame
+    :param batch_size: number of rows read per batch
+    :param header: if False csv is written without header
+    :param writer_profile: parquet writer settings as dict
+    :param parser_engine: parser of the report, defaults to ParquetWrite.parser_engine
+    :return: number of rows
+    """
+    parquet_write = ParquetWrite()
+    parquet_write.parser_engine = parser_engine or ParquetWrite.parser_engine
+    return parquet_write.write_byte_range(input_file_name, start, end, column_name_for_report,
+                                          column_data_type_for_report, output_format, output_file_name, delimiter,
+                                          batch_size, header, writer_profile)
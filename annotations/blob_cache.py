@@ -0,0 +1,160 @@
+"""
+this file contain a size bounded local cache
+for blobs downloaded from cloud storage
+"""
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+from parquet_write_automation.cloud.scripts.main.local_storage import copy_file
+
+
+class BlobCache:
+    """
+    on disk LRU cache of downloaded blobs keyed by (bucket, path, generation).
+    A lookup only reads the metadata of the blob, so a changed object is never
+    served from the cache and an unchanged one is never downloaded twice.
+    Files are written to a temporary file and renamed into place. Entries are
+    stored and copied out under a shared file lock and evicted under an
+    exclusive one, so the tasks of a node can share the directory
+    """
+    lock_file_name = '.lock'
+    file_suffix = '.blob'
+
+    def __init__(self, cache_dir:str, max_bytes:int):
+        """
+        :param cache_dir: directory of the cache, shared by the tasks of a node
+        :param max_bytes: size budget of the cache, least recently used files are evicted above it
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(bucket_name:str, cloud_path:str, generation:int)->str:
+        """
+        this function builds the cache key of a blob
+        :param bucket_name: bucket name
+        :param cloud_path: path of the blob inside the bucket
+        :param generation: generation of the blob
+        :return: cache key
+        """
+        return hashlib.sha256(repr((bucket_name, cloud_path, generation)).encode('utf-8')).hexdigest()
+
+    def cache_file(self, key:str)->str:
+        """
+        this function returns the local file of a cache key
+        :param key: cache key
+        :return: path
+        """
+        return os.path.join(self.cache_dir, key + self.file_suffix)
+
+    def fetch(self, blob:'google.cloud.storage.blob.Blob', destination:str, generation:int=None)->str:
+        """
+        this function puts the current generation of the blob at destination,
+        from the cache if it holds that generation or else by downloading it
+        into the cache first. destination is a copy (a reflink where the file
+        system supports it) of the cached file, so writing it never changes the
+        cache
+        :param blob: blob to fetch
+        :param destination: local file path
+        :param generation: generation to fetch instead of the current one, downloading it fails if the blob does
+                           not have this generation anymore
+        :return: destination
+        """
+        if generation is None:
+            blob.reload()
+            generation = blob.generation
+        key = self.make_key(blob.bucket.name, blob.name, generation)
+        cache_file = self.cache_file(key)
+        with self._file_lock(fcntl.LOCK_SH):
+            if os.path.exists(cache_file):
+                # the modification time orders the files for eviction
+                os.utime(cache_file)
+                self._place(cache_file, destination)
+                self._count('hits')
+                logging.info("Blob cache hit for gs://{}/{}#{}".format(blob.bucket.name, blob.name, generation))
+                return destination
+        self._count('misses')
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            blob.download_to_filename(temp_path, if_generation_match=generation)
+            # stored and copied out under the lock, so it can not be evicted in between
+            with self._file_lock(fcntl.LOCK_SH):
+                os.replace(temp_path, cache_file)
+                self._place(cache_file, destination)
+        except Exception:
+            self._remove(temp_path)
+            raise
+        self.evict()
+        return destination
+
+    def evict(self):
+        """
+        this function removes the least recently used files until the cache fits into max_bytes
+        :return: None
+        """
+        with self._file_lock(fcntl.LOCK_EX):
+            files = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(self.file_suffix):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+                self._count('evictions')
+
+    def stats(self)->dict:
+        """
+        this function returns the counters of the cache
+        :return: dict with hits, misses and evictions
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def _count(self, counter:str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @contextlib.contextmanager
+    def _file_lock(self, operation:int):
+        with open(os.path.join(self.cache_dir, self.lock_file_name), 'a') as lock:
+            fcntl.flock(lock, operation)
+            yield
+
+    @staticmethod
+    def _place(cache_file:str, destination:str):
+        directory = os.path.dirname(os.path.abspath(destination))
+        os.makedirs(directory, exist_ok=True)
+        # copied under a temporary name first, so destination is replaced atomically
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            copy_file(cache_file, temp_path)
+            os.replace(temp_path, destination)
+        except Exception:
+            BlobCache._remove(temp_path)
+            raise
+
+    @staticmethod
+    def _remove(file_path:str):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
@@ -1,37 +1,67 @@
+import threading
+
 from parquet_write_automation.cloud.scripts.main.cloud import Cloud
 from parquet_write_automation.cloud.scripts.main.gcs import Gcs
+from parquet_write_automation.cloud.scripts.main.local_storage import LocalStorage
 
 
 class CloudFactory:
     """
     Factory class for all class which implements Cloud
     all class name(in lower case) and class should be added
-    in __all_storage dictionary in order to get there factory method
+    in __all_storage dictionary in order to get there factory method.
+    Instances are created once per process and shared between callers
     """
     _all_storage = {
         "gcs": Gcs,
+        "local": LocalStorage,
         "abstract": Cloud
 
     }
+    _instances = {}
+    _lock = threading.Lock()
 
     @classmethod
-    def get_cloud_storage(cls, cloud_name: str):
+    def get_cloud_storage(cls, cloud_name: str, refresh: bool = False):
         """
         Factory method to get cloud storage instance based on
-        registered cloud name
+        registered cloud name. The instance is created on first call and
+        the same instance is returned afterwards
         :param cloud_name: name of cloud storage
+        :param refresh: if True the cached instance is closed and replaced by a new one
         :return: instance
         """
         if not isinstance(cloud_name, str):
             raise TypeError("cloud_name should be of string type")
 
         key = cloud_name.lower()
-        try:
-            return cls._all_storage[key]()
-        except KeyError:
+        if key not in cls._all_storage:
             keys = cls.get_all_register_class_name()
             raise KeyError("Invalid cloud name supplied\n"
                            "All implemented cloud storage are {}".format(keys))
+        with cls._lock:
+            if refresh and key in cls._instances:
+                cls._close_instance(cls._instances.pop(key))
+            if key not in cls._instances:
+                cls._instances[key] = cls._all_storage[key]()
+            return cls._instances[key]
+
+    @classmethod
+    def close_all(cls):
+        """
+        this function closes and drops every cached instance
+        :return: None
+        """
+        with cls._lock:
+            for instance in cls._instances.values():
+                cls._close_instance(instance)
+            cls._instances.clear()
+
+    @staticmethod
+    def _close_instance(instance):
+        close = getattr(instance, 'close', None)
+        if close is not None:
+            close()
 
     @classmethod
     def get_all_register_class_name(cls)->list:
@@ -0,0 +1,192 @@
+"""
+this file contain a read through cache for
+datastore entities which change rarely
+"""
+import copy
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class ConfigCache:
+    """
+    in process LRU cache with a time to live for the result of config kind
+    queries, keyed by (kind, filter_map). Entries can optionally be kept in a
+    directory as well, so tasks running on the same worker share them
+    """
+
+    def __init__(self, ttl:float=300, max_entries:int=1024, disk_path:str=None):
+        """
+        :param ttl: seconds an entry is served before it is read from datastore again
+        :param max_entries: number of entries kept in memory, the least recently used one is evicted first
+        :param disk_path: directory of the shared on disk layer, disabled if None
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_path:
+            os.makedirs(disk_path, exist_ok=True)
+
+    @staticmethod
+    def make_key(kind:str, filter_map:dict, *options)->str:
+        """
+        this function builds the cache key of a query
+        :param kind: kind on which query is done
+        :param filter_map: filter map(dict) of the query
+        :param options: any other query option which changes the result
+        :return: cache key
+        """
+        return repr((kind, sorted(filter_map.items()), options))
+
+    def get_or_load(self, key:str, loader:'callable'):
+        """
+        this function returns the cached value of key, calling loader and
+        caching its result when the key is missing or expired. A copy is
+        returned so callers can not change the cached value
+        :param key: cache key
+        :param loader: function without arguments returning the value
+        :return: value
+        """
+        found, value = self.get(key)
+        if not found:
+            value = loader()
+            self.put(key, value)
+        return copy.deepcopy(value)
+
+    def get(self, key:str)->tuple:
+        """
+        this function looks the key up in memory and then on disk
+        :param key: cache key
+        :return: (found, value)
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return True, entry[1]
+                del self._entries[key]
+
+        if self.disk_path:
+            entry = self._read_disk(key)
+            if entry is not None and entry[0] > now:
+                self._put_memory(key, entry)
+                return True, entry[1]
+        return False, None
+
+    def put(self, key:str, value):
+        """
+        this function caches value for ttl seconds
+        :param key: cache key
+        :param value: value to cache, has to be picklable when the disk layer is used
+        :return: None
+        """
+        entry = (time.time() + self.ttl, value)
+        self._put_memory(key, entry)
+        if self.disk_path:
+            self._write_disk(key, entry)
+
+    def invalidate(self, kind:str=None, filter_map:dict=None):
+        """
+        this function drops the cached entries of kind, or of kind and
+        filter_map whatever the other query options, or every entry if kind
+        is None
+        :param kind: kind to invalidate
+        :param filter_map: filter map(dict) to invalidate within kind
+        :return: None
+        """
+        prefix = self.key_prefix(kind, filter_map)
+        with self._lock:
+            keys = [key for key in self._entries if key.startswith(prefix)]
+            for key in keys:
+                del self._entries[key]
+        if self.disk_path:
+            for file_name in os.listdir(self.disk_path):
+                if not file_name.endswith('.cache'):
+                    continue
+                file_path = os.path.join(self.disk_path, file_name)
+                if kind is None:
+                    self._remove(file_path)
+                    continue
+                try:
+                    with open(file_path, 'rb') as fp:
+                        key = pickle.load(fp)[0]
+                except Exception:
+                    continue
+                if key.startswith(prefix):
+                    self._remove(file_path)
+
+    @staticmethod
+    def key_prefix(kind:str=None, filter_map:dict=None)->str:
+        """
+        this function returns the common prefix of the keys built by make_key
+        for kind, or for kind and filter_map
+        :param kind: kind on which query is done
+        :param filter_map: filter map(dict) of the query
+        :return: key prefix
+        """
+        if kind is None:
+            return ''
+        if filter_map is None:
+            return repr((kind, []))[:-len("[])")]
+        return repr((kind, sorted(filter_map.items())))[:-1]
+
+    def invalidate_key(self, key:str):
+        """
+        this function drops a single cached entry
+        :param key: cache key
+        :return: None
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.disk_path:
+            self._remove(self._disk_file(key))
+
+    def _put_memory(self, key:str, entry:tuple):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _disk_file(self, key:str)->str:
+        return os.path.join(self.disk_path, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.cache')
+
+    def _read_disk(self, key:str):
+        try:
+            with open(self._disk_file(key), 'rb') as fp:
+                stored_key, expires_at, value = pickle.load(fp)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logging.warning("Ignoring unreadable config cache file for {}".format(key))
+            return None
+        if stored_key != key:
+            return None
+        return expires_at, value
+
+    def _write_disk(self, key:str, entry:tuple):
+        # written to a temporary file and renamed, so concurrent tasks never read a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.disk_path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump((key, entry[0], entry[1]), fp)
+            os.replace(temp_path, self._disk_file(key))
+        except Exception:
+            self._remove(temp_path)
+            logging.warning("Could not write config cache file for {}".format(key))
+
+    @staticmethod
+    def _remove(file_path:str):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,338 @@
+"""
+this file contain the native reader of the merged reports, the multi
+threaded csv parser of pyarrow with a streaming translation of multi
+character delimiters into a single byte
+"""
+from __future__ import annotations
+
+import contextlib
+import io
+import mmap
+import os
+
+from parquet_write_automation.common.scripts.main.lazy_import import lazy_import
+
+pa = lazy_import('pyarrow')
+pacsv = lazy_import('pyarrow.csv')
+pd = lazy_import('pandas')
+
+# arrow type of the pandas read dtypes the native parser converts itself, other dtypes are read as strings and
+# converted by pandas
+native_read_types = {
+    'str': 'string', 'object': 'string', 'string': 'string',
+    'int8': 'int8', 'int16': 'int16', 'int32': 'int32', 'int64': 'int64', 'int': 'int64',
+    'uint8': 'uint8', 'uint16': 'uint16', 'uint32': 'uint32', 'uint64': 'uint64',
+    'Int8': 'int8', 'Int16': 'int16', 'Int32': 'int32', 'Int64': 'int64',
+    'float32': 'float32', 'float64': 'float64', 'float': 'float64',
+    'bool': 'bool_', 'boolean': 'bool_',
+}
+# read dtypes which stay nullable in pandas instead of turning into float64 when a value is missing
+nullable_read_dtypes = {'Int8', 'Int16', 'Int32', 'Int64', 'boolean'}
+
+
+class DelimiterConflict(Exception):
+    """
+    raised when the byte a multi character delimiter is translated into also occurs in the report
+    """
+
+    def __init__(self, message:str, substitute:bytes):
+        super().__init__(message)
+        self.substitute = substitute
+
+
+def dtype_name(dtype)->str:
+    """
+    this function returns the name of a pandas read dtype, ex - 'str' for str
+    :param dtype: dtype as type or name
+    :return: name
+    """
+    return dtype.__name__ if isinstance(dtype, type) else str(dtype)
+
+
+def is_single_byte(delimiter:str)->bool:
+    """
+    this function tells if the native parser can split on delimiter directly
+    :param delimiter: delimiter of the report
+    :return: bool
+    """
+    return len(delimiter.encode('utf-8')) == 1
+
+
+class DelimiterTranslator(io.RawIOBase):
+    """
+    readable binary stream which replaces a multi byte delimiter of the
+    wrapped stream by a single substitute byte, outside of quoted fields
+    only. A quote opens a quoted field at the start of a field, like in the
+    csv parsers, and "" inside a quoted field is an escaped quote. The input
+    is translated chunk by chunk, so memory does not grow with the report.
+
+    The delimiter is taken literally, delimiters meant as regular expression
+    need the python engine of pd.read_csv
+    """
+    quote = b'"'
+
+    def __init__(self, raw:'readable binary stream', delimiter:bytes, substitute:bytes,
+                 chunk_size:int=8 * 1024 * 1024):
+        """
+        :param raw: stream of the report
+        :param delimiter: delimiter of the report, may not contain the quote
+        :param substitute: byte written instead of the delimiter
+        :param chunk_size: bytes read from raw at a time
+        """
+        super().__init__()
+        if self.quote in delimiter:
+            raise ValueError("delimiter {!r} contains the quote character".format(delimiter))
+        self.raw = raw
+        self.delimiter = delimiter
+        self.substitute = substitute
+        self.chunk_size = chunk_size
+        # bytes kept back so a delimiter or an escaped quote is never split between two chunks
+        self._hold = max(len(delimiter) - 1, 1)
+        self._buffer = b''
+        # last byte written, a quote right after a substitute or a newline starts a field
+        self._last_byte = b'\n'
+        self._in_quotes = False
+        self._pending = b''
+        self._offset = 0
+        self._eof = False
+
+    def readable(self)->bool:
+        return True
+
+    def readinto(self, b)->int:
+        # b is filled completely unless the stream ends, the parser takes a short read as a short block
+        size = 0
+        while size < len(b):
+            if self._offset >= len(self._pending):
+                if self._eof:
+                    break
+                self._fill()
+                continue
+            count = min(len(b) - size, len(self._pending) - self._offset)
+            b[size:size + count] = self._pending[self._offset:self._offset + count]
+            self._offset += count
+            size += count
+        return size
+
+    def _fill(self):
+        chunk = self.raw.read(self.chunk_size)
+        if self.substitute in chunk:
+            raise DelimiterConflict("the report contains the byte {!r} its delimiter is translated into, convert it "
+                                    "with parser_engine python".format(self.substitute), self.substitute)
+        data = self._buffer + chunk
+        final = not chunk
+        end = len(data) if final else max(len(data) - self._hold, 0)
+        self._pending = self._translate(data, end, final)
+        self._offset = 0
+        self._eof = final
+
+    def _translate(self, data:bytes, end:int, final:bool)->bytes:
+        """
+        this function translates data[:end], it may read on beyond end to finish a delimiter or an escaped quote,
+        everything not translated is kept for the next chunk
+        :param data: untranslated bytes
+        :param end: bytes to translate
+        :param final: True for the last bytes of the stream
+        :return: translated bytes
+        """
+        delimiter = self.delimiter
+        out = []
+        position = 0
+        while position < end:
+            quote = data.find(self.quote, position, end)
+            if self._in_quotes:
+                if quote == -1:
+                    out.append(data[position:end])
+                    position = end
+                elif data[quote + 1:quote + 2] == self.quote:
+                    out.append(data[position:quote + 2])
+                    position = quote + 2
+                else:
+                    out.append(data[position:quote + 1])
+                    position = quote + 1
+                    self._in_quotes = False
+                continue
+            if quote == -1 and not final:
+                # the bytes kept back may finish a delimiter starting before end, it is translated whole
+                segment = data[position:end + len(delimiter) - 1]
+                translated = segment.replace(delimiter, self.substitute)
+                beyond = len(segment) - (end - position)
+                last = translated.rfind(self.substitute)
+                keep = len(translated) - last - 1 if last != -1 and len(translated) - last - 1 < beyond else beyond
+                out.append(translated[:len(translated) - keep])
+                position += len(segment) - keep
+                continue
+            stop = end if quote == -1 else quote
+            out.append(data[position:stop].replace(delimiter, self.substitute))
+            position = stop
+            if quote != -1:
+                previous = next((piece[-1:] for piece in reversed(out) if piece), self._last_byte)
+                self._in_quotes = previous in (self.substitute, b'\n', b'\r')
+                out.append(self.quote)
+                position = quote + 1
+        self._buffer = data[position:]
+        translated = b''.join(out)
+        self._last_byte = translated[-1:] or self._last_byte
+        return translated
+
+
+class NativeCsvReader:
+    """
+    reads a headerless report with the multi threaded csv parser of pyarrow
+    into data frames like pd.read_csv(names=..., dtype=read_dtypes) does:
+    empty and NA fields are missing values, blank lines are skipped, quoted
+    fields may hold delimiters and newlines, and columns without a read dtype
+    are inferred per batch as integer, float, bool or string.
+
+    A single byte delimiter is handed to the parser directly, a multi byte
+    delimiter is translated by DelimiterTranslator into a byte which does not
+    occur in the report
+    """
+    # bytes of the report parsed per block, the blocks are parsed by the threads of the arrow cpu pool
+    block_size = 16 * 1024 * 1024
+    translate_chunk_size = 8 * 1024 * 1024
+    # control characters a multi byte delimiter is translated into, the first one not found in the report is used
+    substitutes = (b'\x1f', b'\x1e', b'\x1d', b'\x1c')
+
+    def __init__(self, column_names:list, read_dtypes:dict, delimiter:str):
+        """
+        :param column_names: columns of the report
+        :param read_dtypes: pandas dtype by column, see ReportSchema.read_dtypes
+        :param delimiter: delimiter of the report
+        """
+        self.column_names = list(column_names)
+        self.read_dtypes = dict(read_dtypes)
+        self.delimiter = delimiter
+        self.column_types = {column: self.read_type(self.read_dtypes.get(column)) for column in self.column_names}
+
+    @staticmethod
+    def read_type(dtype)->'pa.DataType':
+        """
+        this function returns the arrow type a column is parsed as
+        :param dtype: pandas read dtype, None if not declared
+        :return: arrow type, strings for dtypes converted by pandas and for inferred columns
+        """
+        return getattr(pa, native_read_types.get(dtype_name(dtype), 'string'))()
+
+    def batches(self, input_file:'local path or readable stream', batch_size:int)->'iterator':
+        """
+        this function reads the report batch_size rows at a time
+        :param input_file: local path or readable binary stream of the report
+        :param batch_size: rows per data frame, the last one may be shorter
+        :return: generator of data frames
+        """
+        with self.open_stream(input_file) as (stream, delimiter):
+            reader = pacsv.open_csv(stream, read_options=self.read_options(), parse_options=self.parse_options(delimiter),
+                                    convert_options=self.convert_options())
+            pending = []
+            pending_rows = 0
+            for record_batch in reader:
+                pending.append(record_batch)
+                pending_rows += record_batch.num_rows
+                while pending_rows >= batch_size:
+                    table = pa.Table.from_batches(pending)
+                    yield self.to_frame(table.slice(0, batch_size))
+                    rest = table.slice(batch_size)
+                    pending = rest.to_batches()
+                    pending_rows = rest.num_rows
+            if pending_rows:
+                yield self.to_frame(pa.Table.from_batches(pending))
+
+    def read(self, input_file:'local path or readable stream', nrows:int=None)->'pd.DataFrame':
+        """
+        this function reads the whole report, or its first nrows rows, into one data frame
+        :param input_file: local path or readable binary stream of the report
+        :param nrows: rows to read, all if None
+        :return: data frame
+        """
+        if nrows is not None:
+            # closing the generator closes the report without reading the rest of it
+            with contextlib.closing(self.batches(input_file, nrows)) as batches:
+                batch = next(batches, None)
+            return batch if batch is not None else pd.DataFrame(columns=self.column_names)
+        with self.open_stream(input_file) as (stream, delimiter):
+            table = pacsv.read_csv(stream, read_options=self.read_options(), parse_options=self.parse_options(delimiter),
+                                   convert_options=self.convert_options())
+        return self.to_frame(table)
+
+    @contextlib.contextmanager
+    def open_stream(self, input_file:'local path or readable stream'):
+        """
+        this function opens the report for the parser, through a DelimiterTranslator for multi byte delimiters
+        :param input_file: local path or readable binary stream of the report
+        :return: context manager yielding the stream and the single byte delimiter of the stream
+        """
+        with contextlib.ExitStack() as stack:
+            stream = input_file
+            if isinstance(input_file, str):
+                stream = stack.enter_context(open(input_file, 'rb'))
+            if is_single_byte(self.delimiter):
+                yield stream, self.delimiter
+                return
+            substitute = self.choose_substitute(input_file) if isinstance(input_file, str) else self.substitutes[0]
+            translator = stack.enter_context(DelimiterTranslator(stream, self.delimiter.encode('utf-8'), substitute,
+                                                                 self.translate_chunk_size))
+            yield translator, substitute.decode('ascii')
+
+    def choose_substitute(self, file_name:str)->bytes:
+        """
+        this function returns the first substitute byte which does not occur in the local report
+        :param file_name: local path of the report
+        :return: substitute byte
+        """
+        if os.path.getsize(file_name) == 0:
+            return self.substitutes[0]
+        with open(file_name, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for substitute in self.substitutes:
+                if mm.find(substitute) == -1:
+                    return substitute
+        raise DelimiterConflict("the report contains every byte its delimiter can be translated into, convert it "
+                                "with parser_engine python", self.substitutes[-1])
+
+    def read_options(self)->'pacsv.ReadOptions':
+        return pacsv.ReadOptions(column_names=self.column_names, block_size=self.block_size, use_threads=True)
+
+    @staticmethod
+    def parse_options(delimiter:str)->'pacsv.ParseOptions':
+        return pacsv.ParseOptions(delimiter=delimiter, quote_char='"', double_quote=True, newlines_in_values=True,
+                                  ignore_empty_lines=True)
+
+    def convert_options(self)->'pacsv.ConvertOptions':
+        return pacsv.ConvertOptions(column_types=self.column_types, strings_can_be_null=True,
+                                    quoted_strings_can_be_null=True)
+
+    def to_frame(self, table:'pa.Table')->'pd.DataFrame':
+        """
+        this function turns a parsed table into the data frame pd.read_csv would have returned
+        :param table: table parsed with column_types
+        :return: data frame
+        """
+        columns = {}
+        for name, column in zip(table.column_names, table.columns):
+            dtype = self.read_dtypes.get(name)
+            if dtype is None:
+                columns[name] = self.infer(column).to_pandas()
+            elif dtype_name(dtype) in nullable_read_dtypes:
+                columns[name] = column.to_pandas(types_mapper={column.type: pd.api.types.pandas_dtype(dtype)}.get)
+            elif dtype_name(dtype) in native_read_types:
+                if column.null_count and pa.types.is_integer(column.type):
+                    # pandas can not hold a missing value in a numpy integer column either
+                    raise ValueError("Unable to convert column {} to type {}, it has NA values".format(name, dtype))
+                columns[name] = column.to_pandas()
+            else:
+                columns[name] = column.to_pandas().astype(dtype)
+        return pd.DataFrame(columns, columns=self.column_names)
+
+    @staticmethod
+    def infer(column:'pa.ChunkedArray')->'pa.ChunkedArray':
+        """
+        this function infers the type of a column read as strings, like pd.read_csv for columns without a dtype
+        :param column: string column
+        :return: the column as integers, floats or bools if all of its values parse, else the strings
+        """
+        for arrow_type in (pa.int64(), pa.float64(), pa.bool_()):
+            try:
+                return column.cast(arrow_type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                continue
+        return column
@@ -0,0 +1,121 @@
+"""
+this file contain logic to write a report as
+hive partitioned parquet dataset
+"""
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from parquet_write_automation.common.scripts.main.lazy_import import lazy_import
+from parquet_write_automation.parquet_write.scripts.main.writer_profile import ParquetWriterProfile
+
+pa = lazy_import('pyarrow')
+pq = lazy_import('pyarrow.parquet')
+
+
+class PartitionedDatasetWriter:
+    """
+    writes arrow batches into a local hive style dataset, ex -
+    root/report_date=2020-07-27/store=12/part-00000.parquet. Every partition
+    has its own parquet writer which rolls over to a new file after
+    max_rows_per_file rows, and the partitions of a batch are written
+    concurrently
+    """
+    default_partition_name = '__HIVE_DEFAULT_PARTITION__'
+
+    def __init__(self, root_dir:str, partition_by:list, max_rows_per_file:int=None, max_workers:int=None,
+                 writer_profile:ParquetWriterProfile=None):
+        """
+        :param root_dir: local directory of the dataset
+        :param partition_by: columns the dataset is partitioned by, in directory order
+        :param max_rows_per_file: rows after which a partition starts a new file, unlimited if None
+        :param max_workers: number of partitions written concurrently
+        :param writer_profile: parquet writer settings, defaults to ParquetWriterProfile()
+        """
+        self.root_dir = root_dir
+        self.partition_by = list(partition_by)
+        self.max_rows_per_file = max_rows_per_file
+        self.writer_profile = writer_profile or ParquetWriterProfile()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._partitions = {}
+        self._files = []
+        self._lock = threading.Lock()
+
+    def partition_dir(self, values:tuple)->str:
+        """
+        this function returns the relative directory of a partition
+        :param values: values of the partition columns
+        :return: relative path, ex - report_date=2020-07-27/store=12
+        """
+        parts = []
+        for column, value in zip(self.partition_by, values):
+            value = self.default_partition_name if value is None or value != value else quote(str(value), safe='')
+            parts.append("{}={}".format(column, value))
+        return '/'.join(parts)
+
+    def write_batch(self, table:pa.Table):
+        """
+        this function splits the batch by partition and appends every slice to
+        its partition, the partitions are written concurrently
+        :param table: arrow table holding the partition columns
+        :return: None
+        """
+        keys = table.select(self.partition_by).to_pandas()
+        groups = keys.groupby(self.partition_by, sort=False, dropna=False).indices
+        data = table.drop(self.partition_by)
+        futures = []
+        for values, indices in groups.items():
+            values = values if isinstance(values, tuple) else (values,)
+            futures.append(self.executor.submit(self._write_partition, self.partition_dir(values),
+                                                data.take(pa.array(indices))))
+        for future in futures:
+            future.result()
+
+    def _write_partition(self, partition:str, table:pa.Table):
+        with self._lock:
+            state = self._partitions.setdefault(partition, {'writer': None, 'rows': 0, 'file_number': 0,
+                                                            'lock': threading.Lock()})
+        with state['lock']:
+            offset = 0
+            while offset < table.num_rows:
+                if state['writer'] is None:
+                    self._open_file(partition, state, table.schema)
+                length = table.num_rows - offset
+                if self.max_rows_per_file:
+                    length = min(length, self.max_rows_per_file - state['rows'])
+                state['writer'].write_table(table.slice(offset, length),
+                                            row_group_size=self.writer_profile.row_group_size)
+                state['rows'] += length
+                offset += length
+                if self.max_rows_per_file and state['rows'] >= self.max_rows_per_file:
+                    self._close_file(state)
+
+    def _open_file(self, partition:str, state:dict, schema:pa.Schema):
+        relative_path = "{}/part-{:05d}.parquet".format(partition, state['file_number'])
+        local_path = os.path.join(self.root_dir, relative_path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        state['writer'] = pq.ParquetWriter(local_path, schema, allow_truncated_timestamps=True,
+                                           **self.writer_profile.writer_kwargs())
+        state['path'] = relative_path
+        state['rows'] = 0
+        state['file_number'] += 1
+
+    def _close_file(self, state:dict):
+        state['writer'].close()
+        with self._lock:
+            self._files.append((state['path'], state['rows']))
+        state['writer'] = None
+
+    def close(self)->list:
+        """
+        this function closes every open file of the dataset
+        :return: list of (relative path, row count) of the written files, sorted by path
+        """
+        for state in self._partitions.values():
+            if state['writer'] is not None:
+                self._close_file(state)
+        self.executor.shutdown()
+        return sorted(self._files)
@@ -1,8 +1,17 @@
-from google.cloud import datastore
+from __future__ import annotations
+
 import datetime
+import json
 import logging
 import os
 
+from parquet_write_automation.common.scripts.main.lazy_import import lazy_import
+from parquet_write_automation.datastore.scripts.main.config_cache import ConfigCache
+
+# imported on first use, the annotations below are not evaluated
+datastore = lazy_import('google.cloud.datastore')
+datastore_query = lazy_import('google.cloud.datastore.query')
+
 
 class Db:
     report_download_namespace = 'ReportDownloadTask'
@@ -12,6 +21,38 @@ class Db:
     merge_config_namespace = 'MergeReportConfig'
     manual_parquet_write_config = "ManualParquetWriteConfig"
     manual_run_merge_config = 'ManualMergeReportConfig'
+    # datastore limits on the disjunctions of one query and the entities of one commit
+    max_query_disjunctions = 30
+    max_batch_put = 500
+    # parquet_write task properties that are never queried, nested values like stage_metrics can exceed the size
+    # limit of an indexed property and every indexed property costs index writes
+    unindexed_task_properties = ('exception_details', 'stage_metrics', 'outputs', 'part_rows', 'writer_profile')
+    # kinds whose query results are served from config_cache once it is enabled
+    config_kinds = (parquet_write_config_namespace, merge_config_namespace, manual_parquet_write_config,
+                    manual_run_merge_config)
+    config_cache = None
+
+    @classmethod
+    def enable_config_cache(cls, ttl:float=300, max_entries:int=1024, disk_path:str=None):
+        """
+        enable_config_cache turns on the process wide read through cache for queries on config_kinds
+        :param ttl: seconds a cached query result is served before it is read from datastore again
+        :param max_entries: number of query results kept in memory
+        :param disk_path: directory shared by the tasks of a worker to cache results on disk, disabled if None
+        :return:
+        """
+        cls.config_cache = ConfigCache(ttl, max_entries, disk_path)
+
+    @classmethod
+    def invalidate_config_cache(cls, kind:'namespace'=None, filter_map:dict=None):
+        """
+        invalidate_config_cache drops cached config query results
+        :param kind: kind to invalidate, every kind if None
+        :param filter_map: if given together with kind only the results of this filter map are dropped
+        :return:
+        """
+        if cls.config_cache is not None:
+            cls.config_cache.invalidate(kind, filter_map)
 
     def get_datastore_client(self, credentials:'dsClientCredentials') -> google.cloud.datastore.Client:
         """
@@ -21,7 +62,8 @@ class Db:
         """
         return datastore.Client(credentials=credentials)
 
-    def get_report_task_entry(self, client : google.cloud.datastore.Client, dag_id :'unique dag identifier', run_id:str, airflow_task_id : 'unique name for task ', name_space:'unique name') -> list:
+    def get_report_task_entry(self, client : google.cloud.datastore.Client, dag_id :'unique dag identifier', run_id:str, airflow_task_id : 'unique name for task ', name_space:'unique name',
+                              limit:int=None) -> list:
 
         """
         get_report_task_entry is used to query the entry for task
@@ -29,34 +71,155 @@ class Db:
         :param dag_id: dag's id
         :param run_id: dag's run id
         :param name_space: name space which consist all the task entry
+        :param limit: maximum number of entries returned
         :return: list of the entry for given dag_id, run_id, report_name and report date
         """
-        query = client.query(kind=name_space)
-        query.add_filter('dag_id', '=', dag_id)
-        query.add_filter('run_id', '=', run_id)
-        query.add_filter('airflow_task_id', '=', airflow_task_id)
-        return list(query.fetch())
+        filter_map = {'dag_id': dag_id, 'run_id': run_id, 'airflow_task_id': airflow_task_id}
+        return self.get_datastore_entries(client, filter_map, name_space, limit=limit)
 
-    def get_datastore_entries(self, client : google.cloud.datastore.Client, filter_map : dict , kind :'namespace') -> list:
+    def get_datastore_entries(self, client : google.cloud.datastore.Client, filter_map : dict , kind :'namespace',
+                              limit:int=None, order:list=None, projection:list=None, keys_only:bool=False) -> list:
 
         """
         get_report_task_entry is used to query the entry for task
         :param filter_map: filter map is dictionary where keys are filters and value are filter's value
         :param client: data store client
         :param kind: name space which consist all the task entry
+        :param limit: maximum number of entries returned
+        :param order: property names to sort on, a leading '-' sorts descending (ex - ['-modified_at'])
+        :param projection: property names to return instead of the whole entity
+        :param keys_only: if True only the keys of the entries are fetched
         :return: list of the entry for given dag_id, run_id, report_name and report date
         """
-        query = client.query(kind=kind)
+        if self.config_cache is not None and kind in self.config_kinds:
+            key = ConfigCache.make_key(kind, filter_map, limit, order, projection, keys_only)
+            return self.config_cache.get_or_load(
+                key, lambda: self.fetch_datastore_entries(client, filter_map, kind, limit, order, projection,
+                                                          keys_only))
+        return self.fetch_datastore_entries(client, filter_map, kind, limit, order, projection, keys_only)
+
+    def fetch_datastore_entries(self, client : google.cloud.datastore.Client, filter_map : dict , kind :'namespace',
+                                limit:int=None, order:list=None, projection:list=None, keys_only:bool=False) -> list:
+        """
+        fetch_datastore_entries runs the query of get_datastore_entries against datastore, bypassing config_cache
+        :return: list of entries
+        """
+        query = self.build_query(client, filter_map, kind, order, projection, keys_only)
+        return list(query.fetch(limit=limit))
+
+    def iter_datastore_entries(self, client : google.cloud.datastore.Client, filter_map : dict , kind :'namespace',
+                               page_size:int=100, limit:int=None, order:list=None, projection:list=None,
+                               keys_only:bool=False):
+
+        """
+        iter_datastore_entries yields the entries of filter_map one page at a time, every page is fetched with the
+        cursor of the previous one, so only a single page is held in memory and the caller can stop early
+        :param client: data store client
+        :param filter_map: filter map is dictionary where keys are filters and value are filter's value
+        :param kind: name space which consist all the task entry
+        :param page_size: number of entries fetched per request
+        :param limit: maximum number of entries yielded
+        :param order: property names to sort on, a leading '-' sorts descending (ex - ['-modified_at'])
+        :param projection: property names to return instead of the whole entity
+        :param keys_only: if True only the keys of the entries are fetched
+        :return: generator of entries
+        """
+        query = self.build_query(client, filter_map, kind, order, projection, keys_only)
+        cursor = None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            fetch_size = page_size if remaining is None else min(page_size, remaining)
+            iterator = query.fetch(start_cursor=cursor, limit=fetch_size)
+            page = list(next(iterator.pages, []))
+            for entry in page:
+                yield entry
+            if remaining is not None:
+                remaining -= len(page)
+            # datastore can return a short page before the end of the results, only a missing cursor ends them
+            if iterator.next_page_token is None or (not page and iterator.next_page_token == cursor):
+                return
+            cursor = iterator.next_page_token
+
+    @staticmethod
+    def build_query(client : google.cloud.datastore.Client, filter_map : dict , kind :'namespace', order:list=None,
+                    projection:list=None, keys_only:bool=False) -> google.cloud.datastore.query.Query:
+        """
+        build_query creates the equality query of filter_map on kind
+        :param client: data store client
+        :param filter_map: filter map is dictionary where keys are filters and value are filter's value
+        :param kind: name space which consist all the task entry
+        :param order: property names to sort on, a leading '-' sorts descending
+        :param projection: property names to return instead of the whole entity
+        :param keys_only: if True only the keys of the entries are fetched
+        :return: query
+        """
+        query = client.query(kind=kind, order=order or (), projection=projection or ())
         for key in filter_map.keys():
             query.add_filter(key, '=', filter_map[key])
-        return list(query.fetch())
+        if keys_only:
+            query.keys_only()
+        return query
+
+    def get_datastore_entries_for_filter_maps(self, client : google.cloud.datastore.Client, filter_maps : list,
+                                              kind :'namespace') -> list:
+
+        """
+        get_datastore_entries_for_filter_maps queries the entries of several filter maps on one kind at once. Equal
+        filter maps are queried once and the others are combined into OR queries, so a batch of jobs costs a handful
+        of queries instead of one per job
+        :param client: data store client
+        :param filter_maps: list of filter maps, each a dictionary where keys are filters and value are filter's value
+        :param kind: name space which consist all the task entry
+        :return: list with the list of entries of every filter map, in the order of filter_maps
+        """
+        unique_filter_maps = {}
+        for filter_map in filter_maps:
+            unique_filter_maps.setdefault(repr(sorted(filter_map.items())), filter_map)
+
+        entries_by_filter = {}
+        combined = []
+        for filter_key, filter_map in unique_filter_maps.items():
+            if filter_map:
+                combined.append((filter_key, filter_map))
+            else:
+                entries_by_filter[filter_key] = self.get_datastore_entries(client, filter_map, kind)
+
+        for start in range(0, len(combined), self.max_query_disjunctions):
+            chunk = combined[start:start + self.max_query_disjunctions]
+            conjunctions = [datastore_query.And([datastore_query.PropertyFilter(key, '=', value)
+                                                 for key, value in filter_map.items()])
+                            for _, filter_map in chunk]
+            query = client.query(kind=kind)
+            query.add_filter(filter=conjunctions[0] if len(conjunctions) == 1 else datastore_query.Or(conjunctions))
+            fetched = list(query.fetch())
+            for filter_key, filter_map in chunk:
+                entries_by_filter[filter_key] = [entry for entry in fetched
+                                                 if self.entry_matches_filter_map(entry, filter_map)]
+
+        return [entries_by_filter[repr(sorted(filter_map.items()))] for filter_map in filter_maps]
+
+    @staticmethod
+    def entry_matches_filter_map(entry, filter_map:dict) -> bool:
+        """
+        entry_matches_filter_map applies the equality filters of filter_map to an entity the way datastore does,
+        a list property matches if any of its values is equal
+        :param entry: datastore entity
+        :param filter_map: filter map is dictionary where keys are filters and value are filter's value
+        :return: True if the entity satisfies every filter
+        """
+        for key, value in filter_map.items():
+            entry_value = entry.get(key)
+            if entry_value != value and not (isinstance(entry_value, list) and value in entry_value):
+                return False
+        return True
 
     def put_parquet_write_task_entry(self, client :google.cloud.datastore.Client, task_entry, dag_id:'unique dag identifier', run_id :str, report_merged_task_ids: 'unique name for task', report_name:str,
                                      report_date: datetime.datetime, report_column:str, report_column_datatype:'data type of column', gcs_output_file_path:str,
                                      exception:str,
                                      exception_details:'detailed_text', job_status:'success/failure', output_bucket:str,
                                      total_row:int, row_count_in_part_file:int, commit_id:str, report_type:'type of report',
-                                     kind:'namespace', filter_map: dict , airflow_task_id: 'unique name for task ', job_id:'str/int') ->'created a new parquet write task':
+                                     kind:'namespace', filter_map: dict , airflow_task_id: 'unique name for task ', job_id:'str/int',
+                                     task_properties:dict=None) ->'created a new parquet write task':
         """
         put_parquet_write_task_entry is used to insert the task instance for parquet_write task
         :param job_id: job id of wrl
@@ -81,6 +244,27 @@ class Db:
         :param total_row: total row in merge file
         :param row_count_in_part_file: total row in part file
         :param report_type: report type
+        :param task_properties: additional properties of the task, ex - writer_profile
+        :return:
+        """
+        self.fill_parquet_write_task_entry(task_entry, dag_id, run_id, report_merged_task_ids, report_name, report_date,
+                                           report_column, report_column_datatype, gcs_output_file_path, exception,
+                                           exception_details, job_status, output_bucket, total_row,
+                                           row_count_in_part_file, commit_id, report_type, kind, filter_map,
+                                           airflow_task_id, job_id, task_properties)
+        logging.debug("Writing parquet write task {}".format(task_entry.key))
+        client.put(task_entry)
+
+    def fill_parquet_write_task_entry(self, task_entry, dag_id:'unique dag identifier', run_id :str, report_merged_task_ids: 'unique name for task', report_name:str,
+                                      report_date: datetime.datetime, report_column:str, report_column_datatype:'data type of column', gcs_output_file_path:str,
+                                      exception:str,
+                                      exception_details:'detailed_text', job_status:'success/failure', output_bucket:str,
+                                      total_row:int, row_count_in_part_file:int, commit_id:str, report_type:'type of report',
+                                      kind:'namespace', filter_map: dict , airflow_task_id: 'unique name for task ', job_id:'str/int',
+                                      task_properties:dict=None):
+        """
+        fill_parquet_write_task_entry sets the properties of a parquet_write task entity without writing it, the
+        parameters are the ones of put_parquet_write_task_entry
         :return:
         """
         task_entry['dag_id'] = dag_id
@@ -104,15 +288,16 @@ class Db:
         task_entry['filter_map'] = filter_map
         task_entry['airflow_task_id'] = airflow_task_id
         task_entry['job_id'] = job_id
-
-        print(task_entry)
-        client.put(task_entry)
+        task_entry.update(task_properties or {})
+        # entities read back from datastore only exclude the properties they were written with
+        task_entry.exclude_from_indexes.update(self.unindexed_task_properties)
 
     def handle_report_parquet_write_task(self, client:google.cloud.datastore.Client, dag_id:'unique dag identifier', run_id : str, report_merged_task_id: 'unique name for task ', output_file_name:str,
-                                         report_date:datetime.datetime, report_column;str, report_column_datatype:'data type of column', gcs_output_file_path :str,
-                                         exception:str, exception_details:'detailed_text', job_status:'success/failure', output_bucket:, total_row:int,
+                                         report_date:datetime.datetime, report_column:str, report_column_datatype:'data type of column', gcs_output_file_path :str,
+                                         exception:str, exception_details:'detailed_text', job_status:'success/failure', output_bucket:str, total_row:int,
                                          row_count_in_part_file:int, report_type:'type of report',
-                                         kind:'namespace', filter_map: dict , airflow_task_id: 'unique name for task ', job_id:'str/int')->'create or update parquet write task':
+                                         kind:'namespace', filter_map: dict , airflow_task_id: 'unique name for task ', job_id:'str/int',
+                                         task_properties:dict=None)->'create or update parquet write task':
         """
         handle_report_parquet_write_task is used to check if the task instance for the given param is available in the
         datastore or not. If it is already there then it is being updated else a new instance is being inserted
@@ -136,21 +321,155 @@ class Db:
         :param total_row: total row in merge file
         :param row_count_in_part_file: total row in part file
         :param report_type: report_type
+        :param task_properties: additional properties of the task, ex - writer_profile
         :return:
         """
-        existing_entries = self.get_report_task_entry(client, dag_id, run_id, airflow_task_id, self.parquet_write_namespace)
+        with client.transaction():
+            task_entry = self.get_or_create_parquet_write_task_entry(client, dag_id, run_id, airflow_task_id)
+            self.put_parquet_write_task_entry(client, task_entry, dag_id, run_id, report_merged_task_id,
+                                              output_file_name, report_date, report_column, report_column_datatype,
+                                              gcs_output_file_path, exception, exception_details, job_status,
+                                              output_bucket, total_row, row_count_in_part_file, self.get_commit_id(),
+                                              report_type, kind, filter_map, airflow_task_id, job_id,
+                                              task_properties)
+
+    def handle_report_parquet_write_tasks(self, client:google.cloud.datastore.Client, tasks:list):
+        """
+        handle_report_parquet_write_tasks creates or updates many parquet_write task entities and writes them with
+        put_multi instead of one put per task
+        :param client: datastore client
+        :param tasks: list of dict, each holding the arguments of handle_report_parquet_write_task except client
+        :return:
+        """
+        commit_id = self.get_commit_id()
+        for start in range(0, len(tasks), self.max_batch_put):
+            chunk = tasks[start:start + self.max_batch_put]
+            keys = [self.parquet_write_task_key(client, task['dag_id'], task['run_id'], task['airflow_task_id'])
+                    for task in chunk]
+            with client.transaction():
+                existing_entries = {entry.key: entry for entry in client.get_multi(keys)}
+                task_entries = {}
+                for key, task in zip(keys, chunk):
+                    task_entry = task_entries.get(key) or existing_entries.get(key) or self.new_parquet_write_task_entry(key)
+                    self.fill_parquet_write_task_entry(task_entry, task['dag_id'], task['run_id'],
+                                                       task['report_merged_task_id'], task['output_file_name'],
+                                                       task['report_date'], task['report_column'],
+                                                       task['report_column_datatype'], task['gcs_output_file_path'],
+                                                       task['exception'], task['exception_details'],
+                                                       task['job_status'], task['output_bucket'], task['total_row'],
+                                                       task['row_count_in_part_file'], commit_id, task['report_type'],
+                                                       task['kind'], task['filter_map'], task['airflow_task_id'],
+                                                       task['job_id'], task.get('task_properties'))
+                    task_entries[key] = task_entry
+                client.put_multi(list(task_entries.values()))
+
+    def parquet_write_task_key(self, client:google.cloud.datastore.Client, dag_id:'unique dag identifier', run_id:str,
+                               airflow_task_id:'unique name for task ') -> google.cloud.datastore.Key:
+        """
+        parquet_write_task_key returns the key of the parquet_write task entity of a task. The key name is derived
+        from dag_id, run_id and airflow_task_id so the entity can be read and written by key instead of by query
+        :param client: datastore client
+        :param dag_id: dag's id
+        :param run_id: dag's run id
+        :param airflow_task_id: airflow task id
+        :return: datastore key
+        """
+        return client.key(self.parquet_write_namespace, json.dumps([dag_id, run_id, airflow_task_id]))
+
+    def new_parquet_write_task_entry(self, key:google.cloud.datastore.Key):
+        """
+        new_parquet_write_task_entry creates an empty parquet_write task entity for key
+        :param key: datastore key
+        :return: task entity
+        """
+        task_entry = datastore.Entity(key=key, exclude_from_indexes=self.unindexed_task_properties)
+        task_entry['created_at'] = datetime.datetime.utcnow()
+        return task_entry
+
+    def get_parquet_write_task_entry(self, client:google.cloud.datastore.Client, dag_id:'unique dag identifier',
+                                     run_id:str, airflow_task_id:'unique name for task '):
+        """
+        get_parquet_write_task_entry reads the parquet_write task entity of a task by key, which unlike
+        get_report_task_entry is strongly consistent
+        :param client: datastore client
+        :param dag_id: dag's id
+        :param run_id: dag's run id
+        :param airflow_task_id: airflow task id
+        :return: task entity or None
+        """
+        return client.get(self.parquet_write_task_key(client, dag_id, run_id, airflow_task_id))
+
+    def get_or_create_parquet_write_task_entry(self, client:google.cloud.datastore.Client, dag_id:'unique dag identifier',
+                                               run_id:str, airflow_task_id:'unique name for task '):
+        """
+        get_or_create_parquet_write_task_entry returns the existing parquet_write task entity of the task or a new one
+        :param client: datastore client
+        :param dag_id: dag's id
+        :param run_id: dag's run id
+        :param airflow_task_id: airflow task id
+        :return: task entity
+        """
+        task_entry = self.get_parquet_write_task_entry(client, dag_id, run_id, airflow_task_id)
+        if task_entry is None:
+            task_entry = self.new_parquet_write_task_entry(
+                self.parquet_write_task_key(client, dag_id, run_id, airflow_task_id))
+        return task_entry
+
+    def migrate_parquet_write_task_keys(self, client:google.cloud.datastore.Client) -> int:
+        """
+        migrate_parquet_write_task_keys re-keys parquet_write task entities written with auto allocated ids to the
+        key of parquet_write_task_key. When several entities map to the same key the most recently modified one is
+        kept. The old entities are deleted after the new ones are written
+        :param client: datastore client
+        :return: number of entities re-keyed
+        """
+        query = client.query(kind=self.parquet_write_namespace)
+        migrated = {}
+        old_keys = []
+        for entry in query.fetch():
+            key = self.parquet_write_task_key(client, entry.get('dag_id'), entry.get('run_id'),
+                                              entry.get('airflow_task_id'))
+            if entry.key == key:
+                continue
+            old_keys.append(entry.key)
+            current = migrated.get(key)
+            if current is not None and self.modified_order(current) >= self.modified_order(entry):
+                continue
+            task_entry = datastore.Entity(key=key, exclude_from_indexes=self.unindexed_task_properties)
+            task_entry.update(entry)
+            migrated[key] = task_entry
+
+        task_entries = list(migrated.values())
+        written = 0
+        for start in range(0, len(task_entries), self.max_batch_put):
+            chunk = task_entries[start:start + self.max_batch_put]
+            # an entity already written under the new key is newer than the legacy ones
+            existing_keys = {entry.key for entry in client.get_multi([entry.key for entry in chunk])}
+            new_entries = [entry for entry in chunk if entry.key not in existing_keys]
+            client.put_multi(new_entries)
+            written += len(new_entries)
+        for start in range(0, len(old_keys), self.max_batch_put):
+            client.delete_multi(old_keys[start:start + self.max_batch_put])
+        logging.info("Re-keyed {} of {} legacy parquet write task entities".format(written, len(old_keys)))
+        return written
+
+    @staticmethod
+    def modified_order(entry) -> tuple:
+        """
+        modified_order is a sort key ordering entities by modified_at, entities without it come first
+        :param entry: datastore entity
+        :return: sort key
+        """
+        modified_at = entry.get('modified_at')
+        return (modified_at is not None, modified_at)
+
+    @staticmethod
+    def get_commit_id() -> str:
+        """
+        get_commit_id returns the github commit sha of the running code, or an empty string
+        :return: commit sha
+        """
         commit_id = ''
         if 'GITHUB_SHA' in os.environ:
             commit_id = os.environ['GITHUB_SHA']
-
-        if len(existing_entries) > 0:
-            task_entry = existing_entries[0]
-        else:
-            task_key = client.key(self.parquet_write_namespace)
-            task_entry = datastore.Entity(key=task_key, exclude_from_indexes=('exception_details',))
-            task_entry['created_at'] = datetime.datetime.utcnow()
-        self.put_parquet_write_task_entry(client, task_entry, dag_id, run_id, report_merged_task_id, output_file_name,
-                                          report_date, report_column, report_column_datatype, gcs_output_file_path,
-                                          exception, exception_details, job_status, output_bucket, total_row,
-                                          row_count_in_part_file, commit_id, report_type, kind, filter_map,
-                                          airflow_task_id, job_id)
+        return commit_id
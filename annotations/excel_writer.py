@@ -0,0 +1,84 @@
+"""
+this file contain logic to write a report as excel
+workbook in constant memory
+"""
+import datetime
+
+from parquet_write_automation.common.scripts.main.lazy_import import lazy_import
+from parquet_write_automation.parquet_write.scripts.main.report_schema import ReportSchema
+
+openpyxl = lazy_import('openpyxl')
+
+
+class StreamingExcelWriter:
+    """
+    writes report batches into an xlsx workbook opened in write only mode, so
+    rows are streamed to the workbook instead of being kept in memory. When a
+    sheet reaches the excel row limit the writer continues on a new sheet
+    (Sheet1, Sheet2, ...), every sheet starting with the header row
+    """
+    max_excel_rows = 1048576
+
+    def __init__(self, output:'local path or writable binary stream', column_name_for_report:list,
+                 report_schema:ReportSchema=None, max_rows_per_sheet:int=None):
+        """
+        :param output: local path or binary stream the workbook is saved to
+        :param column_name_for_report: list of columns of the report
+        :param report_schema: compiled schema used to write typed cells, plain values if None
+        :param max_rows_per_sheet: rows of a sheet including the header, defaults to the excel limit
+        """
+        self.output = output
+        self.column_names = list(column_name_for_report)
+        self.report_schema = report_schema
+        self.max_rows_per_sheet = max_rows_per_sheet or self.max_excel_rows
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheet = None
+        self.sheet_rows = 0
+        self.total_rows = 0
+
+    def _new_sheet(self):
+        self.sheet = self.workbook.create_sheet("Sheet{}".format(len(self.workbook.worksheets) + 1))
+        self.sheet.append(self.column_names)
+        self.sheet_rows = 1
+
+    def write_batch(self, df:'pd.DataFrame'):
+        """
+        this function appends the rows of a batch
+        :param df: batch read with the read dtypes of report_schema
+        :return: None
+        """
+        if self.report_schema is not None:
+            columns = [self.cell_values(column) for column in self.report_schema.to_table(df).columns]
+        else:
+            columns = [df[column].astype(object).where(df[column].notna(), None).tolist() for column in df.columns]
+        for row in zip(*columns):
+            if self.sheet is None or self.sheet_rows >= self.max_rows_per_sheet:
+                self._new_sheet()
+            self.sheet.append(row)
+            self.sheet_rows += 1
+        self.total_rows += len(df)
+
+    @staticmethod
+    def cell_values(column:'pa.ChunkedArray')->list:
+        """
+        this function turns an arrow column into excel cell values. Excel has
+        no timezones, so timezone aware timestamps are written as wall time of
+        their timezone
+        :param column: arrow column
+        :return: list of python values
+        """
+        values = column.to_pylist()
+        if hasattr(column.type, 'tz') and column.type.tz is not None:
+            values = [value.replace(tzinfo=None) if isinstance(value, datetime.datetime) else value
+                      for value in values]
+        return values
+
+    def close(self)->int:
+        """
+        this function saves the workbook, an empty report still gets a sheet with the header
+        :return: number of rows written
+        """
+        if self.sheet is None:
+            self._new_sheet()
+        self.workbook.save(self.output)
+        return self.total_rows
@@ -2,11 +2,24 @@
 this file contain logic to
 download / upload files from gcs
 """
+import base64
 import json
 import os
-from google.cloud import storage
-from google.cloud import datastore
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from parquet_write_automation.cloud.scripts.main.blob_cache import BlobCache
 from parquet_write_automation.cloud.scripts.main.cloud import Cloud
+from parquet_write_automation.common.scripts.main.lazy_import import lazy_import
+
+# the google client libraries take seconds to import, they are imported when the first client is created
+google_crc32c = lazy_import('google_crc32c')
+requests = lazy_import('requests')
+google_auth_requests = lazy_import('google.auth.transport.requests')
+storage = lazy_import('google.cloud.storage')
+datastore = lazy_import('google.cloud.datastore')
+service_account = lazy_import('google.oauth2.service_account')
 
 
 class StorageCredentialNotFound(Exception):
@@ -45,77 +58,279 @@ def get_secrets(path_:str)-> dict:
     except Exception as e:
         raise e
 
+class DownloadError(Exception):
+    """
+    One or more files of a prefix could not be downloaded
+    """
+
+    def __init__(self, message:str, downloaded_files:list, errors:dict):
+        super().__init__(message)
+        self.downloaded_files = downloaded_files
+        self.errors = errors
+
+
+class UploadVerificationError(Exception):
+    """
+    Uploaded object does not match the local file
+    """
+    pass
 
 
 class Gcs(Cloud):
     """
     class to handle all gcs related operation
     """
+    # blobs bigger than this are fetched as concurrent byte range slices of this size
+    download_slice_size = 64 * 1024 * 1024
+    # files bigger than this are uploaded as concurrent parts composed into the final object
+    composite_upload_threshold = 256 * 1024 * 1024
+    composite_part_size = 64 * 1024 * 1024
+    composite_upload_workers = 8
+    # maximum number of source objects of a single compose request
+    max_compose_sources = 32
 
-    def __init__(self):
-        self.client = self.gcs_auth_client()
+    # vault mounted json file holding the service account under the key SA
+    credentials_path = "/vault/secrets/gcp_credentials.json"
+    # connections kept open per host by the shared http session, sized for the concurrent transfers
+    http_pool_size = 32
+    # process wide cache of downloaded blobs, disabled until enable_blob_cache is called
+    blob_cache = None
 
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._credentials = None
+        self._client = None
+        self._datastore_client = None
 
- PATH = "/vault/secrets/gcp_credentials.json"
-        try:
-            cred = get_secrets(PATH)
-            key = cred["SA"]
-        except KeyError as ke:
-            raise StorageCredentialNotFound("Storage credentials not"
-                                            " mounted for gcs ")
-        gcs_sa = json.loads(key)
-        with open('gcs-sa.json', 'w') as json_file:
-            json.dump(gcs_sa, json_file)
+    def gcs_credentials(self)->'google.oauth2.service_account.Credentials':
+        """
+        this function reads the service account from vault once and keeps
+        the credentials in memory for every client created by this instance
+        :return: service account credentials
+        """
+        with self._lock:
+            if self._credentials is None:
+                try:
+                    cred = get_secrets(self.credentials_path)
+                    key = cred["SA"]
+                except KeyError:
+                    raise StorageCredentialNotFound("Storage credentials not"
+                                                    " mounted for gcs ")
+                self._credentials = service_account.Credentials.from_service_account_info(json.loads(key))
+            return self._credentials
 
+    @property
+    def client(self)->'google.cloud.storage.Client':
+        """
+        shared storage client, created on first access
+        :return: gcs client
+        """
+        with self._lock:
+            if self._client is None:
+                credentials = self.gcs_credentials()
+                session = google_auth_requests.AuthorizedSession(credentials)
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.http_pool_size,
+                                                        pool_maxsize=self.http_pool_size)
+                session.mount('https://', adapter)
+                self._client = storage.Client(project=credentials.project_id, credentials=credentials,
+                                              _http=session)
+            return self._client
 
-    @staticmethod
-    def gcs_auth_client()->google.cloud.storage.Client:
+    def gcs_auth_client(self)->'google.cloud.storage.Client':
         """
         google.cloud.storage.client.Client
-        this function creates and return gcs client
+        this function return the shared gcs client
         :return: gcs client
-        """       
-        return storage.Client.from_service_account_json('gcs-sa.json')
+        """
+        return self.client
 
-    @staticmethod
-    def gcs_data_store_client()->google.cloud.datastore.Client:
+    def gcs_data_store_client(self)->'google.cloud.datastore.Client':
         """
-        this function creates and return gcs client
-        :return: gcs client
-        """      
-        return datastore.Client.from_service_account_json('gcs-sa.json')
+        this function return the shared datastore client, created on first access
+        :return: datastore client
+        """
+        with self._lock:
+            if self._datastore_client is None:
+                credentials = self.gcs_credentials()
+                self._datastore_client = datastore.Client(project=credentials.project_id, credentials=credentials)
+            return self._datastore_client
+
+    def close(self):
+        """
+        this function closes the shared clients, they are created again on
+        next access
+        :return: None
+        """
+        with self._lock:
+            for client in (self._client, self._datastore_client):
+                if client is not None:
+                    client.close()
+            self._client = None
+            self._datastore_client = None
+
+    def refresh(self):
+        """
+        this function closes the shared clients and forgets the credentials,
+        so the next access reads the (possibly rotated) secret from vault again
+        :return: None
+        """
+        with self._lock:
+            self.close()
+            self._credentials = None
+
+    @classmethod
+    def enable_blob_cache(cls, cache_dir:str, max_bytes:int):
+        """
+        this function turns on the local cache of downloaded blobs for
+        download_file and the merged report downloads of ParquetWrite
+        :param cache_dir: (str) directory of the cache, shared by the tasks of a node
+        :param max_bytes: (int) size budget of the cache in bytes
+        :return: None
+        """
+        cls.blob_cache = BlobCache(cache_dir, max_bytes)
+
+    @classmethod
+    def disable_blob_cache(cls):
+        """
+        this function turns the blob cache off, the files on disk are kept
+        :return: None
+        """
+        cls.blob_cache = None
 
     def download_file(self, cloud_path:str, bucket_name:str, destination:str=None)->str:
         """
         this function downloads file from gcs and put it into destination
         mention in function called , if not mentioned it will create a
         sub directory downloads inside current working directory and put
-        it there. Also it return the path where downloaded files resides
+        it there. Also it return the path where downloaded files resides.
+        If the blob cache is enabled the file is served from it
         :param cloud_path: (str) gcs path for file to download
         :param bucket_name: (str) gcs bucket name
         :param destination: (str) destination where file will be downloaded
         :return: (str) path where downloaded file will reside
         """
-        blob=get_blob(bucket_name,cloud_path)
+        blob = self.get_blob(bucket_name, cloud_path)
         if not destination:
-            destination = os.path.join(os.path.dirname(os.path.abspath()), 'download')
+            destination = os.path.join(os.getcwd(), 'download')
         file_name = cloud_path.split('/')[-1]
         destination_file_path = os.path.join(destination, file_name)
+        if self.blob_cache is not None:
+            return self.blob_cache.fetch(blob, destination_file_path)
+        os.makedirs(destination, exist_ok=True)
         blob.download_to_filename(destination_file_path)
         return destination_file_path
 
-    def upload_file(self, file_path:str, bucket_name:str, cloud_path:str):
+    def upload_file(self, file_path:str, bucket_name:str, cloud_path:str, composite_threshold:int=None,
+                    part_size:int=None, max_workers:int=None):
         """
-        this function will upload file to gcs path
+        this function will upload file to gcs path. Files bigger than
+        composite_threshold are uploaded as parallel composite upload
         :param file_path: (str) local file path
         :param bucket_name: (str) gcs bucket name
         :param cloud_path: (str) gcs path where file will be uploaded
+        :param composite_threshold: (int) size in bytes above which the file is uploaded in parts,
+                                    defaults to composite_upload_threshold
+        :param part_size: (int) size in bytes of every part, defaults to composite_part_size
+        :param max_workers: (int) number of parts uploaded concurrently, defaults to composite_upload_workers
         :return: None
         """
-        blob=get_blob(bucket_name,cloud_path)
-        blob.upload_from_filename(file_path)
+        composite_threshold = composite_threshold or self.composite_upload_threshold
+        if os.path.getsize(file_path) > composite_threshold:
+            self.upload_composite(file_path, bucket_name, cloud_path, part_size or self.composite_part_size,
+                                  max_workers or self.composite_upload_workers)
+        else:
+            blob = self.get_blob(bucket_name, cloud_path)
+            blob.upload_from_filename(file_path)
 
-    def get_blob(bucket_name:str,cloud_path:str)->google.cloud.storage.blob.Blob:
+    def upload_composite(self, file_path:str, bucket_name:str, cloud_path:str, part_size:int, max_workers:int):
+        """
+        this function splits the file in parts of part_size bytes, uploads the
+        parts concurrently as temporary objects next to cloud_path and composes
+        them into a temporary object. The composed object is checked against the
+        size and crc32c of the local file and only then copied to cloud_path, so
+        a failed upload never replaces the object at cloud_path. The temporary
+        objects are always deleted
+        :param file_path: (str) local file path
+        :param bucket_name: (str) gcs bucket name
+        :param cloud_path: (str) gcs path where file will be uploaded
+        :param part_size: (int) size in bytes of every part
+        :param max_workers: (int) number of parts uploaded concurrently
+        :return: None
+        """
+        bucket = self.client.bucket(bucket_name)
+        file_size = os.path.getsize(file_path)
+        temp_prefix = "{}.parts-{}/".format(cloud_path, uuid.uuid4().hex)
+        temp_blobs = []
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                checksum_future = executor.submit(self.file_crc32c, file_path)
+                part_futures = []
+                for number, start in enumerate(range(0, file_size, part_size)):
+                    part_blob = bucket.blob("{}{:05d}".format(temp_prefix, number))
+                    temp_blobs.append(part_blob)
+                    part_futures.append(executor.submit(self.upload_part, part_blob, file_path, start,
+                                                        min(part_size, file_size - start)))
+                for future in part_futures:
+                    future.result()
+                expected_crc32c = checksum_future.result()
+
+            sources = temp_blobs
+            level = 0
+            while len(sources) > self.max_compose_sources:
+                # compose accepts a limited number of sources, so large files are composed in levels
+                level += 1
+                intermediates = []
+                for number in range(0, len(sources), self.max_compose_sources):
+                    intermediate = bucket.blob("{}compose-{}-{:05d}".format(temp_prefix, level, number))
+                    intermediate.compose(sources[number:number + self.max_compose_sources])
+                    intermediates.append(intermediate)
+                temp_blobs.extend(intermediates)
+                sources = intermediates
+
+            blob = bucket.blob("{}composed".format(temp_prefix))
+            blob.compose(sources)
+            temp_blobs.append(blob)
+            blob.reload()
+            if blob.size != file_size or blob.crc32c != expected_crc32c:
+                raise UploadVerificationError("Composed object gs://{}/{} has size {} and crc32c {}, expected "
+                                              "size {} and crc32c {}".format(bucket_name, cloud_path, blob.size,
+                                                                            blob.crc32c, file_size,
+                                                                            expected_crc32c))
+            # a copy inside the bucket does not move the bytes again
+            bucket.copy_blob(blob, bucket, cloud_path)
+        finally:
+            bucket.delete_blobs(temp_blobs, on_error=lambda blob: None)
+
+    @staticmethod
+    def upload_part(blob:'google.cloud.storage.blob.Blob', file_path:str, start:int, size:int):
+        """
+        this function uploads size bytes of the local file starting at start
+        :param blob: temporary blob the part is written to
+        :param file_path: (str) local file path
+        :param start: (int) offset of the part in the file
+        :param size: (int) size of the part in bytes
+        :return: None
+        """
+        with open(file_path, 'rb') as fp:
+            fp.seek(start)
+            blob.upload_from_file(fp, size=size, checksum='crc32c')
+
+    @staticmethod
+    def file_crc32c(file_path:str, chunk_size:int=8 * 1024 * 1024)->str:
+        """
+        this function computes the crc32c of a local file in the base64 form
+        gcs reports for objects
+        :param file_path: (str) local file path
+        :param chunk_size: (int) bytes read at a time
+        :return: (str) base64 encoded crc32c
+        """
+        checksum = google_crc32c.Checksum()
+        with open(file_path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(chunk_size), b''):
+                checksum.update(chunk)
+        return base64.b64encode(checksum.digest()).decode('utf-8')
+
+    def get_blob(self, bucket_name:str, cloud_path:str)->'google.cloud.storage.blob.Blob':
         """
         this function creates a blob for a given bucket_name and cloud_path
         :param bucket_name: (str) gcs bucket name
@@ -126,9 +341,22 @@ class Gcs(Cloud):
         bucket = client.bucket(bucket_name)
         blob = bucket.blob(cloud_path)
         return blob
-        
 
-    def download_files(self, cloud_path:str, bucket_name:str, destination:str)->list:
+    def list_files(self, cloud_path:str, bucket_name:str, recursive:bool=False)->list:
+        """
+        this function lists the files under the prefix cloud_path, the folder placeholder objects ending with '/'
+        are skipped
+        :param cloud_path: prefix of the files inside the bucket
+        :param bucket_name: bucket name
+        :param recursive: if False only the files directly under the prefix are listed
+        :return: list of blobs sorted by name
+        """
+        blobs = self.client.list_blobs(bucket_or_name=bucket_name, prefix=cloud_path,
+                                       delimiter=None if recursive else '/')
+        return sorted((blob for blob in blobs if not blob.name.rstrip().endswith("/")), key=lambda blob: blob.name)
+
+    def download_files(self, cloud_path:str, bucket_name:str, destination:str, max_workers:int=None,
+                       slice_size:int=None)->list:
         """
         this function download list of files mention in directory structure
         in gcs (apart from bucket) example : gs://bucket_name/A/B/C/1.txt ,
@@ -137,12 +365,18 @@ class Gcs(Cloud):
         :param cloud_path: path of directory structure inside a bucket
         :param bucket_name: bucket name
         :param destination: local path where file will be store
+        :param max_workers: if given, files are downloaded concurrently by this many workers
+        :param slice_size: size in bytes above which a file is downloaded as concurrent byte range slices,
+                           only used with max_workers, defaults to download_slice_size
         :return: List[str] list of downloaded file  local path
         """
         client = self.client
         blobs = client.list_blobs(bucket_or_name=bucket_name, prefix=cloud_path, delimiter='/')
         if not destination:
-            destination = os.path.join(os.path.dirname(os.path.abspath()), 'download')
+            destination = os.path.join(os.getcwd(), 'download')
+        if max_workers:
+            return self.download_blobs_concurrently(blobs, destination, max_workers,
+                                                    slice_size or self.download_slice_size)
         downloaded_files = []
         for blob in blobs:
 
@@ -152,3 +386,66 @@ class Gcs(Cloud):
                 blob.download_to_filename(destination_file_path)
                 downloaded_files.append(destination_file_path)
         return downloaded_files
+
+    def download_blobs_concurrently(self, blobs:'iterable of blobs', destination:str, max_workers:int,
+                                    slice_size:int)->list:
+        """
+        this function downloads blobs with a bounded pool of workers. Downloads
+        are submitted while the listing is still being paged, and blobs bigger
+        than slice_size are split into byte ranges which are written in place
+        into a preallocated local file. Files that fail are removed locally and
+        reported through DownloadError once every other file has finished
+        :param blobs: blobs to download, in listing order
+        :param destination: local path where file will be store
+        :param max_workers: number of concurrent downloads
+        :param slice_size: size in bytes above which a blob is downloaded in slices
+        :return: List[str] list of downloaded file local path in listing order
+        """
+        blob_futures = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for blob in blobs:
+                if blob.name.rstrip().endswith("/"):
+                    continue
+                file_name = blob.name.replace('/', '_')
+                destination_file_path = os.path.join(destination, file_name)
+                if blob.size is not None and blob.size > slice_size:
+                    with open(destination_file_path, 'wb') as fp:
+                        fp.truncate(blob.size)
+                    futures = [executor.submit(self.download_slice, blob, destination_file_path, start,
+                                               min(start + slice_size, blob.size) - 1)
+                               for start in range(0, blob.size, slice_size)]
+                else:
+                    futures = [executor.submit(blob.download_to_filename, destination_file_path)]
+                blob_futures.append((destination_file_path, futures))
+
+        downloaded_files = []
+        errors = {}
+        for destination_file_path, futures in blob_futures:
+            exceptions = [future.exception() for future in futures if future.exception() is not None]
+            if exceptions:
+                errors[destination_file_path] = exceptions[0]
+                if os.path.exists(destination_file_path):
+                    os.remove(destination_file_path)
+            else:
+                downloaded_files.append(destination_file_path)
+        if errors:
+            raise DownloadError("Failed to download {} of {} files: {}".format(len(errors), len(blob_futures),
+                                                                              list(errors.keys())),
+                                downloaded_files, errors)
+        return downloaded_files
+
+    @staticmethod
+    def download_slice(blob:'google.cloud.storage.blob.Blob', destination_file_path:str, start:int, end:int):
+        """
+        this function downloads the byte range [start, end] of a blob into the
+        same offsets of an existing local file. The generation is pinned so all
+        slices come from the same version of the object
+        :param blob: blob to download from
+        :param destination_file_path: preallocated local file
+        :param start: first byte of the slice
+        :param end: last byte of the slice (inclusive)
+        :return: None
+        """
+        with open(destination_file_path, 'r+b') as fp:
+            fp.seek(start)
+            blob.download_to_file(fp, start=start, end=end, if_generation_match=blob.generation)
@@ -0,0 +1,43 @@
+"""
+this file contain a helper to defer the import of heavy
+dependencies until they are first used
+"""
+import importlib
+import sys
+import threading
+import types
+
+_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    """
+    stand-in for a module which imports the real module on first attribute
+    access and then takes over its attributes, so later accesses cost the
+    same as on the real module. Unlike importlib.util.LazyLoader, a submodule
+    like pyarrow.parquet does not import its parent package upfront
+    """
+
+    def __getattr__(self, attribute:str):
+        # only called for attributes which are not set yet, so at most once per attribute before the import
+        with _lock:
+            module = importlib.import_module(self.__name__)
+            self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+    def __dir__(self):
+        return dir(importlib.import_module(self.__name__))
+
+
+def lazy_import(module_name:str)->types.ModuleType:
+    """
+    this function returns a module whose import is deferred until one of its
+    attributes is used, ex - pd = lazy_import('pandas'). An already imported
+    module is returned as is
+    :param module_name: dotted module name
+    :return: module
+    """
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    return LazyModule(module_name)
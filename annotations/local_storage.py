@@ -0,0 +1,320 @@
+"""
+this file contain logic to
+download / upload files from a local or nfs volume
+"""
+import errno
+import fcntl
+import io
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from parquet_write_automation.cloud.scripts.main.cloud import Cloud
+
+# ioctl request of linux which clones a file into another one (reflink) on btrfs, xfs and similar file systems
+FICLONE = 0x40049409
+
+
+def transfer_file(source:str, destination:str):
+    """
+    this function puts a copy of source at destination without moving the
+    bytes through user space, with a reflink or an in kernel os.sendfile copy
+    (see copy_file). Files are never hardlinked, callers rewrite their local
+    files in place, ex - the local output of a conversion on a re-run, which
+    would rewrite the stored object too. destination is replaced atomically
+    :param source: local file path
+    :param destination: local file path
+    :return: None
+    """
+    directory = os.path.dirname(os.path.abspath(destination))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        os.close(fd)
+        copy_file(source, temp_path)
+        os.replace(temp_path, destination)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def copy_file(source:str, destination:str):
+    """
+    this function copies source into a new file destination with a reflink if
+    the file system supports it and with os.sendfile otherwise
+    :param source: local file path
+    :param destination: local file path, created
+    :return: None
+    """
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+        size = os.fstat(src.fileno()).st_size
+        offset = 0
+        try:
+            while offset < size:
+                sent = os.sendfile(dst.fileno(), src.fileno(), offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS) or offset:
+                raise
+            # sendfile between these files is not supported, copy in user space
+            shutil.copyfileobj(src, dst, 8 * 1024 * 1024)
+
+
+class LocalObjectWriter(io.BufferedWriter):
+    """
+    writable stream of an object, the bytes go to a temporary file next to
+    the object which replaces it on close. Readers holding the previous
+    object open keep its content and an interrupted write never leaves a half
+    written object. Leaving a with block on an exception drops the temporary
+    file and keeps the previous object
+    """
+
+    def __init__(self, path:str):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        super().__init__(io.FileIO(fd, 'wb'))
+        self.path = path
+        self.aborted = False
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.aborted = exc_type is not None
+        return super().__exit__(exc_type, exc_value, traceback)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super().close()
+        except Exception:
+            self.aborted = True
+            raise
+        finally:
+            if self.aborted:
+                os.remove(self.temp_path)
+            else:
+                os.replace(self.temp_path, self.path)
+
+
+class LocalBlob:
+    """
+    object stored as the file root/bucket/name, with the part of the
+    interface of google.cloud.storage.blob.Blob used by this project. The
+    generation is the modification time of the file, so rewriting an object
+    changes it
+    """
+    # not tracked for local files, computing it would read the whole file
+    crc32c = None
+
+    def __init__(self, bucket:'LocalBucket', name:str):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.path, name)
+
+    @property
+    def generation(self)->int:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    @property
+    def size(self)->int:
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return None
+
+    def exists(self)->bool:
+        return os.path.isfile(self.path)
+
+    def reload(self):
+        if not self.exists():
+            raise FileNotFoundError(self.path)
+
+    def download_to_filename(self, file_name:str, if_generation_match:int=None):
+        if if_generation_match is not None and if_generation_match != self.generation:
+            raise ValueError("generation of {} changed".format(self.name))
+        transfer_file(self.path, file_name)
+
+    def upload_from_filename(self, file_name:str, content_type:str=None):
+        transfer_file(file_name, self.path)
+
+    def upload_from_string(self, data:'str/bytes', content_type:str=None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data.encode('utf-8') if isinstance(data, str) else data)
+        os.replace(temp_path, self.path)
+
+    def open(self, mode:str='rb', chunk_size:int=None, ignore_flush:bool=False, if_generation_match:int=None):
+        if if_generation_match is not None and if_generation_match != self.generation:
+            raise ValueError("generation of {} changed".format(self.name))
+        if 'w' in mode:
+            # never written in place, see LocalObjectWriter
+            writer = LocalObjectWriter(self.path)
+            return writer if 'b' in mode else io.TextIOWrapper(writer, encoding='utf-8')
+        return open(self.path, mode)
+
+    def delete(self):
+        os.remove(self.path)
+
+
+class LocalBucket:
+    """
+    bucket stored as the directory root/name
+    """
+
+    def __init__(self, root:str, name:str):
+        self.name = name
+        self.path = os.path.join(root, name)
+
+    def blob(self, name:str)->LocalBlob:
+        return LocalBlob(self, name)
+
+    def get_blob(self, name:str)->LocalBlob:
+        blob = LocalBlob(self, name)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix:str='', delimiter:str=None)->list:
+        """
+        this function lists the objects whose name starts with prefix, sorted
+        by name like gcs. With delimiter '/' only the objects directly under
+        the prefix are listed and only the directory of the prefix is read,
+        otherwise the directory of the prefix is walked with its sub
+        directories
+        :param prefix: name prefix
+        :param delimiter: '/' or None
+        :return: list of blobs
+        """
+        start = os.path.join(self.path, os.path.dirname(prefix))
+        blobs = []
+        for directory, directory_names, file_names in os.walk(start):
+            if delimiter:
+                # objects in sub directories have the delimiter after the prefix
+                directory_names.clear()
+            for file_name in file_names:
+                name = os.path.relpath(os.path.join(directory, file_name), self.path).replace(os.sep, '/')
+                if not name.startswith(prefix) or file_name.endswith('.tmp'):
+                    continue
+                if delimiter and delimiter in name[len(prefix):]:
+                    continue
+                blobs.append(LocalBlob(self, name))
+        return sorted(blobs, key=lambda blob: blob.name)
+
+
+class LocalStorageClient:
+    """
+    storage client whose buckets are the directories under root
+    """
+
+    def __init__(self, root:str):
+        self.root = root
+
+    def bucket(self, name:str)->LocalBucket:
+        return LocalBucket(self.root, name)
+
+    def list_blobs(self, bucket_or_name:str, prefix:str='', delimiter:str=None)->list:
+        return self.bucket(bucket_or_name).list_blobs(prefix, delimiter)
+
+    def close(self):
+        pass
+
+
+class LocalStorage(Cloud):
+    """
+    class to handle storage on a local or nfs volume, buckets are the
+    directories under root_path. Files are copied with reflinks or
+    os.sendfile instead of being read and written, so transfers run at disk
+    speed
+    """
+    root_path = os.environ.get('LOCAL_STORAGE_ROOT', '/data/storage')
+    download_workers = 8
+    # blobs of local files are never cached, they are already on local disk
+    blob_cache = None
+
+    def __init__(self, root_path:str=None):
+        """
+        :param root_path: directory holding the buckets, defaults to the class attribute root_path
+        """
+        self.client = LocalStorageClient(root_path or self.root_path)
+
+    def get_blob(self, bucket_name:str, cloud_path:str)->LocalBlob:
+        """
+        this function creates a blob for a given bucket_name and cloud_path
+        :param bucket_name: (str) bucket name
+        :param cloud_path: (str) path of the object inside the bucket
+        :return: blob
+        """
+        return self.client.bucket(bucket_name).blob(cloud_path)
+
+    def download_file(self, cloud_path:str, bucket_name:str, destination:str=None)->str:
+        """
+        this function puts the file into destination, a sub directory download
+        of the current working directory if not mentioned
+        :param cloud_path: (str) path of the file inside the bucket
+        :param bucket_name: (str) bucket name
+        :param destination: (str) destination where file will be downloaded
+        :return: (str) path where downloaded file will reside
+        """
+        destination = destination or os.path.join(os.getcwd(), 'download')
+        destination_file_path = os.path.join(destination, cloud_path.split('/')[-1])
+        self.get_blob(bucket_name, cloud_path).download_to_filename(destination_file_path)
+        return destination_file_path
+
+    def upload_file(self, file_path:str, bucket_name:str, cloud_path:str, *args, **kwargs):
+        """
+        this function puts the local file at cloud_path, the gcs upload options are accepted and ignored
+        :param file_path: (str) local file path
+        :param bucket_name: (str) bucket name
+        :param cloud_path: (str) path of the file inside the bucket
+        :return: None
+        """
+        self.get_blob(bucket_name, cloud_path).upload_from_filename(file_path)
+
+    def download_files(self, cloud_path:str, bucket_name:str, destination:str, max_workers:int=None,
+                       slice_size:int=None)->list:
+        """
+        this function puts the files directly under the prefix cloud_path into
+        destination, named like Gcs.download_files does (A/B/1.txt -> A_B_1.txt)
+        :param cloud_path: prefix of the files inside the bucket
+        :param bucket_name: bucket name
+        :param destination: local path where file will be store
+        :param max_workers: number of files transferred concurrently, defaults to download_workers
+        :param slice_size: accepted for compatibility with Gcs.download_files, files are never sliced
+        :return: List[str] list of downloaded file local path in listing order
+        """
+        destination = destination or os.path.join(os.getcwd(), 'download')
+        blobs = self.list_files(cloud_path, bucket_name)
+        destination_file_paths = [os.path.join(destination, blob.name.replace('/', '_')) for blob in blobs]
+        with ThreadPoolExecutor(max_workers=max_workers or self.download_workers) as executor:
+            for future in [executor.submit(blob.download_to_filename, destination_file_path)
+                           for blob, destination_file_path in zip(blobs, destination_file_paths)]:
+                future.result()
+        return destination_file_paths
+
+    def list_files(self, cloud_path:str, bucket_name:str, recursive:bool=False)->list:
+        """
+        this function lists the files under the prefix cloud_path
+        :param cloud_path: prefix of the files inside the bucket
+        :param bucket_name: bucket name
+        :param recursive: if False only the files directly under the prefix are listed
+        :return: list of blobs sorted by name
+        """
+        return self.client.list_blobs(bucket_name, prefix=cloud_path, delimiter=None if recursive else '/')
+
+    def close(self):
+        """
+        nothing to close, kept for CloudFactory
+        :return: None
+        """
+        pass
@@ -0,0 +1,271 @@
+"""
+this file contain an asyncio pipeline which overlaps
+the download, conversion and upload of many reports
+"""
+import asyncio
+import functools
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from parquet_write_automation.parquet_write.scripts.main.ParquetWrite import ParquetWrite, \
+    convert_downloaded_report_job, convert_merged_report_job
+from parquet_write_automation.exception.scripts.main.exceptions import StorageFileNotFound
+
+
+class StagedBytesBudget:
+    """
+    asyncio semaphore counted in bytes, limiting the bytes of the reports
+    staged on local disk (not the memory of the conversions). A report bigger
+    than the whole budget is still admitted once nothing else holds the
+    budget, so it can not block the pipeline forever
+    """
+
+    def __init__(self, max_bytes:int):
+        """
+        :param max_bytes: bytes which can be staged on local disk at the same time
+        """
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, size:int):
+        """
+        this function waits until size bytes fit into the budget and takes them
+        :param size: bytes to take
+        :return: None
+        """
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.used == 0 or self.used + size <= self.max_bytes)
+            self.used += size
+
+    async def release(self, size:int):
+        """
+        this function gives size bytes back to the budget
+        :param size: bytes to give back
+        :return: None
+        """
+        async with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+class ReportPipeline:
+    """
+    converts many merged reports with the download, convert and upload
+    stages running at the same time, so while report N is converted report
+    N+1 is downloaded and report N-1 is uploaded. The stages are connected by
+    bounded queues, transfers are limited by max_transfers and the bytes of
+    reports staged on local disk by max_staged_bytes, which is what pushes
+    back on the downloads when conversion or upload fall behind.
+
+    Jobs which can not be split into the three stages (stream, partition_by,
+    part files, output targets or parallel workers) are converted whole in
+    the convert stage. Conversions run in spawned processes, or one at a time
+    in this process when the ParquetWrite has state those processes can not
+    rebuild, see ParquetWrite.worker_settings
+    """
+
+    def __init__(self, parquet_write:ParquetWrite=None, max_transfers:int=4, max_conversions:int=None,
+                 max_staged_bytes:int=4 * 1024 * 1024 * 1024, queue_size:int=2, work_dir:str=None):
+        """
+        :param parquet_write: instance whose clients are used for datastore and transfers, a new one if None
+        :param max_transfers: downloads plus uploads running at the same time
+        :param max_conversions: conversions running at the same time, defaults to the number of cpus
+        :param max_staged_bytes: disk space of the reports downloaded and not yet uploaded, a report is counted
+                                 as twice its size for its input and output file
+        :param queue_size: reports waiting between two stages
+        :param work_dir: local directory for the staged files, a temporary directory if None
+        """
+        self.parquet_write = parquet_write or ParquetWrite()
+        self.max_transfers = max_transfers
+        self.max_conversions = max_conversions or os.cpu_count() or 1
+        self.max_staged_bytes = max_staged_bytes
+        self.queue_size = queue_size
+        self.work_dir = work_dir
+
+    def run(self, jobs:list)->list:
+        """
+        this function runs the pipeline for jobs, see ParquetWrite.write_merge_reports_as_parquet
+        :param jobs: list of dict, each holding the keyword arguments of write_merge_report_as_parquet
+        :return: list of dict with job, status, total_row and exception for every job in the order of jobs
+        """
+        if self.work_dir:
+            return asyncio.run(self.run_async(jobs, self.work_dir))
+        with tempfile.TemporaryDirectory() as work_dir:
+            return asyncio.run(self.run_async(jobs, work_dir))
+
+    async def run_async(self, jobs:list, work_dir:str)->list:
+        """
+        coroutine of run
+        :param jobs: list of dict, each holding the keyword arguments of write_merge_report_as_parquet
+        :param work_dir: local directory for the staged files
+        :return: results of the jobs
+        """
+        loop = asyncio.get_running_loop()
+        results = [{'job': job, 'status': 'failure', 'total_row': None, 'exception': None} for job in jobs]
+        io_executor = ThreadPoolExecutor(max_workers=self.max_transfers)
+        cpu_executor, worker = self.parquet_write.conversion_executor(self.max_conversions)
+        try:
+            merge_inputs = await loop.run_in_executor(io_executor, self.parquet_write.resolve_merge_inputs,
+                                                      jobs, results)
+            # jobs whose input was already converted with the same settings are not converted again
+            plans, conversions = await loop.run_in_executor(io_executor, self.parquet_write.plan_merge_conversions,
+                                                            jobs, results, merge_inputs)
+            transfers = asyncio.Semaphore(self.max_transfers)
+            budget = StagedBytesBudget(self.max_staged_bytes)
+            download_queue = asyncio.Queue()
+            convert_queue = asyncio.Queue(maxsize=self.queue_size)
+            upload_queue = asyncio.Queue(maxsize=self.queue_size)
+            for index in sorted(plans):
+                if index not in conversions:
+                    download_queue.put_nowait(index)
+
+            async def fail(index, stage, e, staged):
+                logging.error("exception occur in {} of {}: {}".format(stage, jobs[index]['output_file_name'], e))
+                results[index]['exception'] = e
+                await self._unstage(staged, budget)
+
+            async def download():
+                while not download_queue.empty():
+                    index = download_queue.get_nowait()
+                    staged = self._staged(plans[index], index, work_dir)
+                    if self.runs_whole(jobs[index]):
+                        await convert_queue.put((index, staged))
+                        continue
+                    try:
+                        await self._download(loop, io_executor, transfers, budget, merge_inputs[index],
+                                             plans[index], staged)
+                    except Exception as e:
+                        await fail(index, 'download', e, staged)
+                        continue
+                    await convert_queue.put((index, staged))
+
+            async def convert():
+                while True:
+                    item = await convert_queue.get()
+                    if item is None:
+                        return
+                    index, staged = item
+                    try:
+                        conversion, uploaded = await self._convert(loop, cpu_executor, worker, jobs[index],
+                                                                   merge_inputs[index], plans[index], staged)
+                    except Exception as e:
+                        await fail(index, 'conversion', e, staged)
+                        continue
+                    if uploaded:
+                        conversions[index] = conversion
+                        await self._unstage(staged, budget)
+                        continue
+                    await upload_queue.put((index, staged, conversion))
+
+            async def upload():
+                while True:
+                    item = await upload_queue.get()
+                    if item is None:
+                        return
+                    index, staged, conversion = item
+                    plan = plans[index]
+                    try:
+                        async with transfers:
+                            await loop.run_in_executor(io_executor, self.parquet_write.gcs.upload_file,
+                                                       staged['output_file_name'], plan['output_bucket'],
+                                                       plan['output_file_path'])
+                    except Exception as e:
+                        await fail(index, 'upload', e, staged)
+                        continue
+                    conversions[index] = conversion
+                    await self._unstage(staged, budget)
+
+            downloaders = [asyncio.ensure_future(download()) for _ in range(self.max_transfers)]
+            converters = [asyncio.ensure_future(convert()) for _ in range(self.max_conversions)]
+            uploaders = [asyncio.ensure_future(upload()) for _ in range(self.max_transfers)]
+            await asyncio.gather(*downloaders)
+            for _ in converters:
+                await convert_queue.put(None)
+            await asyncio.gather(*converters)
+            for _ in uploaders:
+                await upload_queue.put(None)
+            await asyncio.gather(*uploaders)
+
+            await loop.run_in_executor(io_executor, self.parquet_write.record_merge_report_conversions,
+                                       jobs, results, merge_inputs, conversions, plans)
+        finally:
+            cpu_executor.shutdown()
+            io_executor.shutdown()
+        return results
+
+    @staticmethod
+    def runs_whole(job:dict)->bool:
+        """
+        this function tells if a job is converted whole in the convert stage, downloading and uploading itself
+        :param job: keyword arguments of write_merge_report_as_parquet
+        :return: bool
+        """
+        return bool(job.get('stream') or job.get('partition_by') or job.get('part_files_layout') or
+                    job.get('output_targets') or job.get('parallel_workers'))
+
+    @staticmethod
+    def _staged(plan:dict, index:int, work_dir:str)->dict:
+        # every job gets its own directory, jobs may share file names
+        job_dir = os.path.join(work_dir, str(index))
+        os.makedirs(job_dir, exist_ok=True)
+        return {'input_file_name': None,
+                'output_file_name': os.path.join(job_dir, plan['output_file_name'].split('/')[-1]),
+                'job_dir': job_dir, 'size': 0}
+
+    async def _download(self, loop, io_executor, transfers, budget, merge_input:tuple, plan:dict, staged:dict):
+        _, input_bucket_name, input_path = merge_input
+        blob = await loop.run_in_executor(
+            io_executor, self.parquet_write.storage_client.bucket(input_bucket_name).get_blob, input_path)
+        if blob is None:
+            raise StorageFileNotFound("No input file found at gs://{}/{}".format(input_bucket_name, input_path))
+        # the staged output is assumed to be at most the size of the input
+        await budget.acquire(2 * blob.size)
+        staged['size'] = 2 * blob.size
+        staged['input_file_name'] = os.path.join(staged['job_dir'], input_path.split('/')[-1])
+        async with transfers:
+            # the generation the reuse check was done with is the one converted
+            await loop.run_in_executor(io_executor, self.parquet_write.get_blob_for_merged_report,
+                                       input_bucket_name, input_path, staged['input_file_name'],
+                                       plan['input_generation'])
+
+    async def _convert(self, loop, cpu_executor, worker:'dict/ParquetWrite', job:dict, merge_input:tuple, plan:dict,
+                       staged:dict)->tuple:
+        merge_entry, input_bucket_name, input_path = merge_input
+        expected_row_count = ParquetWrite.expected_row_count(job, merge_entry)
+        if self.runs_whole(job):
+            # run_in_executor only forwards positional arguments
+            conversion = await loop.run_in_executor(cpu_executor, functools.partial(
+                convert_merged_report_job, worker, input_bucket_name, input_path,
+                job['column_name_for_report'], job['column_data_type_for_report'], job['output_format'],
+                plan['output_file_name'], plan['output_file_path'], plan['output_bucket'], job['delimiter'],
+                batch_size=job.get('batch_size'),
+                stream=job.get('stream', False), preflight=job.get('preflight', False),
+                expected_row_count=expected_row_count, partition_by=job.get('partition_by'),
+                max_rows_per_file=job.get('max_rows_per_file'), writer_profile=job.get('writer_profile'),
+                profile_objective=job.get('profile_objective', 'size'),
+                part_files_layout=job.get('part_files_layout'),
+                output_targets=plan['output_targets'], parser_engine=job.get('parser_engine'),
+                parallel_workers=job.get('parallel_workers'),
+                parallel_layout=job.get('parallel_layout', 'single'), input_generation=plan['input_generation']))
+            return conversion, True
+        conversion = await loop.run_in_executor(
+            cpu_executor, convert_downloaded_report_job, worker, staged['input_file_name'],
+            job['column_name_for_report'], job['column_data_type_for_report'], job['output_format'],
+            staged['output_file_name'], job['delimiter'],
+            job.get('batch_size'), job.get('preflight', False), expected_row_count, job.get('writer_profile'),
+            job.get('profile_objective', 'size'), job.get('parser_engine'))
+        # the input is not needed anymore once it is converted
+        os.remove(staged['input_file_name'])
+        return conversion, False
+
+    @staticmethod
+    async def _unstage(staged:dict, budget:StagedBytesBudget):
+        for file_name in (staged['input_file_name'], staged['output_file_name']):
+            if file_name and os.path.exists(file_name):
+                os.remove(file_name)
+        if staged['size']:
+            await budget.release(staged['size'])
+            staged['size'] = 0
@@ -0,0 +1,123 @@
+"""
+this file contain logic to compile the column data types
+of a report into a typed arrow schema
+"""
+from __future__ import annotations
+
+import re
+
+from parquet_write_automation.common.scripts.main.lazy_import import lazy_import
+
+pa = lazy_import('pyarrow')
+pc = lazy_import('pyarrow.compute')
+
+
+class ReportSchema:
+    """
+    Compiled form of column_data_type_for_report. Plain pandas dtypes are
+    passed to pd.read_csv as before, while the types below are read as strings
+    and parsed column by column with vectorized arrow kernels when a batch is
+    turned into an arrow table
+
+    timestamp, timestamp[unit] or timestamp[unit, timezone]
+    date
+    decimal(precision, scale)
+    dictionary or category (dictionary encoded strings)
+
+    int8/int16/int32/int64 stay numpy dtypes, so a missing value fails the
+    read like it always did. The pandas nullable types Int8/Int16/Int32/Int64
+    opt into integer columns with missing values, written as nulls
+
+    A type can also be given as dict, ex - {'type': 'timestamp', 'format': '%d/%m/%Y %H:%M',
+    'unit': 'ms', 'timezone': 'America/Mexico_City'}. Timestamps without %z in
+    their format are taken as wall time in timezone
+    """
+    # matched case insensitively against the original string, timezone names like America/Mexico_City are case
+    # sensitive
+    timestamp_pattern = re.compile(r'^timestamp(?:\[\s*(\w+)\s*(?:,\s*([^\]]+?)\s*)?\])?$', re.IGNORECASE)
+    decimal_pattern = re.compile(r'^decimal\(\s*(\d+)\s*,\s*(\d+)\s*\)$')
+
+    def __init__(self, column_name_for_report:list, column_data_type_for_report:dict=None):
+        """
+        :param column_name_for_report: list of columns of the report
+        :param column_data_type_for_report: data type of the columns, by column name
+        """
+        self.column_names = list(column_name_for_report)
+        self.read_dtypes = {}
+        self.arrow_types = {}
+        self.converters = {}
+        for column, spec in (column_data_type_for_report or {}).items():
+            self._compile_column(column, spec)
+
+    def _compile_column(self, column:str, spec):
+        options = spec if isinstance(spec, dict) else {}
+        type_name = options.get('type', spec) if isinstance(spec, dict) else spec
+        name = type_name.strip() if isinstance(type_name, str) else type_name
+        lowered = name.lower() if isinstance(name, str) else None
+
+        timestamp_match = self.timestamp_pattern.match(name) if lowered else None
+        decimal_match = self.decimal_pattern.match(lowered) if lowered else None
+        if timestamp_match:
+            unit = options.get('unit', (timestamp_match.group(1) or 'us').lower())
+            timezone = options.get('timezone', timestamp_match.group(2))
+            self._add_converter(column, pa.timestamp(unit, timezone),
+                                self._timestamp_converter(options.get('format'), unit, timezone))
+        elif lowered == 'date':
+            self._add_converter(column, pa.date32(), self._date_converter(options.get('format')))
+        elif decimal_match:
+            arrow_type = pa.decimal128(int(decimal_match.group(1)), int(decimal_match.group(2)))
+            self._add_converter(column, arrow_type, lambda strings: pc.cast(strings, arrow_type))
+        elif lowered in ('dictionary', 'category'):
+            self._add_converter(column, pa.dictionary(pa.int32(), pa.string()),
+                                lambda strings: strings.dictionary_encode())
+        else:
+            self.read_dtypes[column] = type_name
+
+    def _add_converter(self, column:str, arrow_type:pa.DataType, converter:'callable'):
+        self.read_dtypes[column] = 'str'
+        self.arrow_types[column] = arrow_type
+        self.converters[column] = converter
+
+    @staticmethod
+    def _timestamp_converter(format_:str, unit:str, timezone:str)->'callable':
+        def convert(strings):
+            if format_:
+                timestamps = pc.strptime(strings, format=format_, unit=unit)
+            else:
+                timestamps = pc.cast(strings, pa.timestamp(unit))
+            if timezone is None:
+                return timestamps
+            if timestamps.type.tz is not None:
+                # values parsed with %z are already normalised to UTC
+                return timestamps.cast(pa.timestamp(unit, timezone))
+            return pc.assume_timezone(timestamps, timezone)
+        return convert
+
+    @staticmethod
+    def _date_converter(format_:str)->'callable':
+        def convert(strings):
+            if format_:
+                return pc.strptime(strings, format=format_, unit='s').cast(pa.date32())
+            return pc.cast(strings, pa.date32())
+        return convert
+
+    def to_table(self, df:'pd.DataFrame')->pa.Table:
+        """
+        this function converts a batch read with read_dtypes into an arrow table
+        with the compiled types, parsing one whole column at a time
+        :param df: data frame read with read_dtypes
+        :return: arrow table
+        """
+        arrays = []
+        fields = []
+        for column in df.columns:
+            converter = self.converters.get(column)
+            if converter is not None:
+                array = converter(pa.array(df[column], type=pa.string(), from_pandas=True))
+            elif column in self.arrow_types:
+                array = pa.array(df[column], type=self.arrow_types[column], from_pandas=True)
+            else:
+                array = pa.array(df[column], from_pandas=True)
+            arrays.append(array)
+            fields.append(pa.field(column, array.type))
+        return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
@@ -0,0 +1,68 @@
+"""
+this file contain logic to split a local report into byte
+ranges which start and end on record boundaries, so the
+ranges can be converted in parallel
+"""
+import mmap
+import os
+
+
+def find_record_ranges(file_name:str, parts:int, min_range_bytes:int=1, scan_chunk_size:int=64 * 1024 * 1024)->list:
+    """
+    this function splits the report into at most parts byte ranges of about
+    the same size. A range ends right after a newline which is outside of
+    quoted fields, so quoted fields holding newlines are never cut. Quotes
+    are taken as csv quoting (a field is quoted as a whole and a quote inside
+    it is doubled), so a newline is outside of quotes when the number of
+    quotes before it is even. Reports without quotes are not scanned at all,
+    otherwise the quotes are counted once up to the last split point
+    :param file_name: local path of the report
+    :param parts: number of ranges wanted
+    :param min_range_bytes: ranges are not made smaller than this, so small reports get fewer ranges
+    :param scan_chunk_size: bytes of the memory mapped report counted at a time
+    :return: list of (start, end) byte offsets in file order, covering the whole report, empty for an empty report
+    """
+    size = os.path.getsize(file_name)
+    if size == 0:
+        return []
+    parts = max(1, min(parts, size // max(min_range_bytes, 1)))
+    ranges = []
+    start = 0
+    with open(file_name, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        quoted = mm.find(b'"') != -1
+        # quotes in mm[:counted_to]
+        quotes = 0
+        counted_to = 0
+        for index in range(1, parts):
+            position = max(size * index // parts, start)
+            boundary = None
+            while boundary is None:
+                newline = mm.find(b'\n', position)
+                if newline == -1:
+                    break
+                if quoted:
+                    quotes += count_quotes(mm, counted_to, newline, scan_chunk_size)
+                    counted_to = newline
+                    if quotes % 2:
+                        # the newline is inside a quoted field
+                        position = newline + 1
+                        continue
+                boundary = newline + 1
+            if boundary is None or boundary >= size:
+                break
+            ranges.append((start, boundary))
+            start = boundary
+    ranges.append((start, size))
+    return ranges
+
+
+def count_quotes(mm:mmap.mmap, start:int, end:int, chunk_size:int)->int:
+    """
+    this function counts the quotes in mm[start:end], chunk by chunk so only one chunk is copied at a time
+    :param mm: memory mapped report
+    :param start: first byte
+    :param end: end of the bytes (exclusive)
+    :param chunk_size: bytes counted at a time
+    :return: number of quotes
+    """
+    return sum(mm[offset:min(offset + chunk_size, end)].count(b'"') for offset in range(start, end, chunk_size))
@@ -0,0 +1,162 @@
+"""
+this file contain the per stage timing and throughput
+instrumentation of a parquet write run
+"""
+import contextlib
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+
+class StageMetrics:
+    """
+    accumulates wall time, bytes, rows and peak RSS for the stages of a run,
+    ex - datastore_query, download, parse, encode, upload, datastore_put. A
+    stage can be entered many times, ex - once per batch, its numbers add up.
+    Peak RSS is the high water mark of the process when the stage last
+    finished, so it only grows from one stage to the next.
+
+    Hooks are objects with the optional methods stage_started(stage) and
+    stage_finished(stage, record), called around every entry of a stage, so
+    profilers can be attached without changing the conversion code
+    """
+    prometheus_prefix = 'parquet_write_stage'
+
+    def __init__(self, hooks:list=None):
+        """
+        :param hooks: objects notified when a stage starts and finishes
+        """
+        self.hooks = list(hooks or [])
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name:str, rows:int=0, bytes_:int=0):
+        """
+        this function times the block as one entry of stage name. The rows and
+        bytes processed can be given upfront or added to the yielded dict
+        :param name: stage name
+        :param rows: rows processed by the block
+        :param bytes_: bytes processed by the block
+        :return: context manager yielding a dict with rows and bytes
+        """
+        counts = {'rows': rows, 'bytes': bytes_}
+        self._notify('stage_started', name)
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.add(name, time.perf_counter() - start, counts['rows'], counts['bytes'])
+
+    def iterate(self, name:str, iterable:'iterable'):
+        """
+        this function yields the items of iterable, timing every next() as an
+        entry of stage name, ex - the batches of a chunked pandas reader
+        :param name: stage name
+        :param iterable: iterable to time
+        :return: generator
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name) as counts:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                counts['rows'] = len(item) if hasattr(item, '__len__') else 0
+            yield item
+
+    def add(self, name:str, seconds:float, rows:int=0, bytes_:int=0):
+        """
+        this function adds one entry to stage name
+        :param name: stage name
+        :param seconds: wall time of the entry
+        :param rows: rows processed
+        :param bytes_: bytes processed
+        :return: None
+        """
+        with self._lock:
+            record = self.stages.setdefault(name, {'seconds': 0.0, 'rows': 0, 'bytes': 0, 'calls': 0,
+                                                   'peak_rss_bytes': 0})
+            record['seconds'] += seconds
+            record['rows'] += rows or 0
+            record['bytes'] += bytes_ or 0
+            record['calls'] += 1
+            record['peak_rss_bytes'] = max(record['peak_rss_bytes'], self.peak_rss())
+            record = dict(record)
+        self._notify('stage_finished', name, record)
+
+    @staticmethod
+    def peak_rss()->int:
+        """
+        this function returns the peak resident set size of the process
+        :return: bytes
+        """
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # linux reports kilobytes, macos bytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    def to_dict(self)->dict:
+        """
+        this function returns the metrics of every stage with rows/sec and bytes/sec, as stored on the
+        ParquetWriteTask entity
+        :return: dict by stage name
+        """
+        with self._lock:
+            stages = {name: dict(record) for name, record in self.stages.items()}
+        for record in stages.values():
+            seconds = record['seconds']
+            record['rows_per_sec'] = record['rows'] / seconds if seconds else None
+            record['bytes_per_sec'] = record['bytes'] / seconds if seconds else None
+        return stages
+
+    def log_json(self, **labels):
+        """
+        this function emits the metrics as a single JSON log line
+        :param labels: fields added to the line, ex - dag_id, run_id
+        :return: None
+        """
+        logging.info(json.dumps(dict(labels, event='parquet_write_stage_metrics', stages=self.to_dict()),
+                                default=str))
+
+    def write_prometheus_textfile(self, path:str, **labels):
+        """
+        this function writes the metrics in the prometheus text format, for the
+        textfile collector of the node exporter. The file is replaced atomically
+        :param path: path of the .prom file
+        :param labels: labels added to every sample, ex - dag_id
+        :return: None
+        """
+        lines = []
+        for name, record in sorted(self.to_dict().items()):
+            sample_labels = dict(labels, stage=name)
+            label_text = ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                  for key, value in sorted(sample_labels.items()))
+            for metric in ('seconds', 'rows', 'bytes', 'calls', 'peak_rss_bytes', 'rows_per_sec', 'bytes_per_sec'):
+                if record[metric] is not None:
+                    lines.append('{}_{}{{{}}} {}'.format(self.prometheus_prefix, metric, label_text, record[metric]))
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                fp.write('\n'.join(lines) + '\n')
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _notify(self, method:str, *args):
+        for hook in self.hooks:
+            callback = getattr(hook, method, None)
+            if callback is None:
+                continue
+            try:
+                callback(*args)
+            except Exception:
+                logging.exception("metrics hook {} failed in {}".format(hook, method))
@@ -0,0 +1,181 @@
+"""
+this file contain the parquet writer settings
+and the logic to pick them from a sample of the report
+"""
+from __future__ import annotations
+
+import logging
+import time
+
+from parquet_write_automation.common.scripts.main.lazy_import import lazy_import
+
+pa = lazy_import('pyarrow')
+pq = lazy_import('pyarrow.parquet')
+
+# data page sizes the auto mode compares for the chosen codec, None is the pyarrow default of 1 MiB
+candidate_data_page_sizes = (64 * 1024, None, 8 * 1024 * 1024)
+# uncompressed bytes of a row group in the auto mode. A sample is smaller than any useful row group, so row group
+# sizes can not be compared on it and the rows of a row group are derived from the width of the sample rows instead
+target_row_group_bytes = 128 * 1024 * 1024
+
+
+class ParquetWriterProfile:
+    """
+    settings of the parquet writer. Settings left as None use the pyarrow
+    default, so ParquetWriterProfile() writes snappy files like before
+    """
+
+    def __init__(self, compression:str='snappy', compression_level:int=None, row_group_size:int=None,
+                 data_page_size:int=None, use_dictionary:'bool/list'=True, column_encoding:dict=None):
+        """
+        :param compression: codec, ex - snappy, zstd, gzip, lz4, brotli or none
+        :param compression_level: level of the codec, only for codecs which have levels
+        :param row_group_size: maximum rows of a row group
+        :param data_page_size: target size of a data page in bytes
+        :param use_dictionary: True/False for every column or the list of dictionary encoded columns
+        :param column_encoding: encoding by column name for columns which are not dictionary encoded,
+                                ex - {'qty': 'DELTA_BINARY_PACKED'}
+        """
+        self.compression = compression
+        self.compression_level = compression_level
+        self.row_group_size = row_group_size
+        self.data_page_size = data_page_size
+        self.use_dictionary = use_dictionary
+        self.column_encoding = column_encoding
+
+    @classmethod
+    def from_dict(cls, profile:dict)->'ParquetWriterProfile':
+        """
+        this function creates a profile from its dict form, ex - the writer_profile of a dag config
+        :param profile: dict with the arguments of ParquetWriterProfile
+        :return: profile
+        """
+        return cls(**profile)
+
+    def to_dict(self)->dict:
+        """
+        this function returns the dict form of the profile, as recorded on the ParquetWriteTask entity
+        :return: dict
+        """
+        return {'compression': self.compression, 'compression_level': self.compression_level,
+                'row_group_size': self.row_group_size, 'data_page_size': self.data_page_size,
+                'use_dictionary': self.use_dictionary, 'column_encoding': self.column_encoding}
+
+    def writer_kwargs(self)->dict:
+        """
+        this function returns the keyword arguments of pq.ParquetWriter and pq.write_table for the profile,
+        row_group_size is passed to write_table separately
+        :return: dict
+        """
+        kwargs = {'compression': self.compression, 'use_dictionary': self.use_dictionary}
+        if self.compression_level is not None:
+            kwargs['compression_level'] = self.compression_level
+        if self.data_page_size is not None:
+            kwargs['data_page_size'] = self.data_page_size
+        if self.column_encoding:
+            kwargs['column_encoding'] = self.column_encoding
+        return kwargs
+
+    def __repr__(self):
+        return "ParquetWriterProfile({})".format(self.to_dict())
+
+
+def get_writer_profile(writer_profile:'ParquetWriterProfile/dict/None')->ParquetWriterProfile:
+    """
+    this function returns the profile given as profile, dict or None (the default profile)
+    :param writer_profile: profile, its dict form or None
+    :return: profile
+    """
+    if writer_profile is None:
+        return ParquetWriterProfile()
+    if isinstance(writer_profile, dict):
+        return ParquetWriterProfile.from_dict(writer_profile)
+    return writer_profile
+
+
+def candidate_profiles(sample:pa.Table, max_dictionary_ratio:float=0.5)->list:
+    """
+    this function returns the profiles the auto mode benchmarks. Besides the
+    plain codecs, zstd is tried with dictionary encoding only on the columns
+    whose share of distinct values in the sample is below max_dictionary_ratio
+    :param sample: sample of the report
+    :param max_dictionary_ratio: distinct values / rows below which a column is dictionary encoded
+    :return: list of profiles
+    """
+    low_cardinality = []
+    for name, column in zip(sample.column_names, sample.columns):
+        if sample.num_rows and len(column.unique()) / sample.num_rows < max_dictionary_ratio:
+            low_cardinality.append(name)
+    return [ParquetWriterProfile('snappy'),
+            ParquetWriterProfile('lz4'),
+            ParquetWriterProfile('zstd', compression_level=1),
+            ParquetWriterProfile('zstd', compression_level=9),
+            ParquetWriterProfile('zstd', compression_level=3, use_dictionary=low_cardinality)]
+
+
+def choose_profile(sample:pa.Table, objective:str='size', candidates:list=None)->ParquetWriterProfile:
+    """
+    this function writes the sample with every candidate profile into memory
+    and returns the one producing the smallest output (objective size) or the
+    one writing fastest (objective speed). Without candidates the codec is
+    chosen among candidate_profiles(sample) first and then its data page size
+    among layout_profiles, with the row group size of row_group_rows
+    :param sample: sample of the report
+    :param objective: size or speed
+    :param candidates: profiles to compare, defaults to the two rounds above
+    :return: chosen profile
+    """
+    if objective not in ('size', 'speed'):
+        raise ValueError("objective should be size or speed but found {}".format(objective))
+    if candidates:
+        return best_profile(sample, objective, candidates)
+    profile = best_profile(sample, objective, candidate_profiles(sample))
+    return best_profile(sample, objective, layout_profiles(sample, profile))
+
+
+def layout_profiles(sample:pa.Table, profile:ParquetWriterProfile)->list:
+    """
+    this function returns the profile with every size of candidate_data_page_sizes and the row group size of
+    row_group_rows, the codec and the encodings of profile are kept
+    :param sample: sample of the report
+    :param profile: profile whose codec and encodings are kept
+    :return: list of profiles
+    """
+    row_group_size = row_group_rows(sample)
+    return [ParquetWriterProfile.from_dict(dict(profile.to_dict(), row_group_size=row_group_size,
+                                                data_page_size=data_page_size))
+            for data_page_size in candidate_data_page_sizes]
+
+
+def row_group_rows(sample:pa.Table, row_group_bytes:int=None)->int:
+    """
+    this function returns the number of rows of a row group of row_group_bytes uncompressed bytes, estimated
+    from the average width of the sample rows
+    :param sample: sample of the report
+    :param row_group_bytes: target uncompressed size of a row group, defaults to target_row_group_bytes
+    :return: rows, None for an empty sample (the pyarrow default)
+    """
+    if not sample.num_rows or not sample.nbytes:
+        return None
+    return max(1, (row_group_bytes or target_row_group_bytes) * sample.num_rows // sample.nbytes)
+
+
+def best_profile(sample:pa.Table, objective:str, candidates:list)->ParquetWriterProfile:
+    """
+    this function writes the sample with every candidate profile into memory and returns the best one for the
+    objective, candidates writing the same size are ordered by their write time and the other way around
+    :param sample: sample of the report
+    :param objective: size or speed
+    :param candidates: profiles to compare
+    :return: best profile
+    """
+    results = []
+    for profile in candidates:
+        sink = pa.BufferOutputStream()
+        start = time.perf_counter()
+        pq.write_table(sample, sink, row_group_size=profile.row_group_size, **profile.writer_kwargs())
+        elapsed = time.perf_counter() - start
+        size = sink.getvalue().size
+        logging.info("Writer profile {} wrote sample in {:.3f}s as {} bytes".format(profile, elapsed, size))
+        results.append(((size, elapsed) if objective == 'size' else (elapsed, size), profile))
+    return min(results, key=lambda result: result[0])[1]
@@ -0,0 +1,130 @@
+"""
+this file contain an in memory stand-in for the datastore
+client, so ParquetWrite can be benchmarked on the local
+storage backend without any cloud access
+"""
+import contextlib
+import threading
+
+from google.cloud import datastore
+from google.cloud.datastore import query as datastore_query
+
+from parquet_write_automation.cloud.scripts.main.local_storage import LocalStorage
+from parquet_write_automation.datastore.scripts.main.db import Db
+from parquet_write_automation.parquet_write.scripts.main.ParquetWrite import ParquetWrite
+
+
+class FakeQuery:
+    """
+    query on the entities of a kind with equality filters, which may be
+    combined with And and Or like Db.get_datastore_entries_for_filter_maps does
+    """
+
+    def __init__(self, client:'InMemoryDatastore', kind:str, order:tuple=(), projection:tuple=()):
+        self.client = client
+        self.kind = kind
+        self.order = list(order or ())
+        self.filters = []
+
+    def add_filter(self, property_name:str=None, operator:str='=', value=None, filter=None):
+        if filter is None:
+            filter = datastore_query.PropertyFilter(property_name, operator, value)
+        self.check_filter(filter)
+        self.filters.append(filter)
+        return self
+
+    @classmethod
+    def check_filter(cls, filter):
+        if isinstance(filter, datastore_query.PropertyFilter):
+            if filter.operator != '=':
+                raise NotImplementedError("only equality filters are supported by the benchmark datastore")
+        elif isinstance(filter, (datastore_query.And, datastore_query.Or)):
+            for nested in filter.filters:
+                cls.check_filter(nested)
+        else:
+            raise NotImplementedError("unsupported filter {!r}".format(filter))
+
+    @classmethod
+    def matches(cls, entry, filter)->bool:
+        if isinstance(filter, datastore_query.PropertyFilter):
+            return Db.entry_matches_filter_map(entry, {filter.property_name: filter.value})
+        nested = (cls.matches(entry, nested_filter) for nested_filter in filter.filters)
+        return all(nested) if isinstance(filter, datastore_query.And) else any(nested)
+
+    def keys_only(self):
+        pass
+
+    def fetch(self, limit:int=None, start_cursor=None):
+        entries = [entry for entry in self.client.entities_of(self.kind)
+                   if all(self.matches(entry, filter) for filter in self.filters)]
+        for name in reversed(self.order):
+            property_name = name.lstrip('-')
+            entries.sort(key=lambda entry: (entry.get(property_name) is not None, entry.get(property_name)),
+                         reverse=name.startswith('-'))
+        return iter(entries[:limit] if limit is not None else entries)
+
+
+class InMemoryDatastore:
+    """
+    the part of google.cloud.datastore.Client used by Db, entities are kept in a dict by key
+    """
+    project = 'benchmark'
+
+    def __init__(self):
+        self.entities = {}
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def key(self, *path_args)->datastore.Key:
+        return datastore.Key(*path_args, project=self.project)
+
+    def query(self, kind:str, order:tuple=(), projection:tuple=())->FakeQuery:
+        return FakeQuery(self, kind, order, projection)
+
+    def entities_of(self, kind:str)->list:
+        with self._lock:
+            return [entity for key, entity in self.entities.items() if key.kind == kind]
+
+    def transaction(self):
+        # puts are applied immediately, the transaction only has to be a context manager
+        return contextlib.nullcontext(self)
+
+    def get(self, key:datastore.Key):
+        with self._lock:
+            return self.entities.get(key)
+
+    def get_multi(self, keys:list)->list:
+        with self._lock:
+            return [self.entities[key] for key in keys if key in self.entities]
+
+    def put(self, entity:datastore.Entity):
+        with self._lock:
+            if entity.key.is_partial:
+                entity.key = entity.key.completed_key(self._next_id)
+                self._next_id += 1
+            self.entities[entity.key] = entity
+
+    def put_multi(self, entities:list):
+        for entity in entities:
+            self.put(entity)
+
+    def delete_multi(self, keys:list):
+        with self._lock:
+            for key in keys:
+                self.entities.pop(key, None)
+
+    def close(self):
+        pass
+
+
+def fake_parquet_write(storage_root:str, datastore_client:InMemoryDatastore=None)->ParquetWrite:
+    """
+    this function builds a ParquetWrite on a LocalStorage under storage_root and the datastore stand-in
+    :param storage_root: directory holding the buckets
+    :param datastore_client: datastore stand-in, a new one if None
+    :return: ParquetWrite
+    """
+    parquet_write = ParquetWrite('local')
+    parquet_write.gcs = LocalStorage(storage_root)
+    parquet_write.datastore_client = datastore_client or InMemoryDatastore()
+    return parquet_write
@@ -0,0 +1,273 @@
+"""
+this file contain the end to end benchmark of write_merge_report_as_parquet.
+Synthetic merged reports are converted into every output format against the
+local storage backend and the in memory datastore of fakes.py, every case in
+its own process so peak memory is measured per case. ex -
+
+python -m benchmark.run_benchmark --rows 1000000 --columns 20 --output results.json
+python -m benchmark.run_benchmark --output results.json --baseline baseline.json --threshold 0.1
+python -m benchmark.run_benchmark --formats parquet --delimiter '|' '~~' --parser-engines native python
+python -m benchmark.run_benchmark --formats parquet csv --rows 20000000 --parallel-workers 8
+"""
+import argparse
+import datetime
+import decimal
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from google.cloud import datastore
+
+from benchmark.fakes import InMemoryDatastore, fake_parquet_write
+
+# column types of a report, cycled through when building the columns of a dtype mix
+dtype_mixes = {
+    'numeric': ['int64', 'float64'],
+    'string': ['str', 'category'],
+    'mixed': ['int64', 'float64', 'str', 'timestamp[ms]', 'date', 'decimal(12,2)', 'category'],
+}
+# metrics compared against a baseline, with the direction in which a change is a regression
+compared_metrics = {'rows_per_sec': 'lower', 'peak_rss_bytes': 'higher', 'output_bytes': 'higher'}
+merge_kind = 'MergeReportTask'
+input_bucket = 'benchmark-input'
+output_bucket = 'benchmark-output'
+
+
+def synthetic_value(dtype:str, row:int, rng:random.Random)->str:
+    """
+    this function returns the text of a value of dtype
+    :param dtype: column type
+    :param row: row number
+    :param rng: random generator
+    :return: value as written in the report
+    """
+    if dtype == 'int64':
+        return str(rng.randint(-10 ** 9, 10 ** 9))
+    if dtype == 'float64':
+        return repr(rng.uniform(-10 ** 6, 10 ** 6))
+    if dtype.startswith('timestamp'):
+        moment = datetime.datetime(2020, 1, 1) + datetime.timedelta(seconds=rng.randint(0, 10 ** 8))
+        return moment.strftime('%Y-%m-%d %H:%M:%S')
+    if dtype == 'date':
+        return (datetime.date(2020, 1, 1) + datetime.timedelta(days=rng.randint(0, 3650))).isoformat()
+    if dtype.startswith('decimal'):
+        return str(decimal.Decimal(rng.randint(-10 ** 8, 10 ** 8)) / 100)
+    if dtype == 'category':
+        return 'store_{}'.format(rng.randint(0, 50))
+    return 'item_{}_{}'.format(row, rng.randint(0, 10 ** 6))
+
+
+def generate_report(file_name:str, rows:int, columns:int, delimiter:str, dtype_mix:str='mixed',
+                    seed:int=0)->tuple:
+    """
+    this function writes a synthetic merged report, headerless like the merged reports of MergeReportTask
+    :param file_name: local path of the report
+    :param rows: number of rows
+    :param columns: number of columns
+    :param delimiter: delimiter of the report
+    :param dtype_mix: key of dtype_mixes
+    :param seed: seed of the random values
+    :return: column names and column data types of the report
+    """
+    mix = dtype_mixes[dtype_mix]
+    dtypes = [mix[index % len(mix)] for index in range(columns)]
+    column_names = ['col_{}'.format(index) for index in range(columns)]
+    rng = random.Random(seed)
+    with open(file_name, 'w') as fp:
+        for row in range(rows):
+            fp.write(delimiter.join(synthetic_value(dtype, row, rng) for dtype in dtypes))
+            fp.write('\n')
+    return column_names, dict(zip(column_names, dtypes))
+
+
+def run_case(case:dict, work_dir:str)->dict:
+    """
+    this function converts the report of a case end to end and measures it, it is run in a fresh process
+    :param case: output_format, rows, columns, delimiter, dtype_mix, parser_engine and the options of
+                 write_merge_report_as_parquet
+    :param work_dir: directory of the case
+    :return: result of the case
+    """
+    storage_root = os.path.join(work_dir, 'storage')
+    datastore_client = InMemoryDatastore()
+    parquet_write = fake_parquet_write(storage_root, datastore_client)
+    input_path = 'merged/report.csv'
+    input_file = parquet_write.storage_client.bucket(input_bucket).blob(input_path).path
+    os.makedirs(os.path.dirname(input_file), exist_ok=True)
+    column_names, dtypes = generate_report(input_file, case['rows'], case['columns'], case['delimiter'],
+                                           case['dtype_mix'])
+
+    merge_entry = datastore.Entity(key=datastore_client.key(merge_kind, 'benchmark'))
+    merge_entry.update({'status': 'success', 'report_type': 'benchmark', 'bucket': input_bucket,
+                        'path': input_path, 'row_count': case['rows'], 'job_id': 'benchmark'})
+    datastore_client.put(merge_entry)
+
+    extension = {'parquet': 'parquet', 'csv': 'csv', 'excel': 'xlsx'}[case['output_format']]
+    output_file_name = 'report.{}'.format(extension)
+    current_dir = os.getcwd()
+    # the local files of the conversion are written to the working directory
+    os.chdir(work_dir)
+    start = time.perf_counter()
+    try:
+        parquet_write.write_merge_report_as_parquet(
+            'benchmark', 'run', datetime.datetime(2020, 7, 27), output_file_name, output_bucket, 'converted',
+            case['output_format'], column_names, dtypes, 'benchmark', merge_kind, 'path',
+            {'report_type': 'benchmark'}, 'bucket', 'row_count', 'convert', case['delimiter'],
+            force=True, parser_engine=case.get('parser_engine', 'native'), **case.get('options', {}))
+    finally:
+        os.chdir(current_dir)
+    seconds = time.perf_counter() - start
+
+    output_blob = parquet_write.storage_client.bucket(output_bucket).get_blob('converted/' + output_file_name)
+    input_bytes = os.path.getsize(input_file)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return dict(case, seconds=seconds, input_bytes=input_bytes,
+                output_bytes=output_blob.size if output_blob is not None else None,
+                rows_per_sec=case['rows'] / seconds, input_bytes_per_sec=input_bytes / seconds,
+                peak_rss_bytes=peak_rss if sys.platform == 'darwin' else peak_rss * 1024,
+                stages=parquet_write.stage_metrics.to_dict())
+
+
+def run_case_in_tempdir(case:dict)->dict:
+    """
+    process pool entry point of run_benchmark
+    :param case: see run_case
+    :return: result of the case
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        return run_case(case, work_dir)
+
+
+def case_name(case:dict)->str:
+    """
+    this function returns the name identifying a case in results and baselines
+    :param case: see run_case
+    :return: name
+    """
+    return '{output_format}-{rows}x{columns}-{dtype_mix}-{delimiter!r}-{parser_engine}'.format(
+        **dict({'parser_engine': 'native'}, **case))
+
+
+def parser_speedups(results:dict)->dict:
+    """
+    this function compares the rows/sec of the native parser with the python engine of pd.read_csv for every case
+    run with both engines
+    :param results: output of run_benchmark
+    :return: speedup and delimiter type by the case name without the parser engine
+    """
+    speedups = {}
+    for name, result in sorted(results['cases'].items()):
+        if result.get('parser_engine') != 'python':
+            continue
+        native = results['cases'].get(case_name(dict(result, parser_engine='native')))
+        if native is None:
+            continue
+        delimiter_type = 'single byte' if len(result['delimiter'].encode('utf-8')) == 1 else 'multi byte'
+        speedups[name[:-len('-python')]] = {'delimiter_type': delimiter_type,
+                                            'speedup': native['rows_per_sec'] / result['rows_per_sec']}
+    return speedups
+
+
+def run_benchmark(cases:list)->dict:
+    """
+    this function runs every case in a new process, one at a time so the cases do not compete for the cpus
+    :param cases: list of case dicts, see run_case
+    :return: results with the environment and the result of every case by case name
+    """
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for case in cases:
+        with context.Pool(1) as pool:
+            result = pool.apply(run_case_in_tempdir, (case,))
+        logging.info("{}: {:.0f} rows/s, peak rss {} bytes, output {} bytes".format(
+            case_name(case), result['rows_per_sec'], result['peak_rss_bytes'], result['output_bytes']))
+        results[case_name(case)] = result
+    return {'created_at': datetime.datetime.utcnow().isoformat(),
+            'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                            'cpu_count': os.cpu_count()},
+            'cases': results}
+
+
+def compare_results(results:dict, baseline:dict, threshold:float=0.1, metrics:dict=None)->list:
+    """
+    this function compares results with a baseline, a metric regresses when it
+    is worse than the baseline by more than threshold (a fraction). Cases
+    missing from either side are skipped
+    :param results: output of run_benchmark
+    :param baseline: output of an earlier run_benchmark
+    :param threshold: allowed relative change
+    :param metrics: metrics to compare with the direction of a regression, defaults to compared_metrics
+    :return: list of regression messages, empty if nothing regressed
+    """
+    regressions = []
+    for name, result in sorted(results['cases'].items()):
+        base = baseline['cases'].get(name)
+        if base is None:
+            continue
+        for metric, worse in (metrics or compared_metrics).items():
+            current, previous = result.get(metric), base.get(metric)
+            if not current or not previous:
+                continue
+            change = (current - previous) / previous
+            if (worse == 'higher' and change > threshold) or (worse == 'lower' and -change > threshold):
+                regressions.append("{} {} changed by {:+.1%} ({} -> {})".format(name, metric, change, previous,
+                                                                               current))
+    return regressions
+
+
+def main(argv:list=None)->int:
+    """
+    command line entry point
+    :param argv: arguments, defaults to sys.argv
+    :return: exit code, 1 if a metric regressed against the baseline
+    """
+    parser = argparse.ArgumentParser(description="End to end benchmark of write_merge_report_as_parquet")
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000])
+    parser.add_argument('--columns', type=int, nargs='+', default=[20])
+    parser.add_argument('--delimiter', nargs='+', default=['|'])
+    parser.add_argument('--dtype-mix', nargs='+', default=['mixed'], choices=sorted(dtype_mixes))
+    parser.add_argument('--formats', nargs='+', default=['parquet', 'csv', 'excel'])
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--parallel-workers', type=int, default=None,
+                        help="convert every report with this many processes on record aligned byte ranges, "
+                             "parquet and csv only")
+    parser.add_argument('--parser-engines', nargs='+', default=['native'], choices=['native', 'python'])
+    parser.add_argument('--output', default='benchmark_results.json', help="results file")
+    parser.add_argument('--baseline', default=None, help="results file to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1, help="allowed relative regression")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    options = {'batch_size': args.batch_size} if args.batch_size else {}
+    if args.parallel_workers:
+        options['parallel_workers'] = args.parallel_workers
+    cases = [{'output_format': output_format, 'rows': rows, 'columns': columns, 'delimiter': delimiter,
+              'dtype_mix': dtype_mix, 'parser_engine': parser_engine, 'options': options}
+             for output_format in args.formats for rows in args.rows for columns in args.columns
+             for delimiter in args.delimiter for dtype_mix in args.dtype_mix for parser_engine in args.parser_engines]
+    results = run_benchmark(cases)
+    results['parser_speedups'] = parser_speedups(results)
+    for name, speedup in results['parser_speedups'].items():
+        logging.info("{} ({} delimiter): native parser {:.1f}x the python engine".format(
+            name, speedup['delimiter_type'], speedup['speedup']))
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, indent=2, default=str)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare_results(results, json.load(fp), args.threshold)
+        for regression in regressions:
+            logging.error("Regression: {}".format(regression))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
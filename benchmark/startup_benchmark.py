@@ -0,0 +1,128 @@
+"""
+this file contain the cold start benchmark of a parquet write task. Every
+sample is a fresh interpreter which imports ParquetWrite, constructs it and
+converts a one row report on the local storage backend, so the numbers are
+what a short lived airflow task process pays before its first output byte. ex -
+
+python -m benchmark.startup_benchmark --samples 10 --output startup.json --baseline startup_baseline.json
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark.run_benchmark import compare_results
+
+# modules which should not be imported by importing and constructing ParquetWrite
+heavy_modules = ('numpy', 'pandas', 'pyarrow', 'openpyxl', 'google.cloud.storage', 'google.cloud.datastore',
+                 'requests')
+startup_metrics = {'import_seconds': 'higher', 'construct_seconds': 'higher', 'first_byte_seconds': 'higher',
+                   'process_seconds': 'higher'}
+
+
+def child(work_dir:str)->dict:
+    """
+    this function is run in the fresh interpreter of a sample and measures it
+    :param work_dir: directory of the sample
+    :return: timings of the sample, first_byte_seconds counts from the start of the import and process_seconds
+             from the start of the interpreter
+    """
+    # wall clock time just before the parent started the interpreter
+    process_start = float(os.environ['STARTUP_T0'])
+    start = time.perf_counter()
+    from parquet_write_automation.parquet_write.scripts.main.ParquetWrite import ParquetWrite
+    imported = time.perf_counter()
+    loaded_after_import = [name for name in heavy_modules if name in sys.modules]
+    parquet_write = ParquetWrite('local')
+    constructed = time.perf_counter()
+    loaded_after_construct = [name for name in heavy_modules if name in sys.modules]
+
+    from benchmark.fakes import InMemoryDatastore
+    from benchmark.run_benchmark import generate_report
+    from parquet_write_automation.cloud.scripts.main.local_storage import LocalStorage
+    parquet_write.gcs = LocalStorage(os.path.join(work_dir, 'storage'))
+    parquet_write.datastore_client = InMemoryDatastore()
+    input_file = parquet_write.storage_client.bucket('input').blob('report.csv').path
+    os.makedirs(os.path.dirname(input_file), exist_ok=True)
+    column_names, dtypes = generate_report(input_file, 1, 3, '|', 'numeric')
+    output_file = os.path.join(work_dir, 'report.parquet')
+    parquet_write.put_parquet_file_to_gcs(input_file, column_names, dtypes, 'parquet', output_file,
+                                          'converted/report.parquet', 'output', '|')
+    first_byte = time.perf_counter()
+    return {'import_seconds': imported - start, 'construct_seconds': constructed - imported,
+            'first_byte_seconds': first_byte - start, 'process_seconds': time.time() - process_start,
+            'loaded_after_import': loaded_after_import, 'loaded_after_construct': loaded_after_construct}
+
+
+def run_sample()->dict:
+    """
+    this function runs one sample in a new interpreter
+    :return: timings of the sample
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = dict(os.environ, STARTUP_T0=repr(time.time()))
+        output = subprocess.run([sys.executable, '-m', 'benchmark.startup_benchmark', '--child', work_dir],
+                                check=True, stdout=subprocess.PIPE, env=env).stdout
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def run_startup_benchmark(samples:int)->dict:
+    """
+    this function runs samples fresh interpreters and keeps the median of every timing
+    :param samples: number of interpreters
+    :return: results in the format of run_benchmark.run_benchmark with the single case startup
+    """
+    runs = [run_sample() for _ in range(samples)]
+    result = {metric: statistics.median(run[metric] for run in runs) for metric in startup_metrics}
+    result['samples'] = samples
+    result['loaded_after_import'] = runs[-1]['loaded_after_import']
+    result['loaded_after_construct'] = runs[-1]['loaded_after_construct']
+    return {'created_at': datetime.datetime.utcnow().isoformat(), 'cases': {'startup': result}}
+
+
+def main(argv:list=None)->int:
+    """
+    command line entry point
+    :param argv: arguments, defaults to sys.argv
+    :return: exit code, 1 if a timing regressed against the baseline or a heavy module is imported eagerly
+    """
+    parser = argparse.ArgumentParser(description="Cold start benchmark of a parquet write task")
+    parser.add_argument('--samples', type=int, default=5)
+    parser.add_argument('--output', default='startup_results.json', help="results file")
+    parser.add_argument('--baseline', default=None, help="results file to compare with")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(child(args.child)))
+        return 0
+    logging.basicConfig(level=logging.INFO)
+    results = run_startup_benchmark(args.samples)
+    startup = results['cases']['startup']
+    logging.info("import {import_seconds:.3f}s, construct {construct_seconds:.3f}s, first byte "
+                 "{first_byte_seconds:.3f}s, process {process_seconds:.3f}s".format(**startup))
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, indent=2)
+
+    failed = False
+    if startup['loaded_after_construct']:
+        logging.error("Imported eagerly: {}".format(startup['loaded_after_construct']))
+        failed = True
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare_results(results, json.load(fp), args.threshold, startup_metrics)
+        for regression in regressions:
+            logging.error("Regression: {}".format(regression))
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,422 @@
+"""
+Test file to test ParquetWrite.py
+"""
+import datetime
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from google.cloud import datastore
+
+from benchmark.fakes import InMemoryDatastore, fake_parquet_write
+from parquet_write_automation.datastore.scripts.main.db import Db
+from parquet_write_automation.exception.scripts.main.exceptions import DataCountMismatch, ReportInvalidSchema
+from parquet_write_automation.parquet_write.scripts.main.ParquetWrite import ParquetWrite
+from parquet_write_automation.parquet_write.scripts.main.report_schema import ReportSchema
+
+merge_kind = 'MergeReportTask'
+input_bucket = 'input'
+output_bucket = 'output'
+columns = ['store', 'item', 'sales']
+dtypes = {'store': 'int64', 'item': 'str', 'sales': 'float64'}
+
+
+def put_report(parquet_write, name:str, rows:int, row_count:int=None)->str:
+    """
+    this function writes a merged report into the input bucket and its merge entry
+    :return: input path of the report
+    """
+    input_path = 'merged/{}.csv'.format(name)
+    report = parquet_write.storage_client.bucket(input_bucket).blob(input_path).path
+    os.makedirs(os.path.dirname(report), exist_ok=True)
+    with open(report, 'w') as fp:
+        for row in range(rows):
+            fp.write('{}|item {}|{}.5\n'.format(row % 7, row, row))
+    merge_entry = datastore.Entity(key=parquet_write.datastore_client.key(merge_kind, name))
+    merge_entry.update({'status': 'success', 'report_type': name, 'bucket': input_bucket, 'path': input_path,
+                        'row_count': rows if row_count is None else row_count, 'job_id': name})
+    parquet_write.datastore_client.put(merge_entry)
+    return input_path
+
+
+def job(name:str, **options)->dict:
+    """
+    this function returns the keyword arguments of write_merge_report_as_parquet for the report name
+    """
+    return dict({'dag_id': 'dag', 'run_id': 'run', 'report_date': datetime.datetime(2020, 7, 27),
+                 'output_file_name': '{}.parquet'.format(name), 'output_bucket': output_bucket,
+                 'output_path': 'converted', 'output_format': 'parquet', 'column_name_for_report': columns,
+                 'column_data_type_for_report': dtypes, 'report_type': name, 'kind': merge_kind,
+                 'input_path_field_name': 'path', 'filter_map': {'report_type': name},
+                 'input_bucket_field_name': 'bucket', 'row_count_field_name': 'row_count',
+                 'airflow_task_id': 'convert_{}'.format(name), 'delimiter': '|'}, **options)
+
+
+def task_entry(parquet_write, job_args:dict):
+    """
+    this function reads the ParquetWriteTask entity of a job
+    """
+    return Db().get_parquet_write_task_entry(parquet_write.datastore_client, job_args['dag_id'], job_args['run_id'],
+                                             job_args['airflow_task_id'])
+
+
+def batch_parquet_write(tmp_path, monkeypatch):
+    """
+    this function returns a ParquetWrite on local storage whose process pool workers use the same storage
+    """
+    storage_root = str(tmp_path / 'storage')
+    # the conversion processes create their own LocalStorage from the environment
+    monkeypatch.setenv('LOCAL_STORAGE_ROOT', storage_root)
+    monkeypatch.chdir(tmp_path)
+    return fake_parquet_write(storage_root, InMemoryDatastore())
+
+
+def test_write_merge_reports_as_parquet(tmp_path, monkeypatch):
+    """
+    this function will test that the batch path records the fingerprint, generations and stage metrics of every
+    task, fails a job whose row count does not match and reuses the outputs on the next run
+    :return: None
+    """
+    parquet_write = batch_parquet_write(tmp_path, monkeypatch)
+    put_report(parquet_write, 'sales', 120)
+    put_report(parquet_write, 'returns', 30, row_count=31)
+    jobs = [job('sales'), job('returns')]
+
+    results = parquet_write.write_merge_reports_as_parquet(jobs, max_workers=2)
+    assert [result['status'] for result in results] == ['success', 'failure']
+    assert results[0]['total_row'] == 120
+    assert type(results[1]['exception']).__name__ == 'DataCountMismatch'
+    assert task_entry(parquet_write, jobs[1]) is None
+
+    entry = task_entry(parquet_write, jobs[0])
+    output = parquet_write.storage_client.bucket(output_bucket).get_blob('converted/sales.parquet')
+    assert pq.read_table(output.path).num_rows == 120
+    assert entry['conversion_fingerprint']
+    assert entry['input_generation'] is not None
+    assert entry['output_generation'] == output.generation
+    assert entry['stage_metrics']['parse']['rows'] == 120
+    assert entry['reused_output'] is False
+
+    results = parquet_write.write_merge_reports_as_parquet(jobs, max_workers=2)
+    assert [result['status'] for result in results] == ['success', 'failure']
+    entry = task_entry(parquet_write, jobs[0])
+    assert entry['reused_output'] is True
+    assert entry['total_row_in_merged_report'] == 120
+    assert parquet_write.storage_client.bucket(output_bucket).get_blob(
+        'converted/sales.parquet').generation == output.generation
+
+
+def convert(parquet_write, job_args:dict, **options):
+    """
+    this function runs write_merge_report_as_parquet for a job and returns its ParquetWriteTask entity
+    """
+    parquet_write.write_merge_report_as_parquet(**dict(job_args, **options))
+    return task_entry(parquet_write, job_args)
+
+
+def test_reuse_conversion(tmp_path, monkeypatch):
+    """
+    this function will test that an unchanged input is not converted again, unless force is set, and that a
+    rewritten input is converted again
+    :return: None
+    """
+    monkeypatch.chdir(tmp_path)
+    parquet_write = fake_parquet_write(str(tmp_path / 'storage'), InMemoryDatastore())
+    input_path = put_report(parquet_write, 'sales', 40)
+    sales = job('sales')
+    output = parquet_write.storage_client.bucket(output_bucket).blob('converted/sales.parquet')
+
+    first = dict(convert(parquet_write, sales))
+    assert first['reused_output'] is False
+    output_generation = output.generation
+
+    reused = convert(parquet_write, sales)
+    assert reused['reused_output'] is True
+    assert reused['output_generation'] == output_generation
+    assert output.generation == output_generation
+
+    forced = convert(parquet_write, sales, force=True)
+    assert forced['reused_output'] is False
+    assert forced['conversion_fingerprint'] == first['conversion_fingerprint']
+
+    # rewriting the input changes its generation
+    put_report(parquet_write, 'sales', 40)
+    changed = convert(parquet_write, sales)
+    assert changed['reused_output'] is False
+    assert changed['input_generation'] == parquet_write.storage_client.bucket(input_bucket).get_blob(
+        input_path).generation
+    assert changed['input_generation'] != first['input_generation']
+
+
+def test_download_pinned_generation(tmp_path):
+    """
+    this function will test that the merged report is not downloaded once it changed from the planned generation
+    :return: None
+    """
+    parquet_write = fake_parquet_write(str(tmp_path / 'storage'), InMemoryDatastore())
+    input_path = put_report(parquet_write, 'sales', 5)
+    blob = parquet_write.storage_client.bucket(input_bucket).get_blob(input_path)
+    parquet_write.get_blob_for_merged_report(input_bucket, input_path, str(tmp_path / 'a.csv'), blob.generation)
+    generation = blob.generation
+    put_report(parquet_write, 'sales', 6)
+    with pytest.raises(ValueError):
+        parquet_write.get_blob_for_merged_report(input_bucket, input_path, str(tmp_path / 'b.csv'), generation)
+
+
+def test_partitioned_dataset_manifest(tmp_path):
+    """
+    this function will test that the manifest of a partitioned dataset lists every uploaded file with its rows
+    :return: None
+    """
+    parquet_write = fake_parquet_write(str(tmp_path / 'storage'), InMemoryDatastore())
+    report = tmp_path / 'report.csv'
+    report.write_text(''.join('{}|item {}|{}.5\n'.format(row % 3, row, row) for row in range(20)))
+
+    total_row = parquet_write.put_partitioned_dataset_to_gcs(str(report), columns, dtypes, 'converted/sales',
+                                                             output_bucket, '|', ['store'], max_rows_per_file=4,
+                                                             work_dir=str(tmp_path))
+    bucket = parquet_write.storage_client.bucket(output_bucket)
+    with open(bucket.get_blob('converted/sales/_SUCCESS').path) as fp:
+        manifest = json.load(fp)
+    assert total_row == manifest['total_rows'] == 20
+    assert manifest['partition_by'] == ['store']
+    assert [entry['path'] for entry in manifest['files']] == [
+        'store=0/part-00000.parquet', 'store=0/part-00001.parquet', 'store=1/part-00000.parquet',
+        'store=1/part-00001.parquet', 'store=2/part-00000.parquet', 'store=2/part-00001.parquet']
+    for entry in manifest['files']:
+        assert pq.read_table(bucket.get_blob('converted/sales/' + entry['path']).path).num_rows == entry['rows']
+
+
+@pytest.mark.parametrize('parser_engine', ['native', 'python'])
+def test_put_report_in_parallel(tmp_path, monkeypatch, parser_engine):
+    """
+    this function will test that a report converted on byte ranges gives the output of a serial conversion,
+    also with newlines inside quoted values
+    :return: None
+    """
+    parquet_write = batch_parquet_write(tmp_path, monkeypatch)
+    parquet_write.parser_engine = parser_engine
+    parquet_write.parallel_min_split_bytes = 256
+    report = tmp_path / 'merged.csv'
+    report.write_text(''.join('{}|"item\n{}"|{}.5\n'.format(row % 7, row, row) if row % 5 == 0 else
+                              '{}|item {}|{}.5\n'.format(row % 7, row, row) for row in range(300)))
+    bucket = parquet_write.storage_client.bucket(output_bucket)
+
+    for output_format in ('parquet', 'csv'):
+        output_file_name = 'report.{}'.format(output_format)
+        parquet_write.put_parquet_file_to_gcs(str(report), columns, dtypes, output_format, output_file_name,
+                                              'serial/' + output_file_name, output_bucket, '|')
+        total_row = parquet_write.put_report_in_parallel(str(report), columns, dtypes, output_format,
+                                                         output_file_name, 'parallel/' + output_file_name,
+                                                         output_bucket, '|', workers=3, work_dir=str(tmp_path))
+        assert total_row == 300
+        serial = bucket.get_blob('serial/' + output_file_name).path
+        parallel = bucket.get_blob('parallel/' + output_file_name).path
+        if output_format == 'parquet':
+            assert pq.ParquetFile(parallel).metadata.num_row_groups > 1
+            assert pq.read_table(parallel).equals(pq.read_table(serial))
+        else:
+            with open(serial, 'rb') as serial_fp, open(parallel, 'rb') as parallel_fp:
+                assert parallel_fp.read() == serial_fp.read()
+    assert pq.read_table(parallel.replace('.csv', '.parquet')).column('item').to_pylist()[5] == 'item\n5'
+
+
+@pytest.mark.parametrize('newline', [b'\n', b'\r\n'])
+@pytest.mark.parametrize('preflight_chunk_size', [1, 3, 1024])
+def test_validate_merged_report(tmp_path, newline, preflight_chunk_size):
+    """
+    this function will test that the pre-flight check counts the rows of LF and CRLF reports without their blank
+    lines, also across chunk boundaries, and fails a report with the wrong row count or number of columns
+    :return: None
+    """
+    parquet_write = fake_parquet_write(str(tmp_path / 'storage'), InMemoryDatastore())
+    parquet_write.preflight_chunk_size = preflight_chunk_size
+    report = tmp_path / 'report.csv'
+    lines = [b'', b'1|item 1|1.5', b'', b'', b'2|item 2|2.5', b'3|item 3|3.5', b'']
+    report.write_bytes(newline.join(lines) + newline)
+
+    assert parquet_write.validate_merged_report(str(report), columns, '|', 3) == 3
+    with pytest.raises(DataCountMismatch):
+        parquet_write.validate_merged_report(str(report), columns, '|', 4)
+
+    report.write_bytes(newline.join([b'1|item 1|1.5', b'2|item 2']) + newline)
+    with pytest.raises(ReportInvalidSchema):
+        parquet_write.validate_merged_report(str(report), columns, '|', 2)
+
+    # quoted fields may hide newlines, only the first line is checked
+    report.write_bytes(newline.join([b'1|"item' + newline + b'1"|1.5', b'2|item 2|2.5']) + newline)
+    assert parquet_write.validate_merged_report(str(report), columns, '|', 5) is None
+
+
+def fan_out_targets(parquet_write):
+    """
+    this function returns a parquet, a csv and an excel output target of the sales report
+    """
+    return parquet_write.get_output_targets([{'output_format': 'parquet', 'output_file_name': 'sales.parquet'},
+                                             {'output_format': 'csv', 'output_file_name': 'sales.csv'},
+                                             {'output_format': 'excel', 'output_file_name': 'sales.xlsx'}],
+                                            'parquet', 'sales.parquet', 'converted', output_bucket)
+
+
+def test_fan_out_report(tmp_path, monkeypatch):
+    """
+    this function will test that one parse of the report is written into parquet, csv and excel with the same rows
+    :return: None
+    """
+    parquet_write = fake_parquet_write(str(tmp_path / 'storage'), InMemoryDatastore())
+    report = tmp_path / 'merged.csv'
+    report.write_text(''.join('{}|item {}|{}.5\n'.format(row % 7, row, row) for row in range(250)))
+    parses = []
+    read_report_batches = parquet_write.read_report_batches
+    monkeypatch.setattr(parquet_write, 'read_report_batches',
+                        lambda *args: parses.append(args) or read_report_batches(*args))
+
+    outputs = parquet_write.fan_out_report(str(report), columns, dtypes, fan_out_targets(parquet_write), '|',
+                                           batch_size=30, work_dir=str(tmp_path))
+    assert len(parses) == 1
+    assert [output['total_row'] for output in outputs] == [250, 250, 250]
+    bucket = parquet_write.storage_client.bucket(output_bucket)
+    assert pq.read_table(bucket.get_blob('converted/sales.parquet').path).num_rows == 250
+    assert len(pd.read_csv(bucket.get_blob('converted/sales.csv').path)) == 250
+    assert len(pd.read_excel(bucket.get_blob('converted/sales.xlsx').path)) == 250
+
+
+def test_fan_out_report_failed_target(tmp_path):
+    """
+    this function will test that a failing writer fails the conversion without blocking the reading or the
+    queues of the other writers
+    :return: None
+    """
+    parquet_write = fake_parquet_write(str(tmp_path / 'storage'), InMemoryDatastore())
+    report = tmp_path / 'merged.csv'
+    report.write_text(''.join('{}|item {}|{}.5\n'.format(row % 7, row, row) for row in range(500)))
+    write_batches = parquet_write.write_batches
+    written = {}
+
+    def failing_csv_writer(batches, *args):
+        if args[2] == 'csv':
+            next(batches)
+            raise IOError("disk full")
+        written[args[2]] = write_batches(batches, *args)
+        return written[args[2]]
+
+    parquet_write.write_batches = failing_csv_writer
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        conversion = executor.submit(parquet_write.fan_out_report, str(report), columns, dtypes,
+                                     fan_out_targets(parquet_write), '|', batch_size=10, work_dir=str(tmp_path))
+        with pytest.raises(IOError, match='disk full'):
+            conversion.result(timeout=60)
+    # the other writers got the end of the batches and finished their files
+    assert set(written) == {'parquet', 'excel'}
+
+
+class RecordingHook:
+    """
+    metrics hook recording the stages it is notified of
+    """
+
+    def __init__(self):
+        self.finished = []
+
+    def stage_finished(self, stage, record):
+        self.finished.append(stage)
+
+
+def test_metrics_hooks_per_instance(tmp_path, monkeypatch):
+    """
+    this function will test that a metrics hook is notified of the runs of its instance only
+    :return: None
+    """
+    monkeypatch.chdir(tmp_path)
+    parquet_write = fake_parquet_write(str(tmp_path / 'storage'), InMemoryDatastore())
+    other = fake_parquet_write(str(tmp_path / 'storage'), parquet_write.datastore_client)
+    hook = RecordingHook()
+    parquet_write.add_metrics_hook(hook)
+    put_report(parquet_write, 'sales', 10)
+
+    other.write_merge_report_as_parquet(**job('sales'))
+    assert hook.finished == []
+    assert other.metrics_hooks == []
+    parquet_write.write_merge_report_as_parquet(**job('sales', force=True))
+    assert {'parse', 'encode', 'upload'} <= set(hook.finished)
+
+
+def test_failed_rerun_keeps_uploaded_output(tmp_path, monkeypatch):
+    """
+    this function will test that a re-run rewriting the local output of a conversion in place and then failing
+    keeps the output uploaded by the previous run
+    :return: None
+    """
+    monkeypatch.chdir(tmp_path)
+    parquet_write = fake_parquet_write(str(tmp_path / 'storage'), InMemoryDatastore())
+    put_report(parquet_write, 'sales', 30)
+    convert(parquet_write, job('sales'))
+    output = parquet_write.storage_client.bucket(output_bucket).get_blob('converted/sales.parquet')
+    with open(output.path, 'rb') as fp:
+        uploaded = fp.read()
+
+    def failing_to_table(self, df):
+        raise IOError("disk full")
+
+    monkeypatch.setattr(ReportSchema, 'to_table', failing_to_table)
+    # the batched writer opens the local output before converting the first batch
+    with pytest.raises(IOError, match='disk full'):
+        parquet_write.write_merge_report_as_parquet(**job('sales', force=True, batch_size=10))
+    assert os.path.getsize('sales.parquet') == 0
+    with open(output.path, 'rb') as fp:
+        assert fp.read() == uploaded
+    assert pq.read_table(output.path).num_rows == 30
+
+
+def test_worker_settings(tmp_path, monkeypatch):
+    """
+    this function will test that the conversion processes get the storage root and the caches of the instance, and
+    that the conversions of an instance with metrics hooks run in its process and notify its hooks
+    :return: None
+    """
+    parquet_write = batch_parquet_write(tmp_path, monkeypatch)
+    monkeypatch.setattr(Db, 'config_cache', None)
+    Db.enable_config_cache(ttl=60, max_entries=8)
+    settings = parquet_write.worker_settings()
+    assert settings['storage_root'] == str(tmp_path / 'storage')
+    assert settings['config_cache'] == (60, 8, None)
+    monkeypatch.setattr(Db, 'config_cache', None)
+    worker = ParquetWrite.from_worker_settings(settings)
+    assert worker.gcs.client.root == str(tmp_path / 'storage')
+    assert Db.config_cache.ttl == 60
+
+    hook = RecordingHook()
+    parquet_write.add_metrics_hook(hook)
+    assert parquet_write.worker_settings() is None
+    put_report(parquet_write, 'sales', 40)
+    results = parquet_write.write_merge_reports_as_parquet([job('sales')], max_workers=2)
+    assert results[0]['status'] == 'success'
+    assert {'parse', 'encode', 'upload'} <= set(hook.finished)
+    assert task_entry(parquet_write, job('sales'))['stage_metrics']['parse']['rows'] == 40
+    # the conversion had stage metrics of its own
+    assert 'parse' not in parquet_write.stage_metrics.stages
+
+
+@pytest.mark.parametrize('parser_engine', ['native', 'python'])
+def test_missing_integers(tmp_path, parser_engine):
+    """
+    this function will test that a missing value fails the read of an int64 column and is read as null in an Int64
+    column, with both parsers
+    :return: None
+    """
+    parquet_write = fake_parquet_write(str(tmp_path / 'storage'), InMemoryDatastore())
+    parquet_write.parser_engine = parser_engine
+    report = tmp_path / 'report.csv'
+    report.write_text('1|1\n|2\n')
+
+    with pytest.raises(ValueError, match='Unable to convert column qty'):
+        parquet_write.read_report(str(report), ['qty', 'store'], ReportSchema(['qty', 'store'], {'qty': 'int64'}),
+                                  '|')
+    report_schema = ReportSchema(['qty', 'store'], {'qty': 'Int64', 'store': 'int64'})
+    table = report_schema.to_table(parquet_write.read_report(str(report), ['qty', 'store'], report_schema, '|'))
+    assert table.column('qty').to_pylist() == [1, None]
+    assert table.schema.field('qty').type == pa.int64()
@@ -0,0 +1,113 @@
+"""
+Test file to test blob_cache.py
+"""
+import os
+import threading
+from types import SimpleNamespace
+
+from parquet_write_automation.cloud.scripts.main import blob_cache
+from parquet_write_automation.cloud.scripts.main.blob_cache import BlobCache
+from parquet_write_automation.cloud.scripts.main.local_storage import copy_file
+
+
+class FakeBlob:
+    """
+    in memory stand-in for google.cloud.storage.blob.Blob
+    """
+
+    def __init__(self, name, data, generation=1):
+        self.name = name
+        self.bucket = SimpleNamespace(name='bucket')
+        self.data = data
+        self.generation = generation
+        self.downloads = 0
+
+    def reload(self):
+        pass
+
+    def download_to_filename(self, file_name, if_generation_match=None):
+        assert if_generation_match == self.generation
+        self.downloads += 1
+        with open(file_name, 'wb') as fp:
+            fp.write(self.data)
+
+
+def test_fetch_hit_miss_and_generation(tmp_path):
+    """
+    this function will test that a blob is downloaded once per generation
+    and served from the cache afterwards
+    :return: None
+    """
+    cache = BlobCache(str(tmp_path / 'cache'), max_bytes=1024)
+    blob = FakeBlob('A/report.csv', b'a,b\n1,2\n')
+
+    cache.fetch(blob, str(tmp_path / 'first.csv'))
+    cache.fetch(blob, str(tmp_path / 'second.csv'))
+    assert blob.downloads == 1
+    assert (tmp_path / 'second.csv').read_bytes() == b'a,b\n1,2\n'
+
+    blob.generation, blob.data = 2, b'a,b\n3,4\n'
+    cache.fetch(blob, str(tmp_path / 'third.csv'))
+    assert blob.downloads == 2
+    assert (tmp_path / 'third.csv').read_bytes() == b'a,b\n3,4\n'
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'evictions': 0}
+
+
+def test_lru_eviction(tmp_path):
+    """
+    this function will test that the least recently used blob is evicted
+    once the cache is over its size budget
+    :return: None
+    """
+    cache = BlobCache(str(tmp_path / 'cache'), max_bytes=20)
+    first, second, third = FakeBlob('1', b'x' * 10), FakeBlob('2', b'y' * 10), FakeBlob('3', b'z' * 10)
+
+    cache.fetch(first, str(tmp_path / 'out'))
+    cache.fetch(second, str(tmp_path / 'out'))
+    os.utime(cache.cache_file(cache.make_key('bucket', '2', 1)), (1, 1))
+    cache.fetch(third, str(tmp_path / 'out'))
+
+    assert cache.stats()['evictions'] == 1
+    assert not os.path.exists(cache.cache_file(cache.make_key('bucket', '2', 1)))
+    assert os.path.exists(cache.cache_file(cache.make_key('bucket', '1', 1)))
+
+
+def test_fetched_files_are_copies(tmp_path):
+    """
+    this function will test that writing a fetched file in place does not change the cached blob
+    :return: None
+    """
+    cache = BlobCache(str(tmp_path / 'cache'), max_bytes=1024)
+    blob = FakeBlob('A/report.csv', b'a,b\n1,2\n')
+
+    cache.fetch(blob, str(tmp_path / 'first.csv'))
+    with open(str(tmp_path / 'first.csv'), 'wb') as fp:
+        fp.write(b'rewritten')
+    cache.fetch(blob, str(tmp_path / 'second.csv'))
+    assert blob.downloads == 1
+    assert (tmp_path / 'second.csv').read_bytes() == b'a,b\n1,2\n'
+
+
+def test_eviction_waits_for_placement(tmp_path, monkeypatch):
+    """
+    this function will test that an entry can not be evicted while it is stored and copied to its destination
+    :return: None
+    """
+    cache = BlobCache(str(tmp_path / 'cache'), max_bytes=0)
+    blob = FakeBlob('A/report.csv', b'a,b\n1,2\n')
+    evictions = []
+
+    def copy_during_eviction(source, destination):
+        eviction = threading.Thread(target=cache.evict)
+        eviction.start()
+        eviction.join(timeout=0.2)
+        evictions.append((eviction, eviction.is_alive()))
+        copy_file(source, destination)
+
+    monkeypatch.setattr(blob_cache, 'copy_file', copy_during_eviction)
+    cache.fetch(blob, str(tmp_path / 'report.csv'))
+    eviction, blocked = evictions[0]
+    eviction.join()
+    assert blocked
+    assert (tmp_path / 'report.csv').read_bytes() == b'a,b\n1,2\n'
+    assert cache.stats()['evictions'] == 1
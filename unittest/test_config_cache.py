@@ -0,0 +1,49 @@
+"""
+Test file to test config_cache.py
+"""
+from parquet_write_automation.datastore.scripts.main.config_cache import ConfigCache
+
+
+def test_read_through_and_invalidate(tmp_path):
+    """
+    this function will test that a cached result is served without calling
+    the loader again and that invalidation forces a reload
+    :return: None
+    """
+    cache = ConfigCache(ttl=60, disk_path=str(tmp_path))
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return [{'status': 'success'}]
+
+    key = ConfigCache.make_key('ParquetWriteConfig', {'report_type': 'POS'})
+    assert cache.get_or_load(key, loader) == [{'status': 'success'}]
+    assert cache.get_or_load(key, loader) == [{'status': 'success'}]
+    assert len(calls) == 1
+
+    # a second cache on the same directory shares the disk layer
+    assert ConfigCache(ttl=60, disk_path=str(tmp_path)).get(key) == (True, [{'status': 'success'}])
+
+    cache.invalidate('ParquetWriteConfig', {'report_type': 'POS'})
+    cache.get_or_load(key, loader)
+    assert len(calls) == 2
+
+
+def test_expiry_and_lru_eviction():
+    """
+    this function will test that expired entries are not served and that the
+    least recently used entry is evicted first
+    :return: None
+    """
+    cache = ConfigCache(ttl=0)
+    cache.put('a', 1)
+    assert cache.get('a') == (False, None)
+
+    cache = ConfigCache(ttl=60, max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 1)
@@ -0,0 +1,57 @@
+"""
+Test file to test csv_reader.py
+"""
+import io
+
+import pytest
+
+from parquet_write_automation.parquet_write.scripts.main.csv_reader import DelimiterConflict, \
+    DelimiterTranslator, is_single_byte
+
+
+def translate(data, delimiter=b'~~', chunk_size=8 * 1024 * 1024):
+    return DelimiterTranslator(io.BytesIO(data), delimiter, b'\x1f', chunk_size).read()
+
+
+def test_translate_delimiter_outside_quotes():
+    """
+    this function will test that the delimiter is translated except inside
+    quoted fields, which may also hold escaped quotes and newlines
+    :return: None
+    """
+    data = b'a~~"b~~c"~~"say ""hi""~~\nnow"\n5" tv~~"x"\n'
+    expected = b'a\x1f"b~~c"\x1f"say ""hi""~~\nnow"\n5" tv\x1f"x"\n'
+    assert translate(data) == expected
+    # every chunk size splits delimiters and escaped quotes somewhere else
+    for chunk_size in range(1, 8):
+        assert translate(data, chunk_size=chunk_size) == expected
+
+
+def test_translate_overlapping_delimiter():
+    """
+    this function will test that a run of delimiter bytes is split from the
+    left, whatever the chunk boundaries are
+    :return: None
+    """
+    for chunk_size in range(1, 6):
+        assert translate(b'a~~~~~b\n', chunk_size=chunk_size) == b'a\x1f\x1f~b\n'
+
+
+def test_translate_conflict():
+    """
+    this function will test that a report holding the substitute byte is refused
+    :return: None
+    """
+    with pytest.raises(DelimiterConflict):
+        translate(b'a~~b\x1fc\n')
+
+
+def test_is_single_byte():
+    """
+    this function will test which delimiters are handed to the parser directly
+    :return: None
+    """
+    assert is_single_byte('|')
+    assert is_single_byte('\t')
+    assert not is_single_byte('~~')
+    assert not is_single_byte('§')
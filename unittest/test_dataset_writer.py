@@ -0,0 +1,44 @@
+"""
+Test file to test dataset_writer.py
+"""
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from parquet_write_automation.parquet_write.scripts.main.dataset_writer import PartitionedDatasetWriter
+
+
+def test_partition_directories(tmp_path):
+    """
+    this function will test that every partition is written to its hive directory without the partition columns,
+    with null values in the default partition and special characters quoted
+    :return: None
+    """
+    writer = PartitionedDatasetWriter(str(tmp_path), ['day', 'store'])
+    writer.write_batch(pa.table({'day': ['2020-07-27', '2020-07-27', '2020-07-28'], 'store': ['a/b', None, 'c'],
+                                 'sales': [1, 2, 3]}))
+    writer.write_batch(pa.table({'day': ['2020-07-28'], 'store': ['c'], 'sales': [4]}))
+    files = writer.close()
+
+    assert files == [('day=2020-07-27/store=__HIVE_DEFAULT_PARTITION__/part-00000.parquet', 1),
+                     ('day=2020-07-27/store=a%2Fb/part-00000.parquet', 1),
+                     ('day=2020-07-28/store=c/part-00000.parquet', 2)]
+    table = pq.read_table(str(tmp_path / 'day=2020-07-28' / 'store=c' / 'part-00000.parquet'))
+    assert table.column_names == ['sales']
+    assert table.column('sales').to_pylist() == [3, 4]
+
+
+def test_max_rows_per_file(tmp_path):
+    """
+    this function will test that a partition rolls over to a new file after max_rows_per_file rows, also across
+    batches
+    :return: None
+    """
+    writer = PartitionedDatasetWriter(str(tmp_path), ['store'], max_rows_per_file=4)
+    writer.write_batch(pa.table({'store': [1] * 6 + [2], 'sales': list(range(7))}))
+    writer.write_batch(pa.table({'store': [1] * 3, 'sales': list(range(7, 10))}))
+    files = writer.close()
+
+    assert files == [('store=1/part-00000.parquet', 4), ('store=1/part-00001.parquet', 4),
+                     ('store=1/part-00002.parquet', 1), ('store=2/part-00000.parquet', 1)]
+    sales = [pq.read_table(str(tmp_path / path)).column('sales').to_pylist() for path, _ in files[:3]]
+    assert sales == [[0, 1, 2, 3], [4, 5, 7, 8], [9]]
@@ -0,0 +1,151 @@
+"""
+Test file to test db.py
+"""
+import datetime
+
+from google.cloud import datastore
+
+from benchmark.fakes import InMemoryDatastore
+from parquet_write_automation.datastore.scripts.main.db import Db
+
+
+class ShortPageIterator:
+    """
+    query iterator returning at most page_size entries per page, like datastore does when a page is cut short
+    """
+
+    def __init__(self, entries:list, start:int, limit:int, page_size:int):
+        end = min(start + min(limit, page_size), len(entries))
+        self.pages = iter([entries[start:end]])
+        self.next_page_token = end if end < len(entries) else None
+
+
+class ShortPageQuery:
+
+    def __init__(self, entries:list, page_size:int):
+        self.entries = entries
+        self.page_size = page_size
+        self.fetches = 0
+
+    def add_filter(self, *args, **kwargs):
+        return self
+
+    def fetch(self, start_cursor=None, limit=None):
+        self.fetches += 1
+        return ShortPageIterator(self.entries, start_cursor or 0, limit, self.page_size)
+
+
+class ShortPageClient:
+
+    def __init__(self, query:ShortPageQuery):
+        self._query = query
+
+    def query(self, kind:str, order:tuple=(), projection:tuple=()):
+        return self._query
+
+
+def test_iter_datastore_entries_short_pages():
+    """
+    this function will test that iter_datastore_entries reads on while datastore returns a cursor, even after a
+    page shorter than the requested size
+    :return: None
+    """
+    entries = [{'id': index} for index in range(25)]
+    query = ShortPageQuery(entries, page_size=4)
+    client = ShortPageClient(query)
+    assert list(Db().iter_datastore_entries(client, {'status': 'success'}, 'Task', page_size=10)) == entries
+    assert query.fetches == 7
+    assert list(Db().iter_datastore_entries(client, {}, 'Task', page_size=10, limit=9)) == entries[:9]
+
+
+def test_parquet_write_task_entry_unindexed_properties():
+    """
+    this function will test that the nested task properties of a parquet_write task entity are not indexed, also
+    when the entity was read back without them excluded
+    :return: None
+    """
+    db = Db()
+    key = datastore.Key(db.parquet_write_namespace, 'task', project='test')
+    assert set(db.unindexed_task_properties) <= db.new_parquet_write_task_entry(key).exclude_from_indexes
+
+    task_entry = datastore.Entity(key=key)
+    db.fill_parquet_write_task_entry(task_entry, 'dag', 'run', 'merge', 'report.parquet', '2020-07-27', [], {},
+                                     'converted/report.parquet', None, None, 'success', 'output', 10, 10, 'sha',
+                                     'sales', 'MergeReportTask', {}, 'convert', 'job',
+                                     {'stage_metrics': {'parse': {'rows': 10}}, 'outputs': [], 'part_rows': [10],
+                                      'writer_profile': {'compression': 'snappy'}})
+    assert {'exception_details', 'stage_metrics', 'outputs', 'part_rows',
+            'writer_profile'} <= task_entry.exclude_from_indexes
+    assert 'status' not in task_entry.exclude_from_indexes
+
+
+def test_parquet_write_task_upsert_by_key():
+    """
+    this function will test that the parquet_write task of a dag run and airflow task is written under its key and
+    updated in place by the next run of the task
+    :return: None
+    """
+    db = Db()
+    client = InMemoryDatastore()
+    assert db.get_parquet_write_task_entry(client, 'dag6_id', 'run6_id', 'airflow_task_id') is None
+
+    db.handle_report_parquet_write_task(client, 'dag6_id', 'run6_id', 'merge6_id', 'outputfilename', '2020-07-27',
+                                        'column', 'columndatatype', 'output path', 'exception', 'exceptiondetails',
+                                        'fail', 'outbucketname', 10, 10, 'reporttype', 'kind', {}, 'airflow_task_id',
+                                        'job_id')
+    task = db.get_parquet_write_task_entry(client, 'dag6_id', 'run6_id', 'airflow_task_id')
+    assert task.get('status') == 'fail'
+    assert task.key == db.parquet_write_task_key(client, 'dag6_id', 'run6_id', 'airflow_task_id')
+
+    db.handle_report_parquet_write_task(client, 'dag6_id', 'run6_id', 'merge6_id', 'outputfilename', '2020-07-27',
+                                        'column', 'columndatatype', 'output path', None, '',
+                                        'success', 'outbucketname', 10, 10, 'reporttype', 'kind', {}, 'airflow_task_id',
+                                        'job_id')
+    updated_task = db.get_parquet_write_task_entry(client, 'dag6_id', 'run6_id', 'airflow_task_id')
+    assert updated_task.key == task.key
+    assert updated_task.get('status') == 'success'
+    assert len(client.entities_of(db.parquet_write_namespace)) == 1
+
+
+def put_legacy_task(client, airflow_task_id:str, status:str, modified_at:datetime.datetime):
+    """
+    this function writes a parquet_write task entity under an auto allocated id, like before the tasks were keyed
+    """
+    task_entry = datastore.Entity(key=client.key(Db.parquet_write_namespace))
+    task_entry.update({'dag_id': 'dag', 'run_id': 'run', 'airflow_task_id': airflow_task_id, 'status': status,
+                       'modified_at': modified_at})
+    client.put(task_entry)
+    return task_entry.key
+
+
+def test_migrate_parquet_write_task_keys():
+    """
+    this function will test that legacy task entities are re-keyed keeping the most recently modified one per task,
+    that an entity already written under the new key is kept and the legacy entities are deleted, and that a
+    second migration changes nothing
+    :return: None
+    """
+    db = Db()
+    client = InMemoryDatastore()
+    day = datetime.datetime(2020, 7, 27)
+    legacy_keys = [put_legacy_task(client, 'convert_sales', 'fail', day),
+                   put_legacy_task(client, 'convert_sales', 'success', day + datetime.timedelta(hours=1)),
+                   put_legacy_task(client, 'convert_returns', 'fail', day),
+                   put_legacy_task(client, 'convert_stock', 'fail', day)]
+    db.handle_report_parquet_write_task(client, 'dag', 'run', 'merge', 'stock.parquet', day, [], {}, 'stock',
+                                        None, '', 'success', 'output', 5, 5, 'stock', 'MergeReportTask', {},
+                                        'convert_stock', 'stock')
+
+    assert db.migrate_parquet_write_task_keys(client) == 2
+    assert not any(client.get(key) for key in legacy_keys)
+    tasks = {task['airflow_task_id']: task for task in client.entities_of(db.parquet_write_namespace)}
+    assert sorted(tasks) == ['convert_returns', 'convert_sales', 'convert_stock']
+    assert {name: task['status'] for name, task in tasks.items()} == {
+        'convert_returns': 'fail', 'convert_sales': 'success', 'convert_stock': 'success'}
+    for name, task in tasks.items():
+        assert task.key == db.parquet_write_task_key(client, 'dag', 'run', name)
+        assert 'stage_metrics' in task.exclude_from_indexes
+
+    snapshot = {key: dict(task) for key, task in client.entities.items()}
+    assert db.migrate_parquet_write_task_keys(client) == 0
+    assert {key: dict(task) for key, task in client.entities.items()} == snapshot
@@ -0,0 +1,34 @@
+"""
+Test file to test excel_writer.py
+"""
+import io
+
+import pandas as pd
+from openpyxl import load_workbook
+from parquet_write_automation.parquet_write.scripts.main.excel_writer import StreamingExcelWriter
+from parquet_write_automation.parquet_write.scripts.main.report_schema import ReportSchema
+
+
+def test_sheet_rollover_and_typed_cells():
+    """
+    this function will test that rows continue on a new sheet once a sheet is
+    full and that schema types are written as typed cells
+    :return: None
+    """
+    report_schema = ReportSchema(['day', 'qty'], {'day': 'date', 'qty': 'int64'})
+    output = io.BytesIO()
+    writer = StreamingExcelWriter(output, ['day', 'qty'], report_schema, max_rows_per_sheet=3)
+    writer.write_batch(pd.DataFrame({'day': ['2020-07-27', '2020-07-28', '2020-07-29'],
+                                     'qty': pd.array([1, None, 3], dtype='Int64')}))
+    assert writer.close() == 3
+
+    workbook = load_workbook(io.BytesIO(output.getvalue()))
+    assert workbook.sheetnames == ['Sheet1', 'Sheet2']
+    first_sheet = list(workbook['Sheet1'].values)
+    second_sheet = list(workbook['Sheet2'].values)
+    assert first_sheet[0] == ('day', 'qty')
+    assert len(first_sheet) == 3
+    assert second_sheet[0] == ('day', 'qty')
+    assert first_sheet[1][0].year == 2020 and first_sheet[1][1] == 1
+    assert first_sheet[2][1] is None
+    assert second_sheet[1][1] == 3
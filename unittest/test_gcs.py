@@ -1,7 +1,11 @@
 """
 Test file to test gcs.py
 """
+import base64
+
+import google_crc32c
 import pytest
+from parquet_write_automation.cloud.scripts.main.gcs import Gcs, DownloadError, UploadVerificationError
 from merge_automation.cloud.scripts.main.cloud import Cloud
 from merge_automation.cloud.scripts.main.cloud_factory import gcs
 
@@ -18,7 +22,7 @@ def test_invalid_path():
 
         
 def test_invalidJson():
-     """
+    """
     this function will test whether exception
     is thrown if we pass a file which is not JSON 
     :return: None
@@ -28,3 +32,199 @@ def test_invalidJson():
     with pytest.raises(json.JSONDecodeError):
         get_secrets(path)
 
+
+class FakeBlob:
+    """
+    in memory stand-in for google.cloud.storage.blob.Blob
+    """
+
+    def __init__(self, name, data, fail=False):
+        self.name = name
+        self.data = data
+        self.size = len(data)
+        self.generation = 1
+        self.fail = fail
+
+    def download_to_filename(self, file_name):
+        if self.fail:
+            raise IOError("download failed")
+        with open(file_name, 'wb') as fp:
+            fp.write(self.data)
+
+    def download_to_file(self, fp, start, end, if_generation_match=None):
+        if self.fail:
+            raise IOError("download failed")
+        fp.write(self.data[start:end + 1])
+
+
+def test_download_blobs_concurrently(tmp_path):
+    """
+    this function will test that sliced and whole file downloads are
+    reassembled correctly, returned in listing order and that a failing
+    file does not drop the files that were downloaded
+    :return: None
+    """
+    gcs = Gcs.__new__(Gcs)
+    blobs = [FakeBlob('A/1.txt', b'0123456789' * 10), FakeBlob('A/2.txt', b'abc'),
+             FakeBlob('A/3.txt', b'xyz', fail=True)]
+
+    with pytest.raises(DownloadError) as error:
+        gcs.download_blobs_concurrently(blobs, str(tmp_path), max_workers=4, slice_size=7)
+
+    assert error.value.downloaded_files == [str(tmp_path / 'A_1.txt'), str(tmp_path / 'A_2.txt')]
+    assert list(error.value.errors.keys()) == [str(tmp_path / 'A_3.txt')]
+    assert (tmp_path / 'A_1.txt').read_bytes() == b'0123456789' * 10
+    assert (tmp_path / 'A_2.txt').read_bytes() == b'abc'
+    assert not (tmp_path / 'A_3.txt').exists()
+
+
+class FakeListingClient:
+    """
+    storage client whose list_blobs returns fixed blobs, unsorted like a paged listing may be
+    """
+
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.delimiter = None
+
+    def list_blobs(self, bucket_or_name, prefix, delimiter=None):
+        self.delimiter = delimiter
+        return iter(self.blobs)
+
+
+def test_list_files():
+    """
+    this function will test that the part files under a prefix are listed
+    in name order without the folder placeholder objects
+    :return: None
+    """
+    gcs = Gcs()
+    gcs._client = FakeListingClient([FakeBlob('A/part-2.csv', b''), FakeBlob('A/', b''),
+                                     FakeBlob('A/part-1.csv', b'')])
+
+    assert [blob.name for blob in gcs.list_files('A/', 'bucket')] == ['A/part-1.csv', 'A/part-2.csv']
+    assert gcs._client.delimiter == '/'
+    gcs.list_files('A/', 'bucket', recursive=True)
+    assert gcs._client.delimiter is None
+
+
+class FakeComposeBlob:
+    """
+    in memory stand-in for the blob methods used by upload_composite
+    """
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.size = None
+        self.crc32c = None
+
+    def upload_from_file(self, fp, size, checksum=None):
+        # temporary part names end with the part number
+        if self.name[-5:] in self.bucket.failing_parts:
+            raise IOError("upload failed")
+        self.bucket.objects[self.name] = fp.read(size)
+
+    def compose(self, sources):
+        assert len(sources) <= Gcs.max_compose_sources
+        self.bucket.compose_calls.append(len(sources))
+        data = b''.join(self.bucket.objects[source.name] for source in sources)
+        self.bucket.objects[self.name] = data[:-1] if self.bucket.corrupt_compose else data
+
+    def reload(self):
+        data = self.bucket.objects[self.name]
+        self.size = len(data)
+        self.crc32c = base64.b64encode(google_crc32c.Checksum(data).digest()).decode('utf-8')
+
+
+class FakeComposeBucket:
+    """
+    in memory bucket recording the compose calls and deleting objects like delete_blobs
+    """
+
+    def __init__(self, corrupt_compose=False, failing_parts=()):
+        self.objects = {}
+        self.compose_calls = []
+        self.corrupt_compose = corrupt_compose
+        self.failing_parts = set(failing_parts)
+
+    def blob(self, name):
+        return FakeComposeBlob(self, name)
+
+    def copy_blob(self, blob, destination_bucket, new_name):
+        destination_bucket.objects[new_name] = self.objects[blob.name]
+
+    def delete_blobs(self, blobs, on_error=None):
+        for blob in blobs:
+            if self.objects.pop(blob.name, None) is None and on_error is not None:
+                on_error(blob)
+
+
+class FakeBucketClient:
+
+    def __init__(self, bucket):
+        self._bucket = bucket
+
+    def bucket(self, bucket_name):
+        return self._bucket
+
+
+def composite_gcs(bucket):
+    gcs = Gcs()
+    gcs._client = FakeBucketClient(bucket)
+    return gcs
+
+
+def test_upload_composite_levels(tmp_path):
+    """
+    this function will test that a file of more parts than compose accepts is
+    composed in levels into the object and the temporary objects are deleted
+    :return: None
+    """
+    data = bytes(range(256)) * 4
+    local_file = tmp_path / 'report.parquet'
+    local_file.write_bytes(data)
+    bucket = FakeComposeBucket()
+
+    composite_gcs(bucket).upload_composite(str(local_file), 'bucket', 'out/report.parquet', part_size=10,
+                                           max_workers=4)
+
+    # 103 parts are composed into 4 intermediate objects, which are composed into the object
+    assert bucket.compose_calls == [32, 32, 32, 7, 4]
+    assert bucket.objects == {'out/report.parquet': data}
+
+
+def test_upload_composite_verification(tmp_path):
+    """
+    this function will test that a composed object whose size and crc32c do
+    not match the local file raises UploadVerificationError, keeps the
+    previous object and the temporary objects are deleted
+    :return: None
+    """
+    local_file = tmp_path / 'report.parquet'
+    local_file.write_bytes(b'0123456789' * 10)
+    bucket = FakeComposeBucket(corrupt_compose=True)
+    bucket.objects['out/report.parquet'] = b'previous'
+
+    with pytest.raises(UploadVerificationError):
+        composite_gcs(bucket).upload_composite(str(local_file), 'bucket', 'out/report.parquet', part_size=30,
+                                               max_workers=2)
+    assert bucket.objects == {'out/report.parquet': b'previous'}
+
+
+def test_upload_composite_failed_part(tmp_path):
+    """
+    this function will test that a failing part upload is raised, nothing is
+    composed and the parts already uploaded are deleted
+    :return: None
+    """
+    local_file = tmp_path / 'report.parquet'
+    local_file.write_bytes(b'0123456789' * 10)
+    bucket = FakeComposeBucket(failing_parts=['00002'])
+
+    with pytest.raises(IOError):
+        composite_gcs(bucket).upload_composite(str(local_file), 'bucket', 'out/report.parquet', part_size=30,
+                                               max_workers=2)
+    assert bucket.compose_calls == []
+    assert bucket.objects == {}
+
@@ -0,0 +1,23 @@
+"""
+Test file to test lazy_import.py
+"""
+import sys
+
+from parquet_write_automation.common.scripts.main.lazy_import import LazyModule, lazy_import
+
+
+def test_module_is_imported_on_first_use():
+    """
+    this function will test that a lazily imported module is only imported
+    when one of its attributes is used, and that imported modules are
+    returned as is
+    :return: None
+    """
+    sys.modules.pop('colorsys', None)
+    colorsys = lazy_import('colorsys')
+    assert isinstance(colorsys, LazyModule)
+    assert 'colorsys' not in sys.modules
+
+    assert colorsys.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert 'colorsys' in sys.modules
+    assert lazy_import('colorsys') is sys.modules['colorsys']
@@ -0,0 +1,111 @@
+"""
+Test file to test local_storage.py
+"""
+import os
+
+from parquet_write_automation.cloud.scripts.main.local_storage import LocalStorage, copy_file
+
+
+def test_upload_download_and_prefix_listing(tmp_path):
+    """
+    this function will test that files put into the local storage can be
+    listed by prefix and downloaded like with Gcs
+    :return: None
+    """
+    storage = LocalStorage(str(tmp_path / 'storage'))
+    local_file = tmp_path / 'report.csv'
+    local_file.write_bytes(b'a|b\n1|2\n')
+
+    storage.upload_file(str(local_file), 'bucket', 'A/B/1.csv')
+    storage.upload_file(str(local_file), 'bucket', 'A/B/2.csv')
+    storage.upload_file(str(local_file), 'bucket', 'A/B/C/3.csv')
+
+    assert [blob.name for blob in storage.list_files('A/B/', 'bucket')] == ['A/B/1.csv', 'A/B/2.csv']
+    assert len(storage.list_files('A/', 'bucket', recursive=True)) == 3
+
+    downloaded = storage.download_files('A/B/', 'bucket', str(tmp_path / 'download'))
+    assert downloaded == [str(tmp_path / 'download' / 'A_B_1.csv'), str(tmp_path / 'download' / 'A_B_2.csv')]
+    assert open(downloaded[0], 'rb').read() == b'a|b\n1|2\n'
+    assert storage.client.bucket('bucket').get_blob('A/B/missing.csv') is None
+
+
+def test_copy_file(tmp_path):
+    """
+    this function will test the copy used by uploads and downloads
+    :return: None
+    """
+    source = tmp_path / 'source'
+    source.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    copy_file(str(source), str(tmp_path / 'copy'))
+    assert (tmp_path / 'copy').read_bytes() == source.read_bytes()
+
+
+def test_streamed_write_replaces_object(tmp_path):
+    """
+    this function will test that a streamed write replaces the object instead
+    of rewriting it in place, and that a failed stream keeps the previous
+    object
+    :return: None
+    """
+    storage = LocalStorage(str(tmp_path / 'storage'))
+    blob = storage.client.bucket('bucket').blob('A/report.csv')
+    blob.upload_from_string(b'old\n')
+    downloaded = storage.download_file('A/report.csv', 'bucket', str(tmp_path / 'download'))
+
+    with blob.open('wb') as fp:
+        fp.write(b'new\n')
+    assert open(blob.path, 'rb').read() == b'new\n'
+    assert open(downloaded, 'rb').read() == b'old\n'
+
+    try:
+        with blob.open('wb') as fp:
+            fp.write(b'partial')
+            raise RuntimeError("stream failed")
+    except RuntimeError:
+        pass
+    assert open(blob.path, 'rb').read() == b'new\n'
+    assert os.listdir(os.path.dirname(blob.path)) == ['report.csv']
+
+
+def test_local_files_rewritten_in_place(tmp_path):
+    """
+    this function will test that rewriting an uploaded or downloaded local
+    file in place does not change the stored object
+    :return: None
+    """
+    storage = LocalStorage(str(tmp_path / 'storage'))
+    local_file = tmp_path / 'report.csv'
+    local_file.write_bytes(b'a|b\n1|2\n')
+    storage.upload_file(str(local_file), 'bucket', 'A/report.csv')
+    with open(str(local_file), 'wb') as fp:
+        fp.write(b'rewritten')
+    blob = storage.client.bucket('bucket').get_blob('A/report.csv')
+    assert open(blob.path, 'rb').read() == b'a|b\n1|2\n'
+
+    downloaded = storage.download_file('A/report.csv', 'bucket', str(tmp_path / 'download'))
+    with open(downloaded, 'r+b') as fp:
+        fp.truncate(0)
+    assert open(blob.path, 'rb').read() == b'a|b\n1|2\n'
+
+
+def test_listing_with_delimiter_reads_one_directory(tmp_path, monkeypatch):
+    """
+    this function will test that a listing with delimiter does not descend
+    into the sub directories of the prefix
+    :return: None
+    """
+    storage = LocalStorage(str(tmp_path / 'storage'))
+    for name in ('A/1.csv', 'A/B/2.csv', 'A/B/C/3.csv'):
+        storage.client.bucket('bucket').blob(name).upload_from_string(b'x')
+    walked = []
+    walk = os.walk
+
+    def recording_walk(top, *args, **kwargs):
+        for entry in walk(top, *args, **kwargs):
+            walked.append(entry[0])
+            yield entry
+
+    monkeypatch.setattr(os, 'walk', recording_walk)
+    assert [blob.name for blob in storage.list_files('A/', 'bucket')] == ['A/1.csv']
+    assert walked == [str(tmp_path / 'storage' / 'bucket' / 'A')]
+    assert len(storage.list_files('A/', 'bucket', recursive=True)) == 3
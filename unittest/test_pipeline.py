@@ -0,0 +1,116 @@
+"""
+Test file to test pipeline.py
+"""
+import asyncio
+import datetime
+import json
+import os
+
+import pyarrow.parquet as pq
+from google.cloud import datastore
+
+from benchmark.fakes import InMemoryDatastore, fake_parquet_write
+from parquet_write_automation.parquet_write.scripts.main.pipeline import StagedBytesBudget, ReportPipeline
+
+
+def test_byte_budget_backpressure():
+    """
+    this function will test that the byte budget holds back an acquire
+    until enough bytes are released, and admits an oversized acquire once
+    the budget is empty
+    :return: None
+    """
+    async def run():
+        budget = StagedBytesBudget(100)
+        await budget.acquire(60)
+        waiting = asyncio.ensure_future(budget.acquire(60))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        await budget.release(60)
+        await asyncio.wait_for(waiting, 1)
+        assert budget.used == 60
+
+        oversized = asyncio.ensure_future(budget.acquire(500))
+        await budget.release(60)
+        await asyncio.wait_for(oversized, 1)
+        assert budget.used == 500
+
+    asyncio.run(run())
+
+
+def test_pipeline_run(tmp_path, monkeypatch):
+    """
+    this function will test a job converted by the three stages and a job
+    converted whole (partition_by) on the local storage backend
+    :return: None
+    """
+    storage_root = str(tmp_path / 'storage')
+    # the conversion processes create their own LocalStorage from the environment
+    monkeypatch.setenv('LOCAL_STORAGE_ROOT', storage_root)
+    parquet_write = fake_parquet_write(storage_root, InMemoryDatastore())
+    jobs = []
+    for name in ('plain', 'partitioned'):
+        report = parquet_write.storage_client.bucket('input').blob('merged/{}.csv'.format(name)).path
+        os.makedirs(os.path.dirname(report), exist_ok=True)
+        with open(report, 'w') as fp:
+            fp.writelines('{}|{}\n'.format(row % 3, row) for row in range(50))
+        merge_entry = datastore.Entity(key=parquet_write.datastore_client.key('MergeReportTask', name))
+        merge_entry.update({'status': 'success', 'report_type': name, 'bucket': 'input',
+                            'path': 'merged/{}.csv'.format(name), 'row_count': 50})
+        parquet_write.datastore_client.put(merge_entry)
+        jobs.append({'dag_id': 'dag', 'run_id': 'run', 'report_date': datetime.datetime(2020, 7, 27),
+                     'output_file_name': name + '.parquet', 'output_bucket': 'output', 'output_path': 'converted',
+                     'output_format': 'parquet', 'column_name_for_report': ['store', 'sales'],
+                     'column_data_type_for_report': {'store': 'int64', 'sales': 'int64'}, 'report_type': name,
+                     'kind': 'MergeReportTask', 'input_path_field_name': 'path', 'filter_map': {'report_type': name},
+                     'input_bucket_field_name': 'bucket', 'row_count_field_name': 'row_count',
+                     'airflow_task_id': name, 'delimiter': '|'})
+    jobs[1]['partition_by'] = ['store']
+
+    results = ReportPipeline(parquet_write, max_conversions=2, work_dir=str(tmp_path / 'work')).run(jobs)
+    assert [(result['status'], result['total_row'], result['exception']) for result in results] == \
+        [('success', 50, None), ('success', 50, None)]
+    output = parquet_write.storage_client.bucket('output')
+    assert pq.read_table(output.get_blob('converted/plain.parquet').path).num_rows == 50
+    manifest = json.loads(open(output.get_blob('converted/partitioned.parquet/_SUCCESS').path).read())
+    assert manifest['total_rows'] == 50
+    assert len(manifest['files']) == 3
+
+
+def test_pipeline_uploads_to_planned_output(tmp_path, monkeypatch):
+    """
+    this function will test that the upload stage puts the staged output at
+    the output file path and bucket of the plan
+    :return: None
+    """
+    storage_root = str(tmp_path / 'storage')
+    monkeypatch.setenv('LOCAL_STORAGE_ROOT', storage_root)
+    parquet_write = fake_parquet_write(storage_root, InMemoryDatastore())
+    report = parquet_write.storage_client.bucket('input').blob('merged/plain.csv').path
+    os.makedirs(os.path.dirname(report), exist_ok=True)
+    with open(report, 'w') as fp:
+        fp.writelines('{}|{}\n'.format(row % 3, row) for row in range(50))
+    merge_entry = datastore.Entity(key=parquet_write.datastore_client.key('MergeReportTask', 'plain'))
+    merge_entry.update({'status': 'success', 'report_type': 'plain', 'bucket': 'input',
+                        'path': 'merged/plain.csv', 'row_count': 50})
+    parquet_write.datastore_client.put(merge_entry)
+    job = {'dag_id': 'dag', 'run_id': 'run', 'report_date': datetime.datetime(2020, 7, 27),
+           'output_file_name': 'plain.parquet', 'output_bucket': 'output', 'output_path': 'converted',
+           'output_format': 'parquet', 'column_name_for_report': ['store', 'sales'],
+           'column_data_type_for_report': {'store': 'int64', 'sales': 'int64'}, 'report_type': 'plain',
+           'kind': 'MergeReportTask', 'input_path_field_name': 'path', 'filter_map': {'report_type': 'plain'},
+           'input_bucket_field_name': 'bucket', 'row_count_field_name': 'row_count',
+           'airflow_task_id': 'plain', 'delimiter': '|'}
+    plan_merge_conversions = parquet_write.plan_merge_conversions
+
+    def planned_elsewhere(*args):
+        plans, conversions = plan_merge_conversions(*args)
+        plans[0].update({'output_bucket': 'planned', 'output_file_path': 'elsewhere/plain.parquet'})
+        return plans, conversions
+
+    monkeypatch.setattr(parquet_write, 'plan_merge_conversions', planned_elsewhere)
+    results = ReportPipeline(parquet_write, max_conversions=1, work_dir=str(tmp_path / 'work')).run([job])
+    assert results[0]['status'] == 'success'
+    assert pq.read_table(parquet_write.storage_client.bucket('planned').get_blob(
+        'elsewhere/plain.parquet').path).num_rows == 50
+    assert parquet_write.storage_client.bucket('output').get_blob('converted/plain.parquet') is None
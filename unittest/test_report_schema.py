@@ -0,0 +1,61 @@
+"""
+Test file to test report_schema.py
+"""
+import datetime
+import decimal
+
+import pandas as pd
+import pyarrow as pa
+from parquet_write_automation.parquet_write.scripts.main.report_schema import ReportSchema
+
+
+def test_compiled_types():
+    """
+    this function will test that the report types are read as strings and
+    parsed into typed arrow columns while pandas dtypes are kept
+    :return: None
+    """
+    report_schema = ReportSchema(['sold_at', 'day', 'price', 'store', 'qty', 'units', 'name'],
+                                 {'sold_at': {'type': 'timestamp', 'format': '%d/%m/%Y %H:%M', 'unit': 'ms',
+                                              'timezone': 'UTC'},
+                                  'day': 'date', 'price': 'decimal(10,2)', 'store': 'dictionary', 'qty': 'Int64',
+                                  'units': 'int64', 'name': 'str'})
+    assert report_schema.read_dtypes == {'sold_at': 'str', 'day': 'str', 'price': 'str', 'store': 'str',
+                                         'qty': 'Int64', 'units': 'int64', 'name': 'str'}
+
+    df = pd.DataFrame({'sold_at': ['27/07/2020 10:30', None], 'day': ['2020-07-27', '2020-07-28'],
+                       'price': ['1.50', '2.25'], 'store': ['A', 'A'], 'qty': pd.array([1, None], dtype='Int64'),
+                       'units': [3, 4], 'name': ['x', 'y']})
+    table = report_schema.to_table(df)
+
+    assert table.schema.field('sold_at').type == pa.timestamp('ms', 'UTC')
+    assert table.schema.field('day').type == pa.date32()
+    assert table.schema.field('price').type == pa.decimal128(10, 2)
+    assert table.schema.field('store').type == pa.dictionary(pa.int32(), pa.string())
+    assert table.schema.field('qty').type == pa.int64()
+    assert table.schema.field('units').type == pa.int64()
+    assert table.column('sold_at').to_pylist()[0] == datetime.datetime(2020, 7, 27, 10, 30,
+                                                                       tzinfo=datetime.timezone.utc)
+    assert table.column('sold_at').null_count == 1
+    assert table.column('price').to_pylist() == [decimal.Decimal('1.50'), decimal.Decimal('2.25')]
+    assert table.column('qty').to_pylist() == [1, None]
+
+
+def test_mixed_case_types():
+    """
+    this function will test that type names are matched case insensitively while the timezone keeps its case
+    :return: None
+    """
+    report_schema = ReportSchema(['sold_at', 'local_at', 'day', 'price'],
+                                 {'sold_at': 'Timestamp[ms, UTC]', 'local_at': 'TIMESTAMP[S, America/Mexico_City]',
+                                  'day': 'Date', 'price': 'Decimal(10, 2)'})
+    assert report_schema.arrow_types == {'sold_at': pa.timestamp('ms', 'UTC'),
+                                         'local_at': pa.timestamp('s', 'America/Mexico_City'),
+                                         'day': pa.date32(), 'price': pa.decimal128(10, 2)}
+
+    df = pd.DataFrame({'sold_at': ['2020-07-27 10:30:00'], 'local_at': ['2020-07-27 10:30:00'],
+                       'day': ['2020-07-27'], 'price': ['1.50']})
+    table = report_schema.to_table(df)
+    assert table.schema.field('local_at').type == pa.timestamp('s', 'America/Mexico_City')
+    assert table.column('sold_at').to_pylist()[0] == datetime.datetime(2020, 7, 27, 10, 30,
+                                                                       tzinfo=datetime.timezone.utc)
@@ -0,0 +1,40 @@
+"""
+Test file to test report_splitter.py
+"""
+from parquet_write_automation.parquet_write.scripts.main.report_splitter import find_record_ranges
+
+
+def split(tmp_path, data, parts, scan_chunk_size=64 * 1024 * 1024):
+    report = tmp_path / 'report.csv'
+    report.write_bytes(data)
+    ranges = find_record_ranges(str(report), parts, scan_chunk_size=scan_chunk_size)
+    return [data[start:end] for start, end in ranges]
+
+
+def test_find_record_ranges(tmp_path):
+    """
+    this function will test that the ranges cover the report in order and end on records
+    :return: None
+    """
+    data = b''.join(b'%d|row %d\n' % (index, index) for index in range(1000))
+    pieces = split(tmp_path, data, 7)
+    assert len(pieces) == 7
+    assert b''.join(pieces) == data
+    assert all(piece.endswith(b'\n') for piece in pieces)
+    assert split(tmp_path, data[:-1], 7)[-1].endswith(b'\n999|row 999')
+    assert split(tmp_path, b'', 7) == []
+
+
+def test_find_record_ranges_quoted_newlines(tmp_path):
+    """
+    this function will test that no range starts inside a quoted field holding newlines
+    :return: None
+    """
+    record = b'1|"line\none\n""two""\nthree"|x\n'
+    data = record * 200
+    for scan_chunk_size in (1, 5, 1024):
+        pieces = split(tmp_path, data, 9, scan_chunk_size=scan_chunk_size)
+        assert b''.join(pieces) == data
+        assert all(len(piece) % len(record) == 0 for piece in pieces)
+    # one record can not be split
+    assert split(tmp_path, record, 4) == [record]
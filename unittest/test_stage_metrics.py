@@ -0,0 +1,58 @@
+"""
+Test file to test stage_metrics.py
+"""
+from parquet_write_automation.parquet_write.scripts.main.stage_metrics import StageMetrics
+
+
+class RecordingHook:
+    """
+    hook remembering the notifications it got
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def stage_started(self, stage):
+        self.events.append(('started', stage))
+
+    def stage_finished(self, stage, record):
+        self.events.append(('finished', stage, record['calls']))
+
+
+def test_stages_accumulate_and_notify_hooks():
+    """
+    this function will test that repeated entries of a stage add up and
+    that hooks are notified around every entry
+    :return: None
+    """
+    hook = RecordingHook()
+    metrics = StageMetrics([hook])
+    for batch in metrics.iterate('parse', [[1, 2], [3]]):
+        with metrics.stage('encode', rows=len(batch)):
+            pass
+    with metrics.stage('upload') as counts:
+        counts['bytes'] = 100
+
+    stages = metrics.to_dict()
+    assert stages['parse']['rows'] == 3
+    # the last next() which ends the iteration is timed as well
+    assert stages['parse']['calls'] == 3
+    assert stages['encode']['rows'] == 3 and stages['encode']['calls'] == 2
+    assert stages['upload']['bytes'] == 100
+    assert stages['upload']['peak_rss_bytes'] > 0
+    assert hook.events[:2] == [('started', 'parse'), ('finished', 'parse', 1)]
+
+
+def test_prometheus_textfile(tmp_path):
+    """
+    this function will test the prometheus text format of the metrics
+    :return: None
+    """
+    metrics = StageMetrics()
+    metrics.add('download', 2.0, bytes_=10)
+    path = tmp_path / 'parquet_write.prom'
+    metrics.write_prometheus_textfile(str(path), dag_id='pos')
+
+    lines = path.read_text().splitlines()
+    assert 'parquet_write_stage_seconds{dag_id="pos",stage="download"} 2.0' in lines
+    assert 'parquet_write_stage_bytes_per_sec{dag_id="pos",stage="download"} 5.0' in lines
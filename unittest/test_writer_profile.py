@@ -0,0 +1,61 @@
+"""
+Test file to test writer_profile.py
+"""
+import pyarrow as pa
+import pytest
+
+from parquet_write_automation.parquet_write.scripts.main.writer_profile import ParquetWriterProfile, \
+    candidate_data_page_sizes, choose_profile, layout_profiles, row_group_rows
+
+
+def sample_table(rows=20000):
+    return pa.table({'store': ['store_{}'.format(row % 10) for row in range(rows)],
+                     'qty': pa.array([row % 97 for row in range(rows)], type=pa.int64())})
+
+
+def test_row_group_rows():
+    """
+    this function will test that the rows of a row group follow the width of the sample rows
+    :return: None
+    """
+    sample = sample_table()
+    rows = row_group_rows(sample, row_group_bytes=sample.nbytes)
+    assert rows == sample.num_rows
+    assert row_group_rows(sample, row_group_bytes=2 * sample.nbytes) == 2 * rows
+    assert row_group_rows(sample, row_group_bytes=1) == 1
+    assert row_group_rows(sample.slice(0, 0)) is None
+
+
+def test_layout_profiles():
+    """
+    this function will test that the layout candidates keep the codec and encodings and vary the data page size
+    :return: None
+    """
+    sample = sample_table()
+    profile = ParquetWriterProfile('zstd', compression_level=3, use_dictionary=['store'])
+    profiles = layout_profiles(sample, profile)
+    assert [candidate.data_page_size for candidate in profiles] == list(candidate_data_page_sizes)
+    for candidate in profiles:
+        assert candidate.row_group_size == row_group_rows(sample)
+        assert (candidate.compression, candidate.compression_level, candidate.use_dictionary) == \
+               ('zstd', 3, ['store'])
+
+
+@pytest.mark.parametrize('objective', ['size', 'speed'])
+def test_choose_profile(objective):
+    """
+    this function will test that the auto mode returns a layout candidate of one of the codec candidates and
+    that given candidates are compared as they are
+    :return: None
+    """
+    sample = sample_table()
+    profile = choose_profile(sample, objective)
+    assert profile.compression in ('snappy', 'lz4', 'zstd')
+    assert profile.data_page_size in candidate_data_page_sizes
+    assert profile.row_group_size == row_group_rows(sample)
+
+    candidates = [ParquetWriterProfile('none'), ParquetWriterProfile('zstd', compression_level=9)]
+    chosen = choose_profile(sample, 'size', candidates)
+    assert chosen is candidates[1]
+    with pytest.raises(ValueError):
+        choose_profile(sample, 'smallest')